@@ -0,0 +1,302 @@
+
+from __future__ import annotations
+
+import json
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+USER_BASE = 10**9
+TWEET_BASE = 10**15
+
+# requests allowed per 15 minutes window, as documented for the v2 endpoints
+REAL_RATE_LIMITS: dict[str, int] = {
+	"get_users_followers": 15,
+	"get_users_tweets": 900,
+	"get_user": 900,
+	"get_users": 900,
+	"get_tweet": 900,
+	"get_tweets": 900,
+}
+RATE_LIMIT_WINDOW = 15*60.0
+ENDPOINTS = tuple(REAL_RATE_LIMITS)
+
+_username_pattern = re.compile(r"user(\d+)")
+
+@dataclass
+class GraphShape:
+
+	users: int = 10_000
+	followers_mean: float = 20.0
+	tweets_per_user: int = 10
+	on_topic_users: float = 0.2 # fraction of users who tweet about the keyword at all
+	on_topic_tweets: float = 0.3 # fraction of an on topic user's tweets containing the keyword
+	mentions_mean: float = 1.0
+	retweet_rate: float = 0.1
+	keyword: str = "benchmark"
+	seed: int = 0
+
+class SocialGraph:
+	"""Deterministic synthetic graph, generated lazily so its size costs no memory"""
+
+	def __init__(self, shape: GraphShape):
+
+		self.shape = shape
+
+	def _rng(self, kind: int, index: int) -> random.Random:
+		return random.Random((self.shape.seed*1_000_003 + index)*8 + kind)
+
+	def user_id(self, index: int) -> int:
+		return USER_BASE + index
+
+	def user_index(self, user_id: Any) -> Optional[int]:
+
+		index = int(user_id) - USER_BASE
+		return index if 0 <= index < self.shape.users else None
+
+	def username(self, index: int) -> str:
+		return f"User{index}"
+
+	def username_index(self, username: str) -> Optional[int]:
+
+		if (match := _username_pattern.fullmatch(username.lower())) is None:
+			return None
+
+		index = int(match.group(1))
+		return index if index < self.shape.users else None
+
+	def is_on_topic(self, index: int) -> bool:
+		return self._rng(0, index).random() < self.shape.on_topic_users
+
+	def followers(self, index: int) -> list[int]:
+
+		rng = self._rng(1, index)
+		amount = min(self.shape.users - 1, int(rng.expovariate(1/self.shape.followers_mean)))
+		followers = (rng.randrange(self.shape.users) for _ in range(amount))
+		return list(dict.fromkeys(self.user_id(follower) for follower in followers if follower != index))
+
+	def user_data(self, index: int) -> dict:
+
+		return {
+			"id": str(self.user_id(index)),
+			"name": f"Synthetic user {index}",
+			"username": self.username(index),
+			"public_metrics": {
+				"followers_count": len(self.followers(index)),
+				"following_count": 0,
+				"tweet_count": self.shape.tweets_per_user,
+				"listed_count": 0,
+			},
+		}
+
+	def tweet_ids(self, index: int) -> list[int]:
+
+		first = TWEET_BASE + index*self.shape.tweets_per_user
+		return list(range(first + self.shape.tweets_per_user - 1, first - 1, -1))
+
+	def tweet_index(self, tweet_id: Any) -> Optional[int]:
+
+		index = int(tweet_id) - TWEET_BASE
+		return index if 0 <= index < self.shape.users*self.shape.tweets_per_user else None
+
+	def tweet_data(self, tweet_index: int) -> dict:
+
+		rng = self._rng(2, tweet_index)
+		author = tweet_index//self.shape.tweets_per_user
+		words = [f"word{rng.randrange(1000)}" for _ in range(rng.randrange(5, 20))]
+
+		if self.is_on_topic(author) and rng.random() < self.shape.on_topic_tweets:
+			words.insert(rng.randrange(len(words)), self.shape.keyword)
+
+		mentions = []
+
+		for _ in range(min(10, int(rng.expovariate(1/self.shape.mentions_mean)) if self.shape.mentions_mean > 0 else 0)):
+			username = self.username(rng.randrange(self.shape.users))
+			mentions.append({"start": 0, "end": len(username) + 1, "username": username})
+			words.insert(0, f"@{username}")
+
+		data: dict = {
+			"id": str(TWEET_BASE + tweet_index),
+			"text": " ".join(words),
+			"author_id": str(self.user_id(author)),
+		}
+
+		if mentions:
+			data["entities"] = {"mentions": mentions}
+
+		if rng.random() < self.shape.retweet_rate:
+			data["referenced_tweets"] = [{"type": "retweeted", "id": str(TWEET_BASE + rng.randrange(self.shape.users*self.shape.tweets_per_user))}]
+
+		return data
+
+class FakeResponse:
+	"""Stands for requests.Response, as returned by tweepy.Client(return_type=requests.Response)"""
+
+	def __init__(self, payload: dict, status_code: int = 200):
+
+		self.status_code = status_code
+		self.content = json.dumps(payload).encode(encoding="utf-8")
+
+	def json(self) -> Any:
+		return json.loads(self.content)
+
+def _not_found(value: Any) -> dict:
+	return {"value": str(value), "title": "Not Found Error", "type": "https://api.twitter.com/2/problems/resource-not-found"}
+
+class FakeTwitterClient:
+	"""Local replacement for tweepy.Client backed by a SocialGraph
+
+	rate_limits maps endpoints to the amount of calls allowed per window.
+	When a limit is hit the client sleeps until the window resets, like
+	tweepy does with wait_on_rate_limit=True; time_scale shrinks both the
+	window and that sleep so limited runs stay short.
+
+	shared_calls, a multiprocessing.Array("q", len(ENDPOINTS)), lets clients
+	living in worker processes report their calls to the benchmark."""
+
+	def __init__(self,
+		graph: SocialGraph,
+		latency: float = 0.0,
+		jitter: float = 0.0,
+		rate_limits: Optional[dict[str, int]] = None,
+		time_scale: float = 1.0,
+		shared_calls: Any = None):
+
+		self.graph = graph
+		self.latency = latency
+		self.jitter = jitter
+		self.rate_limits = rate_limits or {}
+		self.time_scale = time_scale
+		self.shared_calls = shared_calls
+		self.calls: Counter[str] = Counter()
+		self.rate_limited: Counter[str] = Counter()
+		self.waited: float = 0.0
+		self._windows: dict[str, tuple[float, int]] = {}
+		self._rng = random.Random(graph.shape.seed)
+
+	def _call(self, endpoint: str):
+
+		self.calls[endpoint] += 1
+
+		if self.shared_calls is not None:
+			with self.shared_calls.get_lock():
+				self.shared_calls[ENDPOINTS.index(endpoint)] += 1
+
+		if endpoint in self.rate_limits:
+
+			now = time.monotonic()
+			window = RATE_LIMIT_WINDOW*self.time_scale
+			start, used = self._windows.get(endpoint, (now, 0))
+
+			if now - start >= window:
+				start, used = now, 0
+
+			if used >= self.rate_limits[endpoint]:
+
+				self.rate_limited[endpoint] += 1
+				wait = start + window - now
+				self.waited += wait
+				time.sleep(wait)
+				start, used = time.monotonic(), 0
+
+			self._windows[endpoint] = (start, used + 1)
+
+		if self.latency or self.jitter:
+			time.sleep(self.latency + self._rng.random()*self.jitter)
+
+	def get_user(self, *, id: Any = None, username: Optional[str] = None, **kwargs) -> FakeResponse:
+
+		self._call("get_user")
+		index = self.graph.user_index(id) if username is None else self.graph.username_index(username)
+
+		if index is None:
+			return FakeResponse({"errors": [_not_found(id if username is None else username)]})
+
+		return FakeResponse({"data": self.graph.user_data(index)})
+
+	def get_users(self, *, ids: Optional[Iterable[Any]] = None, usernames: Optional[Iterable[str]] = None, **kwargs) -> FakeResponse:
+
+		self._call("get_users")
+		data, errors = [], []
+
+		for value in (ids if usernames is None else usernames) or ():
+
+			index = self.graph.user_index(value) if usernames is None else self.graph.username_index(str(value))
+
+			if index is None:
+				errors.append(_not_found(value))
+
+			else:
+				data.append(self.graph.user_data(index))
+
+		payload: dict = {"data": data} if data else {}
+
+		if errors:
+			payload["errors"] = errors
+
+		return FakeResponse(payload)
+
+	def get_users_followers(self, id: Any, *, pagination_token: Optional[str] = None, max_results: int = 100, **kwargs) -> FakeResponse:
+
+		self._call("get_users_followers")
+
+		if (index := self.graph.user_index(id)) is None:
+			return FakeResponse({"errors": [_not_found(id)]})
+
+		followers = self.graph.followers(index)
+		offset = int(pagination_token or 0)
+		page = followers[offset:offset + max_results]
+		meta: dict = {"result_count": len(page)}
+
+		if offset + max_results < len(followers):
+			meta["next_token"] = str(offset + max_results)
+
+		payload: dict = {"meta": meta}
+
+		if page:
+			payload["data"] = [self.graph.user_data(follower - USER_BASE) for follower in page]
+
+		return FakeResponse(payload)
+
+	def get_users_tweets(self, id: Any, *, max_results: int = 10, **kwargs) -> FakeResponse:
+
+		self._call("get_users_tweets")
+
+		if (index := self.graph.user_index(id)) is None:
+			return FakeResponse({"errors": [_not_found(id)]})
+
+		tweet_ids = self.graph.tweet_ids(index)[:max_results]
+		data = [self.graph.tweet_data(tweet_id - TWEET_BASE) for tweet_id in tweet_ids]
+		return FakeResponse({"data": data, "meta": {"result_count": len(data)}})
+
+	def get_tweet(self, id: Any, **kwargs) -> FakeResponse:
+
+		self._call("get_tweet")
+
+		if (index := self.graph.tweet_index(id)) is None:
+			return FakeResponse({"errors": [_not_found(id)]})
+
+		return FakeResponse({"data": self.graph.tweet_data(index)})
+
+	def get_tweets(self, ids: Iterable[Any], **kwargs) -> FakeResponse:
+
+		self._call("get_tweets")
+		data, errors = [], []
+
+		for id in ids:
+
+			if (index := self.graph.tweet_index(id)) is None:
+				errors.append(_not_found(id))
+
+			else:
+				data.append(self.graph.tweet_data(index))
+
+		payload: dict = {"data": data} if data else {}
+
+		if errors:
+			payload["errors"] = errors
+
+		return FakeResponse(payload)
@@ -0,0 +1,222 @@
+
+"""End-to-end crawl benchmark against a synthetic Twitter API
+
+Runs the regular plugins in a scratch directory, with tweepy.Client replaced
+by benchmark.fake_twitter.FakeTwitterClient, and prints a JSON report.
+
+	python -m benchmark.harness --users 20000 --seed-users 20 --max-seconds 60
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+started = time.perf_counter()
+
+repository = Path(__file__).resolve().parent.parent
+if str(repository) not in sys.path: sys.path.insert(0, str(repository))
+
+from benchmark.fake_twitter import ENDPOINTS, REAL_RATE_LIMITS, FakeTwitterClient, GraphShape, SocialGraph
+
+class BenchmarkObserver:
+	"""Counts worked tasks and stops the Locator once the crawl is over"""
+
+	def __init__(self, task_system, coordinator_system, max_seconds: float, max_tasks: int):
+
+		self._task_system = task_system
+		self._coordinator_system = coordinator_system
+		self._max_seconds = max_seconds
+		self._max_tasks = max_tasks
+		self.start = time.perf_counter()
+		self.tasks_run = 0
+
+	def on_event(self, event):
+
+		from locator import Locator, Update
+		from plugins.coordinator_system import CompletedBatch
+		from plugins.task_system import WorkingOnTask
+
+		if isinstance(event, WorkingOnTask):
+
+			self.tasks_run += 1
+
+			if self.tasks_run >= self._max_tasks:
+				# stops at the same task whatever the speed, so that a replay runs what was recorded
+				self._task_system.set_local_execution(False)
+
+		elif isinstance(event, CompletedBatch):
+			self.tasks_run += event.ran
+
+		elif isinstance(event, Update):
+
+			in_flight = self._coordinator_system.leased_tasks() if self._coordinator_system is not None else 0
+
+			if (self._task_system.pending_tasks() + in_flight == 0
+				or time.perf_counter() - self.start > self._max_seconds
+				or self.tasks_run >= self._max_tasks):
+				Locator.shutdown()
+
+def parse_args() -> argparse.Namespace:
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=10_000)
+	parser.add_argument("--followers-mean", type=float, default=20.0)
+	parser.add_argument("--tweets-per-user", type=int, default=10)
+	parser.add_argument("--on-topic-users", type=float, default=0.2)
+	parser.add_argument("--on-topic-tweets", type=float, default=0.3)
+	parser.add_argument("--mentions-mean", type=float, default=1.0)
+	parser.add_argument("--retweet-rate", type=float, default=0.1)
+	parser.add_argument("--graph-seed", type=int, default=0)
+	parser.add_argument("--seed-users", type=int, default=10)
+	parser.add_argument("--seed-tweets", type=int, default=0)
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+	parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, in seconds")
+	parser.add_argument("--rate-limits", action="store_true", help="enforce the documented v2 rate limits")
+	parser.add_argument("--time-scale", type=float, default=0.001, help="scales rate limit windows")
+	parser.add_argument("--max-seconds", type=float, default=60.0)
+	parser.add_argument("--max-tasks", type=int, default=10**9)
+	parser.add_argument("--workers", type=int, default=0, help="crawl through coordinator_system with that many worker processes")
+	parser.add_argument("--campaign", nargs=3, action="append", default=[], metavar=("NAME", "KEYWORD", "SHARE"),
+		help="crawl several campaigns at once instead of the graph's keyword alone")
+	parser.add_argument("--plugin", action="append", default=[], help="extra plugin to load, e.g. profiling_system")
+	cassette = parser.add_mutually_exclusive_group()
+	cassette.add_argument("--record", type=Path, help="record the api answers to this cassette, see data_system_cassette")
+	cassette.add_argument("--replay", type=Path,
+		help="answer from this cassette instead of the synthetic graph, only the main process' calls are counted. "
+		"Run with the --max-tasks of the recording, without workers")
+	parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+	parser.add_argument("--output", type=Path, help="also write the report to this file")
+	return parser.parse_args()
+
+def count_rows(database: Path) -> dict[str, int]:
+
+	connector = sqlite3.connect(database)
+
+	try:
+		return {
+			table: connector.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+			for table in ("users", "tweets", "follows")
+		}
+
+	finally:
+		connector.close()
+
+def main():
+
+	args = parse_args()
+	graph = SocialGraph(GraphShape(
+		users=args.users,
+		followers_mean=args.followers_mean,
+		tweets_per_user=args.tweets_per_user,
+		on_topic_users=args.on_topic_users,
+		on_topic_tweets=args.on_topic_tweets,
+		mentions_mean=args.mentions_mean,
+		retweet_rate=args.retweet_rate,
+		seed=args.graph_seed,
+	))
+	shared_calls = multiprocessing.get_context("spawn").Array("q", len(ENDPOINTS))
+	create_client = partial(
+		FakeTwitterClient,
+		graph,
+		latency=args.latency,
+		jitter=args.jitter,
+		rate_limits=REAL_RATE_LIMITS if args.rate_limits else None,
+		time_scale=args.time_scale,
+		shared_calls=shared_calls,
+	)
+	client = create_client()
+
+	output = args.output.resolve() if args.output is not None else None
+	cassette = (args.record or args.replay).resolve() if (args.record or args.replay) is not None else None
+	workdir = Path(tempfile.mkdtemp(prefix="twt_benchmark_"))
+	os.chdir(workdir)
+	plugins = ["data_system", "task_system", "log_system", "initial_tasks", *args.plugin]
+	if args.workers: plugins.append("coordinator_system")
+	json.dump(plugins, open("plugins.json", "w", encoding="utf-8"))
+	json.dump({
+		"users": [graph.user_id(index) for index in range(min(args.seed_users, args.users))],
+		"tweets": [graph.tweet_ids(index)[0] for index in range(min(args.seed_tweets, args.users))],
+	}, open("init_ids.json", "w", encoding="utf-8"))
+
+	from factory import Factory
+	Factory.set("twitter_api", lambda: client)
+	Factory.set("twitter_worker_api", lambda index: create_client)
+
+	import plugins.coordinator_system_config as coordinator_system_config
+	coordinator_system_config.worker_login_dirs = [Path(f"worker_{index}") for index in range(args.workers)]
+
+	import plugins.data_system_config as data_system_config
+	import plugins.log_system_config as log_system_config
+	import plugins.task_system_config as task_system_config
+	log_system_config.mode = "aggregate"
+
+	if cassette is not None:
+		data_system_config.cassette_mode = "record" if args.record is not None else "replay"
+		data_system_config.cassette_file = cassette
+
+	task_system_config.keywords = [graph.shape.keyword]
+	task_system_config.campaigns = {name: {"keywords": [keyword], "share": float(share)} for name, keyword, share in args.campaign}
+
+	from locator import Locator
+	from plugins.task_system import locate_data_system, locate_task_system
+
+	Locator.load_plugins()
+	startup = time.perf_counter() - started
+
+	coordinator_system = Locator.get_system({"coordinator_system"})
+	observer = BenchmarkObserver(locate_task_system(), coordinator_system, args.max_seconds, args.max_tasks)
+	locate_task_system().add_observer(observer)
+
+	if coordinator_system is not None:
+		coordinator_system.add_observer(observer) #type: ignore
+	Locator.add_observer(observer)
+	Locator.main_loop()
+	elapsed = time.perf_counter() - observer.start
+
+	rows = count_rows(workdir/"data_system.db")
+	calls = dict(zip(ENDPOINTS, shared_calls))
+	api_calls = sum(calls.values()) if args.replay is None else locate_data_system().api_calls
+	report = {
+		"startup_seconds": round(startup, 4),
+		"crawl_seconds": round(elapsed, 4),
+		"tasks_run": observer.tasks_run,
+		"tasks_per_second": round(observer.tasks_run/elapsed, 2),
+		"pending_tasks": locate_task_system().pending_tasks(),
+		"api_calls": api_calls,
+		"api_calls_by_endpoint": {endpoint: amount for endpoint, amount in calls.items() if amount},
+		"api_calls_per_discovered_user": round(api_calls/rows["users"], 3) if rows["users"] else None,
+		"workers": args.workers,
+		"rows": rows,
+		"db_rows_per_second": round(sum(rows.values())/elapsed, 2),
+		"peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1),
+	}
+
+	if args.replay is not None:
+		from metrics import Metrics
+		report["cassette_misses"] = int(Metrics.counter("cassette_misses_total").value)
+
+	if args.campaign:
+		report["api_calls_by_campaign"] = {campaign.name: round(campaign.spent) for campaign in locate_task_system().campaigns()}
+
+	print(json.dumps(report, indent=4))
+
+	if output is not None:
+		json.dump(report, open(output, "w", encoding="utf-8"), indent=4)
+
+	if not args.keep:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	else:
+		print(f"scratch directory kept at {workdir}")
+
+if __name__ == "__main__":
+	main()
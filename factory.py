@@ -15,6 +15,9 @@ class FactoryType:
 	def rem(self, name: str):
 		self._creators.pop(name)
 
+	def has(self, name: str) -> bool:
+		return name in self._creators
+
 	def create(self, name: str, t: type[T], *args, **kwargs) -> T:
 		return self._creators[name](*args, **kwargs)
 
@@ -26,6 +26,12 @@ class Herald(Generic[T]):
 	def rem_observer(self, observer: ObserverProtocol[T]):
 		self._observers.remove(observer)
 
+	def has_observer(self, observer: ObserverProtocol[T]) -> bool:
+		return observer in self._observers
+
+	def get_observers(self) -> list[ObserverProtocol[T]]:
+		return list(self._observers)
+
 	def _dispatch_event(self, event: T):
 
 		for observer in self._observers:
@@ -1,15 +1,18 @@
 
 import json
-import hashlib
 import time
 from dataclasses import dataclass
-from typing import Callable, Iterable, Optional, TypeAlias, TypeVar
+from typing import Any, Callable, Iterable, Optional, TypeAlias, TypeVar
 
 import config
 
 from event import Error, Event
-from herald import Herald
-from plugin_loader import MissingTags, PluginName, PluginNotFound, load_plugin
+from herald import Herald, ObserverProtocol
+from metrics import Metrics
+from plugin_loader import (
+	MissingTags, Plugin, PluginManifest, PluginName, PluginNotFound,
+	files_signature, import_plugins, plugin_files, read_manifest, reload_plugin, sort_plugins,
+)
 from tag import PluginTag, SystemTag
 from protocols import SystemProtocol
 
@@ -33,6 +36,22 @@ class LoadedPlugin(LocatorEvent):
 
 	plugin_name: str
 
+@dataclass
+class UnloadedPlugin(LocatorEvent):
+
+	plugin_name: str
+
+@dataclass
+class ReloadedPlugin(LocatorEvent):
+
+	plugin_name: str
+
+@dataclass
+class CannotReloadPlugin(LocatorError):
+
+	plugin_name: str
+	reason: str
+
 @dataclass
 class MissingPlugin(LocatorError):
 
@@ -75,18 +94,35 @@ class LocatorType(Herald[LocatorEvent]):
 		super().__init__()
 		self.loaded_plugins: set[PluginName] = set()
 		self.loaded_tags: set[PluginTag] = set()
-		self._plugins_file_hash: str = "no hash"
+		self._plugins_file_signature: tuple = ()
 		self._systems: list[SystemProtocol] = []
 		self._keep_going: bool = True
+		self._deferred: list[Callable[[], Any]] = []
+		self._load_order: list[PluginName] = []
+		self._plugins: dict[PluginName, Plugin] = {}
+		self._manifests: dict[PluginName, PluginManifest] = {}
+		self._plugin_signatures: dict[PluginName, tuple] = {}
+		self._owned: dict[PluginName, list[Any]] = {}
+		self._initializing: Optional[PluginName] = None
+		self._updates_metric = Metrics.counter("locator_updates_total", "Update events dispatched by the Locator")
 
 	def shutdown(self):
 		self._keep_going = False
 
+	def defer(self, f: Callable[[], Any]):
+		"""runs f once the current Update has been dispatched to every observer"""
+		self._deferred.append(f)
+
 	def main_loop(self):
 
 		with EnsureCall(self._on_exit):
 			while self._keep_going:
+
 				self._dispatch_event(Update())
+				self._updates_metric.inc()
+
+				while self._deferred:
+					self._deferred.pop(0)()
 
 	def _on_exit(self):
 
@@ -106,8 +142,14 @@ class LocatorType(Herald[LocatorEvent]):
 			if all(tag in system.tags for tag in tags):
 				yield system
 
+	def _own(self, obj: Any):
+
+		if self._initializing is not None and all(owned is not obj for owned in self._owned[self._initializing]):
+			self._owned[self._initializing].append(obj)
+
 	def add_system(self, system: SystemProtocol):
 
+		self._own(system)
 		self._systems.append(system)
 		self._dispatch_event(AddedSystem(system_name=system.__class__.__name__, system=system))
 
@@ -122,69 +164,234 @@ class LocatorType(Herald[LocatorEvent]):
 		else:
 			self._dispatch_event(RemovedSystem(system_name=system.__class__.__name__))
 
-	def load_plugins(self):
-		
-		with open(config.plugins_file, "r", encoding="utf-8") as f:
-			content = f.read()
+	def add_observer(self, observer: ObserverProtocol[LocatorEvent]):
+
+		self._own(observer)
+		super().add_observer(observer)
+
+	def _initialize_plugin(self, plugin_name: PluginName, plugin: Plugin, manifest: PluginManifest, handoff: Any = None):
+
+		self._initializing = plugin_name
+		self._owned[plugin_name] = []
+
+		try:
+			with Metrics.histogram("locator_plugin_load_seconds", "Time spent initializing plugins", plugin=plugin_name).time():
+
+				if handoff is None:
+					plugin.initialize()
+
+				else:
+					plugin.initialize(handoff) #type: ignore
+
+		except BaseException:
+			self._detach_plugin(plugin_name)
+			raise
+
+		finally:
+			self._initializing = None
+
+		self.loaded_plugins.add(plugin_name)
+		self.loaded_tags |= plugin.tags
+		self._load_order.append(plugin_name)
+		self._plugins[plugin_name] = plugin
+		self._manifests[plugin_name] = manifest
+		self._plugin_signatures[plugin_name] = files_signature(plugin_files(plugin_name))
+
+	def _detach_plugin(self, plugin_name: PluginName) -> list[Any]:
+		"""Removes the systems and observers a plugin registered, wherever they are observing"""
+
+		owned = self._owned.pop(plugin_name, [])
+
+		for obj in owned:
+
+			if obj in self._systems:
+				self.rem_system(obj)
+
+			if self.has_observer(obj):
+				self.rem_observer(obj)
+
+		for system in self._systems:
+			if isinstance(system, Herald):
+				for obj in owned:
+					if system.has_observer(obj):
+						system.rem_observer(obj)
+
+		if plugin_name in self._load_order:
+			self._load_order.remove(plugin_name)
+
+		self.loaded_plugins.discard(plugin_name)
+		self._plugins.pop(plugin_name, None)
+		self._manifests.pop(plugin_name, None)
+		self._plugin_signatures.pop(plugin_name, None)
+		self.loaded_tags = set().union(*(plugin.tags for plugin in self._plugins.values()))
+		return owned
+
+	def _with_dependents(self, plugin_names: Iterable[PluginName]) -> list[PluginName]:
+		"""The given loaded plugins and every loaded plugin requiring them, in load order"""
+
+		closure = set(plugin_names) & self.loaded_plugins
+		grown = True
+
+		while grown:
 
-		hasher = hashlib.md5()
-		hasher.update(content.encode(encoding="utf-8"))
-		file_hash = hasher.hexdigest()
+			grown = False
+			provided = frozenset().union(*(self._manifests[name].provides for name in closure))
 
-		if file_hash == self._plugins_file_hash:
+			for name in self._load_order:
+				if name not in closure and self._manifests[name].requires & provided:
+					closure.add(name)
+					grown = True
+
+		return [name for name in self._load_order if name in closure]
+
+	def _finalize_plugins(self,
+		plugin_names: list[PluginName],
+		finalizers: Optional[dict[PluginName, Optional[Callable[[], Any]]]] = None) -> tuple[dict[PluginName, Any], list[Any]]:
+		"""Finalizes and detaches plugins in reverse load order, returning their handoffs"""
+
+		handoffs: dict[PluginName, Any] = {}
+		detached: list[Any] = []
+
+		for plugin_name in reversed(plugin_names):
+
+			if finalizers is None:
+				finalize = getattr(self._plugins[plugin_name], "finalize", None)
+
+			else:
+				finalize = finalizers[plugin_name]
+
+			if finalize is not None:
+				handoffs[plugin_name] = finalize()
+
+			detached += self._detach_plugin(plugin_name)
+
+		return handoffs, detached
+
+	def unload_plugins(self, plugin_names: Iterable[PluginName]):
+
+		plugin_names = self._with_dependents(plugin_names)
+		self._finalize_plugins(plugin_names)
+
+		for plugin_name in plugin_names:
+			self._dispatch_event(UnloadedPlugin(plugin_name=plugin_name))
+			print(f"unloaded {plugin_name}")
+
+	def reload_plugins(self, plugin_names: Iterable[PluginName]):
+		"""Re-imports plugins and the plugins depending on them, without stopping
+
+		Each plugin's finalize() result is handed to its new initialize(handoff),
+		and observers other plugins attached to its systems move to the new ones."""
+
+		plugin_names = self._with_dependents(plugin_names)
+		plugins: dict[PluginName, Plugin] = {}
+		# reloading re-executes the module in place, so the old finalize is kept aside first
+		finalizers = {name: getattr(self._plugins[name], "finalize", None) for name in plugin_names}
+
+		for plugin_name in plugin_names:
+
+			try:
+				plugins[plugin_name] = reload_plugin(plugin_name)
+
+			except Exception as e:
+				self._plugin_signatures[plugin_name] = files_signature(plugin_files(plugin_name))
+				self._dispatch_event(CannotReloadPlugin(plugin_name=plugin_name, reason=repr(e)))
+				return
+
+		handoffs, detached = self._finalize_plugins(plugin_names, finalizers)
+		old_systems = {obj.__class__.__name__: obj for obj in detached if isinstance(obj, Herald)}
+
+		for plugin_name in plugin_names:
+
+			try:
+				self._initialize_plugin(plugin_name, plugins[plugin_name], read_manifest(plugin_name), handoffs.get(plugin_name))
+
+			except (MissingTags, PluginNotFound) as e:
+				self._dispatch_event(CannotReloadPlugin(plugin_name=plugin_name, reason=repr(e)))
+				continue
+
+			for obj in self._owned[plugin_name]:
+				if isinstance(obj, Herald) and (old := old_systems.get(obj.__class__.__name__)) is not None:
+					for observer in old.get_observers():
+						if observer not in detached and not obj.has_observer(observer):
+							obj.add_observer(observer)
+
+			self._dispatch_event(ReloadedPlugin(plugin_name=plugin_name))
+			print(f"reloaded {plugin_name}")
+
+	def reload_changed_plugins(self):
+
+		changed = [
+			plugin_name for plugin_name in self._load_order
+			if files_signature(plugin_files(plugin_name)) != self._plugin_signatures.get(plugin_name)
+		]
+
+		if changed:
+			self.reload_plugins(changed)
+
+	def load_plugins(self):
+
+		if (signature := files_signature([config.plugins_file])) == self._plugins_file_signature:
 			return
 
-		self._plugins_file_hash = file_hash
+		self._plugins_file_signature = signature
+
+		with open(config.plugins_file, "r", encoding="utf-8") as f:
+			content = f.read()
 
 		try:
-			plugin_names: set[PluginName] = set(json.loads(content)) - self.loaded_plugins
+			listed: set[PluginName] = set(json.loads(content))
 
 		except json.decoder.JSONDecodeError:
-			self.events.dispatch(CannotReadPluginsFile())
+			self._dispatch_event(CannotReadPluginsFile())
 			return
 
-		missing_tags: set[PluginTag] = set()
+		if (removed := self.loaded_plugins - listed):
+			self.unload_plugins(removed)
 
-		while plugin_names:
+		plugin_names = listed - self.loaded_plugins
+		manifests: list[PluginManifest] = []
 
-			local_plugin_names = plugin_names.copy()
-			prev_missing_tags = missing_tags
-			missing_tags = set()
+		for plugin_name in sorted(plugin_names):
 
-			while local_plugin_names:
+			try:
+				manifests.append(read_manifest(plugin_name))
 
-				plugin_name = local_plugin_names.pop()
+			except PluginNotFound:
+				self._dispatch_event(MissingPlugin(plugin_name=plugin_name))
 
-				try:
-					plugin = load_plugin(plugin_name)
+		batches, blocked, missing_tags = sort_plugins(manifests, frozenset(self.loaded_tags))
+
+		for batch in batches:
+
+			with Metrics.histogram("locator_plugin_import_seconds", "Time spent importing a batch of independent plugins").time():
+				plugins = import_plugins([manifest.name for manifest in batch], parallel=config.parallel_plugin_imports)
+
+			for manifest in batch:
 
-				except PluginNotFound:
-					
-					self._dispatch_event(MissingPlugin(plugin_name=plugin_name))
-					plugin_names.remove(plugin_name)
+				if isinstance(plugin := plugins[manifest.name], PluginNotFound):
+					self._dispatch_event(MissingPlugin(plugin_name=manifest.name))
 					continue
 
+				try:
+					self._initialize_plugin(manifest.name, plugin, manifest)
+
 				except MissingTags as e:
 
+					blocked.append(manifest)
 					missing_tags |= e.tags
 					continue
 
-				else:
+				self._dispatch_event(LoadedPlugin(plugin_name=manifest.name))
+				print(f"loaded {manifest.name}")
 
-					self._dispatch_event(LoadedPlugin(plugin_name=plugin_name))
-					plugin_names.remove(plugin_name)
-					self.loaded_tags |= plugin.tags
-					print(f"loaded {plugin_name}")
+		if blocked:
 
-			if missing_tags and missing_tags == prev_missing_tags:
-
-				print(f"cannot load {plugin_name=}, {missing_tags=}")
-				self._dispatch_event(
-					CannotLoadPlugins(
-						plugin_names=list(plugin_names),
-						missing_tags=list(missing_tags),
-					)
+			print(f"cannot load {[manifest.name for manifest in blocked]}, {missing_tags=}")
+			self._dispatch_event(
+				CannotLoadPlugins(
+					plugin_names=[manifest.name for manifest in blocked],
+					missing_tags=list(missing_tags),
 				)
-				return
+			)
 
 Locator = LocatorType()
@@ -0,0 +1,206 @@
+
+import json
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Iterable, Iterator, TypeAlias
+
+Labels: TypeAlias = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (
+	0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+class Counter:
+
+	__slots__ = ("value",)
+
+	def __init__(self):
+
+		self.value: float = 0
+
+	def inc(self, amount: float = 1):
+		self.value += amount
+
+class Gauge:
+
+	__slots__ = ("value",)
+
+	def __init__(self):
+
+		self.value: float = 0
+
+	def set(self, value: float):
+		self.value = value
+
+	def inc(self, amount: float = 1):
+		self.value += amount
+
+	def dec(self, amount: float = 1):
+		self.value -= amount
+
+class Timer:
+
+	__slots__ = ("_histogram", "_start")
+
+	def __init__(self, histogram: "Histogram"):
+
+		self._histogram = histogram
+		self._start = 0.0
+
+	def __enter__(self):
+
+		self._start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args, **kwargs):
+		self._histogram.observe(time.perf_counter() - self._start)
+
+class Histogram:
+
+	__slots__ = ("buckets", "counts", "sum", "count")
+
+	def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+
+		self.buckets = buckets
+		self.counts: list[int] = [0]*(len(buckets) + 1)
+		self.sum: float = 0
+		self.count: int = 0
+
+	def observe(self, value: float):
+
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def time(self) -> Timer:
+		return Timer(self)
+
+Metric: TypeAlias = Counter | Gauge | Histogram
+
+class MetricFamily:
+
+	def __init__(self, name: str, kind: type[Metric], help: str):
+
+		self.name = name
+		self.kind = kind
+		self.help = help
+		self.children: dict[Labels, Metric] = {}
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Iterable[tuple[str, str]]) -> str:
+
+	content = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+	return f"{{{content}}}" if content else ""
+
+def _format_value(value: float) -> str:
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+	"""Process wide store of counters, gauges and histograms
+
+	Children are created once per label set and should be kept by the caller
+	when used on a hot path, so that recording is a plain attribute update."""
+
+	def __init__(self):
+
+		self._families: dict[str, MetricFamily] = {}
+		self._lock = threading.Lock()
+
+	def _get(self, kind: type[Metric], name: str, help: str, labels: dict[str, str]) -> Metric:
+
+		key: Labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+		try:
+			return self._families[name].children[key]
+
+		except KeyError:
+
+			with self._lock:
+
+				family = self._families.setdefault(name, MetricFamily(name, kind, help))
+
+				if family.kind is not kind:
+					raise TypeError(f"{name} is a {family.kind.__name__}, not a {kind.__name__}")
+
+				return family.children.setdefault(key, kind())
+
+	def counter(self, name: str, help: str = "", **labels: str) -> Counter:
+		return self._get(Counter, name, help, labels) #type: ignore
+
+	def gauge(self, name: str, help: str = "", **labels: str) -> Gauge:
+		return self._get(Gauge, name, help, labels) #type: ignore
+
+	def histogram(self, name: str, help: str = "", **labels: str) -> Histogram:
+		return self._get(Histogram, name, help, labels) #type: ignore
+
+	def _snapshot_families(self) -> list[tuple[MetricFamily, list[tuple[Labels, Metric]]]]:
+
+		with self._lock:
+			return [(family, list(family.children.items())) for family in self._families.values()]
+
+	def _render_lines(self) -> Iterator[str]:
+
+		for family, children in self._snapshot_families():
+
+			yield f"# HELP {family.name} {family.help}"
+			yield f"# TYPE {family.name} {family.kind.__name__.lower()}"
+
+			for labels, metric in children:
+
+				if isinstance(metric, Histogram):
+
+					cumulated = 0
+
+					for bound, amount in zip(metric.buckets, metric.counts):
+						cumulated += amount
+						yield f"{family.name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulated}"
+
+					yield f"{family.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {metric.count}"
+					yield f"{family.name}_sum{_format_labels(labels)} {_format_value(metric.sum)}"
+					yield f"{family.name}_count{_format_labels(labels)} {metric.count}"
+
+				else:
+					yield f"{family.name}{_format_labels(labels)} {_format_value(metric.value)}"
+
+	def render(self) -> str:
+		"""Prometheus text exposition format"""
+		return "\n".join(self._render_lines()) + "\n"
+
+	def snapshot(self) -> dict:
+
+		snapshot: dict = {"time": time.time(), "metrics": {}}
+
+		for family, children in self._snapshot_families():
+
+			entries = []
+
+			for labels, metric in children:
+
+				entry: dict = {"labels": dict(labels)}
+
+				if isinstance(metric, Histogram):
+					entry |= {"buckets": list(metric.buckets), "counts": list(metric.counts), "sum": metric.sum, "count": metric.count}
+
+				else:
+					entry["value"] = metric.value
+
+				entries.append(entry)
+
+			snapshot["metrics"][family.name] = {"type": family.kind.__name__.lower(), "help": family.help, "values": entries}
+
+		return snapshot
+
+	def write_snapshot(self, file: Path):
+
+		temporary = file.with_suffix(file.suffix + ".tmp")
+
+		with open(temporary, "w", encoding="utf-8") as f:
+			json.dump(self.snapshot(), f)
+
+		temporary.replace(file)
+
+Metrics = MetricsRegistry()
@@ -1,7 +1,15 @@
 
+import ast
 import importlib
+import importlib.util
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from graphlib import CycleError, TopologicalSorter
 from pathlib import Path
-from typing import TypeAlias
+from types import ModuleType
+from typing import Any, Iterable, TypeAlias
 
 import config
 
@@ -9,6 +17,8 @@ from tag import PluginTag
 
 PluginName: TypeAlias = str
 
+_lazy_import_lock = threading.Lock()
+
 class MissingTags(Exception):
 
 	def __init__(self, tags: frozenset[PluginTag]):
@@ -24,10 +34,23 @@ class PluginNotFound(Exception):
 class Plugin:
 
 	tags: frozenset[PluginTag]
+	requires: frozenset[PluginTag]
 
 	@staticmethod
 	def initialize(): ...
 
+	# optional, returns the state handed to the next initialize(handoff) on reload
+	@staticmethod
+	def finalize() -> Any: ...
+
+@dataclass(frozen=True)
+class PluginManifest:
+	"""What a plugin provides and requires, read from its source without importing it"""
+
+	name: PluginName
+	provides: frozenset[PluginTag]
+	requires: frozenset[PluginTag]
+
 def _get_plugin_path(name: PluginName) -> str:
 	return f"{config.plugins_package}.{name}"
 
@@ -39,6 +62,173 @@ def _get_plugin(name: PluginName) -> Plugin:
 	except ModuleNotFoundError as e:
 		raise PluginNotFound(name) from e
 
+def read_manifest(name: PluginName) -> PluginManifest:
+	"""Reads the module level tags and requires literals of a plugin"""
+
+	try:
+		spec = importlib.util.find_spec(_get_plugin_path(name))
+
+	except ModuleNotFoundError as e:
+		raise PluginNotFound(name) from e
+
+	if spec is None or spec.origin is None:
+		raise PluginNotFound(name)
+
+	values: dict[str, frozenset[PluginTag]] = {}
+
+	for node in ast.parse(Path(spec.origin).read_text(encoding="utf-8")).body:
+		if isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value is not None:
+			for target in (node.targets if isinstance(node, ast.Assign) else [node.target]):
+				if isinstance(target, ast.Name) and target.id in ("tags", "requires"):
+					values[target.id] = frozenset(ast.literal_eval(node.value))
+
+	return PluginManifest(
+		name=name,
+		provides=values.get("tags", frozenset()),
+		requires=values.get("requires", frozenset()),
+	)
+
+def sort_plugins(
+	manifests: Iterable[PluginManifest],
+	existing: frozenset[PluginTag]) -> tuple[list[list[PluginManifest]], list[PluginManifest], frozenset[PluginTag]]:
+	"""Orders plugins so that each one comes after the providers of its requirements
+
+	Returns batches of plugins that only depend on earlier batches, the plugins
+	that cannot be loaded, and the tags nobody provides."""
+
+	pending = {manifest.name: manifest for manifest in manifests}
+	provided = existing.union(*(manifest.provides for manifest in pending.values()))
+	blocked: dict[PluginName, PluginManifest] = {}
+
+	while True:
+
+		available = existing.union(*(manifest.provides for manifest in pending.values()))
+		unsatisfied = [manifest for manifest in pending.values() if not manifest.requires <= available]
+
+		if not unsatisfied:
+			break
+
+		for manifest in unsatisfied:
+			blocked[manifest.name] = pending.pop(manifest.name)
+
+	missing = frozenset().union(*(manifest.requires for manifest in blocked.values())) - provided
+
+	providers: dict[PluginTag, set[PluginName]] = {}
+
+	for manifest in pending.values():
+		for tag in manifest.provides:
+			providers.setdefault(tag, set()).add(manifest.name)
+
+	sorter: TopologicalSorter[PluginName] = TopologicalSorter()
+
+	for manifest in pending.values():
+		sorter.add(manifest.name, *(
+			provider
+			for tag in manifest.requires - existing
+			for provider in providers[tag]
+			if provider != manifest.name
+		))
+
+	try:
+		sorter.prepare()
+
+	except CycleError as e:
+
+		for name in e.args[1]:
+			if name in pending:
+				blocked[name] = pending.pop(name)
+
+		batches, more_blocked, more_missing = sort_plugins(pending.values(), existing)
+		return batches, list(blocked.values()) + more_blocked, missing | more_missing
+
+	batches: list[list[PluginManifest]] = []
+
+	while sorter.is_active():
+
+		ready = sorter.get_ready()
+		batches.append([pending[name] for name in sorted(ready)])
+		sorter.done(*ready)
+
+	return batches, list(blocked.values()), missing
+
+def import_plugins(names: list[PluginName], parallel: bool = True) -> dict[PluginName, Plugin | PluginNotFound]:
+	"""Imports plugins without initializing them, on a thread pool if parallel"""
+
+	def attempt(name: PluginName) -> Plugin | PluginNotFound:
+
+		try:
+			return _get_plugin(name)
+
+		except PluginNotFound as e:
+			return e
+
+	if not parallel or len(names) < 2:
+		return {name: attempt(name) for name in names}
+
+	with ThreadPoolExecutor(max_workers=len(names)) as executor:
+		return dict(zip(names, executor.map(attempt, names)))
+
+def _get_config_path(name: PluginName) -> str:
+	return f"{_get_plugin_path(name)}_config"
+
+def plugin_files(name: PluginName) -> list[Path]:
+	"""Source files of a loaded plugin and of its config module"""
+
+	files = []
+
+	for path in (_get_config_path(name), _get_plugin_path(name)):
+		if (module := sys.modules.get(path)) is not None and getattr(module, "__file__", None):
+			files.append(Path(module.__file__)) #type: ignore
+
+	return files
+
+def files_signature(files: Iterable[Path]) -> tuple[tuple[int, int], ...]:
+	"""Cheap change detection, a stat per file instead of reading it"""
+
+	signature = []
+
+	for file in files:
+
+		try:
+			stat = file.stat()
+
+		except OSError:
+			signature.append((-1, -1))
+
+		else:
+			signature.append((stat.st_mtime_ns, stat.st_size))
+
+	return tuple(signature)
+
+def reload_plugin(name: PluginName) -> Plugin:
+	"""Re-executes the config module and the module of an already imported plugin"""
+
+	if (config_module := sys.modules.get(_get_config_path(name))) is not None:
+		importlib.reload(config_module)
+
+	if (module := sys.modules.get(_get_plugin_path(name))) is None:
+		return _get_plugin(name)
+
+	return importlib.reload(module) #type: ignore
+
+def lazy_import(name: str) -> ModuleType:
+	"""Returns a module that only gets executed on first attribute access"""
+
+	with _lazy_import_lock:
+
+		if name in sys.modules:
+			return sys.modules[name]
+
+		if (spec := importlib.util.find_spec(name)) is None or spec.loader is None:
+			raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+		loader = importlib.util.LazyLoader(spec.loader)
+		spec.loader = loader
+		module = importlib.util.module_from_spec(spec)
+		sys.modules[name] = module
+		loader.exec_module(module)
+		return module
+
 def assert_tags(existing: frozenset[PluginTag], required: frozenset[PluginTag]):
 
 	if (missing := required - existing):
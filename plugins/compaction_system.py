@@ -0,0 +1,361 @@
+
+"""Background compaction of data_system.db
+
+A cycle, run every compaction_system_config.cycle_period:
+
+	- removes duplicate users and tweets, keeping the newest row of each id with the
+	  processed flag of any of them, and duplicate follows, keeping the oldest
+	- strips the payload of off-topic tweets and users down to hot_fields. A tweet is
+	  off topic when it contains no keyword of any campaign, a user once processed
+	  when none of their stored tweets is on topic
+	- deletes the oldest rows of tables above their max_rows. Timelines and follower
+	  lists losing rows that way lose their fetched mark, and get fetched again
+	- gives free pages back to the file system with incremental vacuum
+
+The cycle is a generator of small steps, each one a short transaction on the
+DataSystem's connection. Every Update runs steps until step_time_budget is
+spent, so the crawl is never held for more than about one step.
+
+Rows removed or stripped are not recorded one by one in the change log, a
+completed cycle appends a single "compacted" change instead, see
+data_system_changes.
+
+Incremental vacuum needs auto_vacuum, which the DataSystem turns on for new files.
+An existing file is converted once, with a full VACUUM, while the crawler is stopped:
+
+	python -m plugins.compaction_system --enable-incremental-vacuum
+
+which then runs a whole cycle at once. The VACUUM may renumber rowids, which
+neither data_system_export nor the change log depend on."""
+
+import argparse
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+import plugins.compaction_system_config as compaction_system_config
+import plugins.data_system_config as data_system_config
+
+from event import Event
+from herald import Herald
+from locator import Locator, LocatorEvent, Update
+from metrics import Metrics
+from plugin_loader import assert_tags
+from plugins.data_system import DEFAULT_CAMPAIGN, Database, DataSystem, like_pattern, next_version, open_change_log
+from plugins.task_system import Campaign, configured_campaigns, locate_data_system
+
+class CompactionSystemEvent(Event): ...
+
+@dataclass
+class CompletedCompaction(CompactionSystemEvent):
+
+	removed: dict[str, int]
+	stripped: dict[str, int]
+	freed_pages: int
+	seconds: float # spent compacting, over all the steps of the cycle
+	longest_step: float
+
+@dataclass
+class IncrementalVacuumDisabled(CompactionSystemEvent):
+
+	file: str
+
+def json_projection(fields: list[str], column: str = "data") -> str:
+	"""SQL expression of the JSON object holding only fields of column, missing ones left out"""
+
+	tree: dict[str, Any] = {}
+
+	for name in fields:
+
+		*parents, leaf = name.split(".")
+		node = tree
+
+		for parent in parents:
+			node = node.setdefault(parent, {})
+
+		node[leaf] = None
+
+	def leaves(node: dict[str, Any], path: str) -> list[str]:
+		return [leaf for key, child in node.items() for leaf in (leaves(child, f"{path}.{key}") if child is not None else [f"{path}.{key}"])]
+
+	def build(node: dict[str, Any], path: str) -> str:
+
+		members = []
+
+		for key, child in node.items():
+
+			if child is None:
+				members.append(f"'{key}', json_extract({column}, '{path}.{key}')")
+
+			else:
+				# left out rather than kept empty when none of its fields is there
+				present = " OR ".join(f"json_type({column}, '{leaf}') IS NOT NULL" for leaf in leaves(child, f"{path}.{key}"))
+				members.append(f"'{key}', CASE WHEN {present} THEN {build(child, f'{path}.{key}')} END")
+
+		return f"json_object({', '.join(members)})"
+
+	# a merge patch with null members adds nothing for them
+	return f"json_patch('{{}}', {build(tree, '$')})"
+
+# table -> (kind in the fetched table, column holding its id), see DataSystem.get_recent_tweets
+_fetched_lists = {"tweets": ("timeline", "author"), "follows": ("followers", "target")}
+
+class Compactor:
+
+	def __init__(self, database: Database, campaigns: list[Campaign]):
+
+		self._database = database
+		keywords = list(dict.fromkeys(keyword.lower() for campaign in campaigns for keyword in campaign.keywords))
+		self._keywords = {f"keyword{i}": like_pattern(keyword) for i, keyword in enumerate(keywords)}
+		self._campaigns = {f"campaign{i}": campaign.name for i, campaign in enumerate(campaigns) if campaign.name != DEFAULT_CAMPAIGN}
+		self.removed: Counter[str] = Counter()
+		self.stripped: Counter[str] = Counter()
+		self.freed_pages = 0
+		# missing from files no DataSystem of this version opened yet
+		self._has_fetched = database.fetch_one("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fetched'") is not None
+
+	def _changes(self) -> int:
+		return self._database.fetch_one("SELECT changes()", default=(0,))[0] #type: ignore
+
+	def _last_rowid(self, table: str) -> int:
+		return self._database.fetch_one(f"SELECT max(rowid) FROM {table}", default=(None,))[0] or 0 #type: ignore
+
+	def _windows(self, table: str) -> Iterator[dict[str, int]]:
+		"""consecutive rowid ranges of batch_size covering the table as it is now"""
+
+		first, last = self._database.fetch_one(f"SELECT min(rowid), max(rowid) FROM {table}", default=(None, None)) #type: ignore
+
+		for after in range((first or 1) - 1, last or 0, compaction_system_config.batch_size):
+			yield {"after": after, "until": after + compaction_system_config.batch_size}
+
+	def _on_topic(self, table: str) -> str:
+
+		if not self._keywords:
+			return "0"
+
+		return " OR ".join(f"lower(json_extract({table}.data, '$.text')) LIKE :{name} ESCAPE '\\'" for name in self._keywords)
+
+	def _deduplicate(self, table: str) -> Iterator[None]:
+
+		after = -2**63
+
+		while (groups := self._database.fetch(
+			f"SELECT id, count(*), max(rowid), max(processed) FROM {table} WHERE id > :after GROUP BY id ORDER BY id LIMIT :limit",
+			{"after": after, "limit": compaction_system_config.batch_size},
+		)):
+			duplicates = [{"id": id, "keep": keep, "processed": processed} for id, count, keep, processed in groups if count > 1]
+
+			if duplicates:
+				self._database.exec_many(f"UPDATE {table} SET processed = :processed, version = {next_version(table)} WHERE rowid = :keep", duplicates)
+				self._database.exec_many(f"DELETE FROM {table} WHERE id = :id AND rowid != :keep", duplicates)
+				self.removed[table] += sum(count - 1 for _, count, _, _ in groups)
+
+			after = groups[-1][0]
+			yield
+
+	def _deduplicate_follows(self) -> Iterator[None]:
+
+		for window in self._windows("follows"):
+
+			self._database.exec(
+				"DELETE FROM follows WHERE rowid > :after AND rowid <= :until AND EXISTS ("
+				"SELECT 1 FROM follows AS older WHERE older.target = follows.target AND older.actor = follows.actor AND older.rowid < follows.rowid"
+				")",
+				window,
+			)
+			self.removed["follows"] += self._changes()
+			yield
+
+	def _strip(self, table: str, condition: str) -> Iterator[None]:
+
+		# hot_fields hold every column data_system_export reads, stripped rows keep their version
+		projection = json_projection(compaction_system_config.hot_fields[table])
+
+		for window in self._windows(table):
+
+			self._database.exec(
+				f"UPDATE {table} SET data = {projection} "
+				f"WHERE rowid > :after AND rowid <= :until AND data != {projection} AND {condition}",
+				window | self._keywords | self._campaigns,
+			)
+			self.stripped[table] += self._changes()
+			yield
+
+	def _strip_tweets(self) -> Iterator[None]:
+		yield from self._strip("tweets", f"NOT ({self._on_topic('tweets')})")
+
+	def _strip_users(self) -> Iterator[None]:
+
+		processed = "users.processed = 1"
+
+		if self._campaigns:
+			processed = (
+				f"({processed} OR EXISTS (SELECT 1 FROM campaign_processed WHERE "
+				f"campaign IN ({', '.join(':' + name for name in self._campaigns)}) AND kind = 'users' AND id = users.id))"
+			)
+
+		yield from self._strip("users", f"{processed} AND NOT EXISTS (SELECT 1 FROM tweets WHERE tweets.author = users.id AND ({self._on_topic('tweets')}))")
+
+	def _retain(self, table: str, max_rows: int) -> Iterator[None]:
+		"""keeps the rows among the max_rows last inserted, as rowids grow with every insert"""
+
+		cutoff = self._last_rowid(table) - max_rows
+		oldest = f"SELECT rowid FROM {table} WHERE rowid <= :cutoff ORDER BY rowid LIMIT :limit"
+		statements: tuple[str, ...] = (f"DELETE FROM {table} WHERE rowid IN ({oldest})",)
+
+		if self._has_fetched and (fetched := _fetched_lists.get(table)) is not None:
+			kind, column = fetched
+			statements = (f"DELETE FROM fetched WHERE kind = '{kind}' AND id IN (SELECT {column} FROM {table} WHERE rowid IN ({oldest}))",) + statements
+
+		while cutoff > 0:
+
+			# the rows go last, changes() counts them
+			self._database.exec_all(statements, {"cutoff": cutoff, "limit": compaction_system_config.batch_size})
+
+			if not (removed := self._changes()):
+				break
+
+			self.removed[table] += removed
+			yield
+
+	def incremental_vacuum_enabled(self) -> bool:
+		return self._database.fetch_one("PRAGMA auto_vacuum") == (2,)
+
+	def _vacuum(self) -> Iterator[None]:
+
+		if not self.incremental_vacuum_enabled():
+			return
+
+		while (free := self._database.fetch_one("PRAGMA freelist_count", default=(0,))[0]): #type: ignore
+
+			self._database.incremental_vacuum(compaction_system_config.vacuum_pages)
+			self.freed_pages += free - self._database.fetch_one("PRAGMA freelist_count", default=(0,))[0] #type: ignore
+			yield
+
+	def cycle(self) -> Iterator[None]:
+
+		yield from self._deduplicate("users")
+		yield from self._deduplicate("tweets")
+		yield from self._deduplicate_follows()
+		yield from self._strip_tweets()
+		yield from self._strip_users()
+
+		for table, max_rows in compaction_system_config.max_rows.items():
+			if max_rows is not None:
+				yield from self._retain(table, max_rows)
+
+		yield from self._vacuum()
+
+class CompactionSystem(Herald[CompactionSystemEvent]):
+	"""Compacts the DataSystem's database a few milliseconds per Update"""
+
+	tags = {"compaction_system"}
+
+	def __init__(self, database: Database):
+
+		Herald.__init__(self)
+		self._database = database
+		self._compactor: Optional[Compactor] = None
+		self._steps: Optional[Iterator[None]] = None
+		self._next_cycle = time.monotonic() + compaction_system_config.first_cycle_delay
+		self._seconds = 0.0
+		self._longest_step = 0.0
+		self._warned = False
+
+	def _start(self):
+
+		self._compactor = Compactor(self._database, configured_campaigns())
+		self._steps = self._compactor.cycle()
+		self._seconds = self._longest_step = 0.0
+
+		if not self._warned and not self._compactor.incremental_vacuum_enabled():
+			self._warned = True
+			self._dispatch_event(IncrementalVacuumDisabled(file=str(data_system_config.data_system_file)))
+
+	def _complete(self, compactor: Compactor):
+
+		self._steps = None
+		self._next_cycle = time.monotonic() + compaction_system_config.cycle_period
+
+		for action, counts in (("removed", compactor.removed), ("stripped", compactor.stripped)):
+			for table, amount in counts.items():
+				Metrics.counter("compaction_rows_total", "Rows removed or stripped by compaction", table=table, action=action).inc(amount)
+
+		Metrics.counter("compaction_freed_pages_total", "Database pages given back by incremental vacuum").inc(compactor.freed_pages)
+		locate_data_system().log_compaction(dict(compactor.removed), dict(compactor.stripped))
+		self._dispatch_event(CompletedCompaction(
+			removed=dict(compactor.removed),
+			stripped=dict(compactor.stripped),
+			freed_pages=compactor.freed_pages,
+			seconds=self._seconds,
+			longest_step=self._longest_step,
+		))
+
+	def _step(self):
+
+		if self._steps is None:
+
+			if time.monotonic() < self._next_cycle:
+				return
+
+			self._start()
+
+		start = time.perf_counter()
+		deadline = start + compaction_system_config.step_time_budget
+		last = start
+
+		for _ in self._steps: #type: ignore
+
+			now = time.perf_counter()
+			self._longest_step = max(self._longest_step, now - last)
+			last = now
+
+			if now >= deadline:
+				self._seconds += now - start
+				return
+
+		self._seconds += time.perf_counter() - start
+		self._complete(self._compactor) #type: ignore
+
+	def on_event(self, event: LocatorEvent):
+
+		if isinstance(event, Update):
+			self._step()
+
+tags = {"compaction_system"}
+requires = {"data_system"}
+
+def initialize():
+
+	assert_tags(existing=Locator.loaded_tags, required=requires)
+	compaction_system = CompactionSystem(locate_data_system().database)
+	Locator.add_system(compaction_system)
+	Locator.add_observer(compaction_system)
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--enable-incremental-vacuum", action="store_true", help="convert the file with a full VACUUM first")
+	args = parser.parse_args()
+
+	# adds the tables and columns files written by older versions miss, the crawler is stopped so the change log is free
+	data_system = DataSystem(change_log=open_change_log())
+	database = data_system.database
+
+	if args.enable_incremental_vacuum:
+		database.exec("PRAGMA auto_vacuum = INCREMENTAL")
+		database.exec("VACUUM")
+
+	compactor = Compactor(database, configured_campaigns())
+
+	for _ in compactor.cycle():
+		pass
+
+	data_system.log_compaction(dict(compactor.removed), dict(compactor.stripped))
+
+	print(json.dumps({"removed": compactor.removed, "stripped": compactor.stripped, "freed_pages": compactor.freed_pages}))
+
+if __name__ == "__main__":
+	main()
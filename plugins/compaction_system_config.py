@@ -0,0 +1,23 @@
+
+from typing import Optional
+
+first_cycle_delay = 60.0 # seconds after start before the first compaction cycle
+cycle_period = 3600.0 # seconds between the end of a cycle and the start of the next
+step_time_budget = 0.005 # seconds of compaction per Update, checked between steps
+batch_size = 200 # ids or rowids looked at per step
+vacuum_pages = 256 # free pages given back per step
+
+# fields kept in the payloads of off-topic users and tweets, "a.b" keeps b in object a.
+# Every field the tasks, data_system_query and data_system_export read must stay listed
+hot_fields: dict[str, list[str]] = {
+	"users": ["id", "username", "public_metrics"],
+	"tweets": ["id", "author_id", "text", "referenced_tweets", "entities.mentions"],
+}
+
+# newest inserted rows kept per table, None keeps them all. Dropping users or tweets
+# drops their processed flags of the default campaign too, they may be crawled again
+max_rows: dict[str, Optional[int]] = {
+	"users": None,
+	"tweets": None,
+	"follows": 10_000_000,
+}
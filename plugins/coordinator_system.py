@@ -0,0 +1,526 @@
+
+from __future__ import annotations
+
+import multiprocessing
+import time
+import traceback
+from dataclasses import dataclass, field
+from functools import partial
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Optional, TypeVar
+
+import plugins.coordinator_system_config as coordinator_system_config
+import plugins.data_system_config as data_system_config
+
+from event import Event, Error
+from factory import Factory
+from herald import Herald
+from locator import Locator, LocatorEvent, Update
+from plugin_loader import assert_tags, lazy_import
+from plugins.data_system import DEFAULT_CAMPAIGN, Database, DataSystem, create_api, normalize_username
+from plugins.task_system import (
+	Campaign, ShuttingDown, Task, TaskSystem, TaskSystemEvent, is_fusable, locate_data_system, locate_task_system,
+)
+
+tweepy = lazy_import("tweepy")
+
+T = TypeVar("T")
+
+# what each api endpoint fetches by id, see fetch_keys
+fetch_kinds = {"get_user": "user", "get_tweet": "tweet", "get_users_tweets": "timeline", "get_users_followers": "followers"}
+
+def fetch_keys(endpoint: str, kwargs: dict[str, Any]) -> list[tuple[str, Any]]:
+	"""the objects an api call fetches, no two workers fetch one of them at once"""
+
+	if endpoint == "get_users":
+		return [("username", normalize_username(username)) for username in kwargs["usernames"]]
+
+	if (kind := fetch_kinds.get(endpoint)) is None:
+		return []
+
+	return [(kind, int(kwargs["id"]))]
+
+@dataclass
+class FetchClaim:
+	"""sent by a worker before an api call, the coordinator answers whether it may fetch"""
+
+	keys: list[tuple[str, Any]]
+
+class FetchClaimed(Exception):
+	"""another worker is fetching the same object, the task is handed back to the coordinator"""
+
+class WorkerDataSystem(DataSystem):
+	"""DataSystem of a worker process
+
+	Reads go to a read-only connection, writes are recorded as changes for the
+	coordinator to apply, and kept in memory until then so the batch sees them.
+	Each api call first claims what it fetches from the coordinator, and raises
+	FetchClaimed when another worker holds the claim."""
+
+	def __init__(self, connection: Optional[Connection] = None):
+
+		self.connection = connection
+		self.changes: list[tuple] = []
+		self._claimed: set[tuple[str, Any]] = set()
+		self._users: dict[int, tweepy.User] = {}
+		self._tweets: dict[int, tweepy.Tweet] = {}
+		self._processed: set[tuple[int, str]] = set()
+		self._processed_tweets: set[tuple[int, str]] = set()
+		DataSystem.__init__(self, Database(data_system_config.data_system_file, read_only=True))
+
+	def _create_tables(self):
+		pass
+
+	def flush(self) -> list[tuple]:
+
+		changes = self.changes
+		self.changes = []
+		self._users.clear()
+		self._tweets.clear()
+		self._processed.clear()
+		self._processed_tweets.clear()
+		self._claimed.clear()
+
+		# other workers may process these ids before the next batch
+		for known in self._known_processed.values():
+			known.clear()
+
+		return changes
+
+	def _claim(self, keys: list[tuple[str, Any]]):
+
+		if self.connection is None or not (keys := [key for key in keys if key not in self._claimed]):
+			return
+
+		self.connection.send(FetchClaim(keys=keys))
+
+		if not self.connection.recv():
+			raise FetchClaimed(keys)
+
+		self._claimed.update(keys)
+
+	def _api_call(self, f: Callable[..., T], *args, **kwargs) -> T:
+
+		self._claim(fetch_keys(getattr(f, "__name__", "unknown"), kwargs))
+		return DataSystem._api_call(self, f, *args, **kwargs)
+
+	def is_processed(self, user_id: int, campaign: str = DEFAULT_CAMPAIGN) -> bool:
+		return (user_id, campaign) in self._processed or DataSystem.is_processed(self, user_id, campaign)
+
+	def tag_processed(self, user_id: int, campaign: str = DEFAULT_CAMPAIGN):
+
+		self._processed.add((user_id, campaign))
+		self.changes.append(("tag_processed", user_id, campaign))
+
+	def is_tweet_processed(self, tweet_id: int, campaign: str = DEFAULT_CAMPAIGN) -> bool:
+		return (tweet_id, campaign) in self._processed_tweets or DataSystem.is_tweet_processed(self, tweet_id, campaign)
+
+	def tag_tweet_processed(self, tweet_id: int, campaign: str = DEFAULT_CAMPAIGN):
+
+		self._processed_tweets.add((tweet_id, campaign))
+		self.changes.append(("tag_tweet_processed", tweet_id, campaign))
+
+	def _add_follow(self, actor: int, target: int):
+		self.changes.append(("add_follow", actor, target))
+
+	def _tag_fetched(self, kind: str, id: int, items: Optional[list[int]] = None):
+		# the stored rows are only read back once the coordinator applied them along with the tag
+		self.changes.append(("tag_fetched", kind, id, items))
+
+	def _get_user(self, id: int) -> Optional[tweepy.User]:
+
+		if (user := self._users.get(id)) is not None:
+			return user
+
+		return DataSystem._get_user(self, id)
+
+	def _set_user(self, user: tweepy.User):
+
+		self._users[int(user.id)] = user
+		self._remember_username(user.username, int(user.id))
+		self.changes.append(("set_user", user.data))
+
+	def _get_tweet(self, id: int) -> Optional[tweepy.Tweet]:
+
+		if (tweet := self._tweets.get(id)) is not None:
+			return tweet
+
+		return DataSystem._get_tweet(self, id)
+
+	def _set_tweet(self, tweet: tweepy.Tweet):
+
+		self._tweets[int(tweet.id)] = tweet
+		self.changes.append(("set_tweet", tweet.data))
+
+def create_worker_api_factory(index: int) -> Callable[[], tweepy.Client]:
+	"""creator of worker index's api client, sent to the worker process so it must pickle"""
+	return partial(create_api, coordinator_system_config.worker_login_dirs[index])
+
+if not Factory.has("twitter_worker_api"):
+	Factory.set("twitter_worker_api", create_worker_api_factory)
+
+class WorkerTaskSystem(Herald[TaskSystemEvent]):
+	"""TaskSystem of a worker process, new tasks are sent back to the coordinator"""
+
+	tags = {"task_system",}
+
+	def __init__(self, campaigns: dict[str, list[str]]):
+
+		Herald.__init__(self)
+		self._campaigns = {name: Campaign(name=name, keywords=keywords) for name, keywords in campaigns.items()}
+		self.campaign = next(iter(self._campaigns.values()))
+		self.new_tasks: list[str] = []
+		self.ran_inline = 0
+		self._fusion_depth = 0
+
+	def put_task(self, task: Task, campaign_name: Optional[str] = None):
+		"""new tasks go back to the coordinator, in the campaign of the batch"""
+		self.new_tasks.append(task.save())
+
+	def set_campaign(self, name: str):
+		self.campaign = self._campaigns[name]
+
+	def put_next(self, task: Task):
+
+		if not is_fusable(task, self._fusion_depth):
+			self.put_task(task)
+			return
+
+		self._fusion_depth += 1
+
+		try:
+			if task.check():
+				self.ran_inline += 1
+				task.run()
+
+		finally:
+			self._fusion_depth -= 1
+
+	def pending_tasks(self) -> int:
+		return len(self.new_tasks)
+
+	def defer(self, new_tasks: int, ran_inline: int):
+		"""forgets what a task handed back to the coordinator queued or ran since, it runs again later"""
+
+		del self.new_tasks[new_tasks:]
+		self.ran_inline = ran_inline
+		self._fusion_depth = 0
+
+	def flush(self) -> list[str]:
+
+		new_tasks = self.new_tasks
+		self.new_tasks = []
+		self.ran_inline = 0
+		return new_tasks
+
+@dataclass
+class WorkerReport:
+
+	changes: list[tuple]
+	new_tasks: list[str]
+	deferred: list[str] # tasks that met another worker's fetch, to be queued again
+	failures: list[str]
+	ran: int
+	api_calls: int
+
+def worker_main(connection: Connection, api_factory: Callable[[], Any], campaigns: dict[str, list[str]]):
+	"""Runs batches of (campaign name, saved tasks) until it receives None"""
+
+	Factory.set("twitter_api", api_factory)
+	data_system = WorkerDataSystem(connection)
+	task_system = WorkerTaskSystem(campaigns)
+	Locator.add_system(data_system)
+	Locator.add_system(task_system)
+
+	while (message := connection.recv()) is not None:
+
+		campaign_name, batch = message
+		task_system.set_campaign(campaign_name)
+		api_calls = data_system.api_calls
+		deferred: list[str] = []
+		failures: list[str] = []
+		ran = 0
+
+		for saved in batch:
+
+			new_tasks, ran_inline = len(task_system.new_tasks), task_system.ran_inline
+
+			try:
+				task = Task.load(saved)
+
+				if task.check():
+					ran += 1
+					task.run()
+
+			except FetchClaimed:
+				ran -= 1
+				task_system.defer(new_tasks, ran_inline)
+				deferred.append(saved)
+
+			except Exception:
+				failures.append(f"{saved}\n{traceback.format_exc()}")
+
+		ran += task_system.ran_inline
+		connection.send(WorkerReport(
+			changes=data_system.flush(),
+			new_tasks=task_system.flush(),
+			deferred=deferred,
+			failures=failures,
+			ran=ran,
+			api_calls=data_system.api_calls - api_calls,
+		))
+
+class CoordinatorSystemEvent(Event): ...
+class CoordinatorSystemError(Error, CoordinatorSystemEvent): ...
+
+@dataclass
+class StartedWorkers(CoordinatorSystemEvent):
+
+	amount: int
+
+@dataclass
+class CompletedBatch(CoordinatorSystemEvent):
+
+	worker: int
+	taken: int
+	ran: int
+	deferred: int
+
+@dataclass
+class WorkerTaskFailed(CoordinatorSystemError):
+
+	worker: int
+	report: str
+
+@dataclass
+class WorkerDied(CoordinatorSystemError):
+
+	worker: int
+	requeued_tasks: int
+
+@dataclass
+class Worker:
+
+	index: int
+	process: Any
+	connection: Connection
+	leased: list[Task] = field(default_factory=list)
+	claimed: set[tuple[str, Any]] = field(default_factory=set) # fetches granted during the batch
+	campaign: str = DEFAULT_CAMPAIGN # of the leased tasks
+	alive: bool = True
+
+class CoordinatorSystem(Herald[CoordinatorSystemEvent]):
+	"""Runs queued tasks in worker processes
+
+	The coordinator keeps the frontier (the TaskSystem queue) and the only
+	database writer. Each task's lease_key, the user or tweet it is about, is
+	leased to a single worker at a time, so two workers never run tasks on the
+	same user or tweet concurrently. Workers claim every object before fetching
+	it, the coordinator grants a claim to one worker until its batch is applied,
+	so the others then find the object stored. A task denied a claim is handed
+	back and queued again."""
+
+	tags = {"coordinator_system"}
+
+	def __init__(self, task_system: TaskSystem, data_system: DataSystem):
+
+		Herald.__init__(self)
+		self._task_system = task_system
+		self._data_system = data_system
+		self._workers: list[Worker] = []
+		self._leased_keys: set[tuple[str, int]] = set()
+		self._claims: dict[tuple[str, Any], int] = {} # fetches in flight, to the worker index
+
+	def start(self):
+
+		context = multiprocessing.get_context("spawn")
+		campaigns = {campaign.name: campaign.keywords for campaign in self._task_system.campaigns()}
+
+		for index in range(len(coordinator_system_config.worker_login_dirs)):
+
+			connection, worker_connection = context.Pipe()
+			process = context.Process(
+				target=worker_main,
+				args=(worker_connection, Factory.create("twitter_worker_api", object, index), campaigns),
+				name=f"crawl_worker_{index}",
+				daemon=True,
+			)
+			process.start()
+			worker_connection.close()
+			self._workers.append(Worker(index=index, process=process, connection=connection))
+
+		self._task_system.set_local_execution(False)
+		self._dispatch_event(StartedWorkers(amount=len(self._workers)))
+
+	def leased_tasks(self) -> int:
+		return sum(len(worker.leased) for worker in self._workers)
+
+	def _release(self, worker: Worker):
+
+		for task in worker.leased:
+			if (key := task.lease_key()) is not None:
+				self._leased_keys.discard(key)
+
+		worker.leased = []
+
+		for key in worker.claimed:
+			del self._claims[key]
+
+		worker.claimed = set()
+
+	def _bury(self, worker: Worker):
+
+		worker.alive = False
+		requeued = worker.leased
+		self._release(worker)
+
+		for task in requeued:
+			self._task_system.put_task(task, worker.campaign)
+
+		self._dispatch_event(WorkerDied(worker=worker.index, requeued_tasks=len(requeued)))
+
+	def _grant(self, worker: Worker, claim: FetchClaim):
+
+		granted = all(self._claims.get(key, worker.index) == worker.index for key in claim.keys)
+
+		if granted:
+			worker.claimed.update(claim.keys)
+			self._claims.update((key, worker.index) for key in claim.keys)
+
+		try:
+			worker.connection.send(granted)
+
+		except (BrokenPipeError, OSError):
+			self._bury(worker)
+
+	def _receive(self, worker: Worker) -> bool:
+		"""handles a message of the worker, True once its batch is over"""
+
+		try:
+			report: WorkerReport | FetchClaim = worker.connection.recv()
+
+		except (EOFError, OSError):
+			self._bury(worker)
+			return True
+
+		if isinstance(report, FetchClaim):
+			self._grant(worker, report)
+			return not worker.alive
+
+		self._data_system.apply_changes(report.changes)
+		self._task_system.charge(worker.campaign, report.api_calls)
+		taken = len(worker.leased)
+		self._release(worker)
+		self._dispatch_event(CompletedBatch(worker=worker.index, taken=taken, ran=report.ran, deferred=len(report.deferred)))
+
+		for failure in report.failures:
+			self._dispatch_event(WorkerTaskFailed(worker=worker.index, report=failure))
+
+		for saved in report.new_tasks + report.deferred:
+			self._task_system.put_task(Task.load(saved), worker.campaign)
+
+		return True
+
+	def _collect(self, timeout: float):
+		"""answers claims until a batch is over or the timeout passes"""
+
+		deadline = time.monotonic() + timeout
+
+		while busy := {worker.connection: worker for worker in self._workers if worker.alive and worker.leased}:
+
+			over = False
+
+			for connection in wait(list(busy), timeout=max(0, deadline - time.monotonic())):
+				over |= self._receive(busy[connection]) #type: ignore
+
+			if over or time.monotonic() >= deadline:
+				return
+
+	def _lease(self, worker: Worker) -> bool:
+
+		campaign, tasks = self._task_system.take_tasks(coordinator_system_config.batch_size, self._leased_keys)
+
+		if not tasks:
+			return False
+
+		worker.leased = tasks
+		worker.campaign = campaign
+		self._leased_keys.update(key for task in tasks if (key := task.lease_key()) is not None)
+
+		try:
+			worker.connection.send((campaign, [task.save() for task in tasks]))
+
+		except (BrokenPipeError, OSError):
+			self._bury(worker)
+
+		return True
+
+	def _tick(self):
+
+		idle = [worker for worker in self._workers if worker.alive and not worker.leased]
+		self._collect(0 if idle and self._task_system.pending_tasks() else coordinator_system_config.poll_timeout)
+
+		for worker in self._workers:
+			if worker.alive and not worker.leased:
+				if not self._lease(worker):
+					break
+
+	def stop(self):
+
+		deadline = time.monotonic() + coordinator_system_config.shutdown_timeout
+
+		while any(worker.alive and worker.leased for worker in self._workers) and (remaining := deadline - time.monotonic()) > 0:
+			self._collect(remaining)
+
+		for worker in self._workers:
+
+			if not worker.alive:
+				continue
+
+			if worker.leased:
+				self._bury(worker)
+
+			else:
+
+				try:
+					worker.connection.send(None)
+
+				except (BrokenPipeError, OSError):
+					pass
+
+		for worker in self._workers:
+
+			worker.process.join(timeout=1)
+
+			if worker.process.is_alive():
+				worker.process.terminate()
+
+		self._workers = []
+		self._task_system.set_local_execution(True)
+
+	def on_event(self, event: LocatorEvent | TaskSystemEvent):
+
+		if isinstance(event, Update):
+			self._tick()
+
+		elif isinstance(event, ShuttingDown):
+			self.stop()
+
+tags = {"coordinator_system"}
+requires = {"task_system", "data_system"}
+
+def initialize():
+
+	assert_tags(existing=Locator.loaded_tags, required=requires)
+	task_system = locate_task_system()
+	coordinator_system = CoordinatorSystem(task_system, locate_data_system()) #type: ignore
+	coordinator_system.start()
+	task_system.add_observer(coordinator_system)
+	Locator.add_system(coordinator_system)
+	Locator.add_observer(coordinator_system)
+
+def finalize():
+	"""leased tasks are collected or requeued before the workers go away"""
+
+	if (coordinator_system := Locator.get_system({"coordinator_system"})) is not None:
+		coordinator_system.stop() #type: ignore
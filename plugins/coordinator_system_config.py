@@ -0,0 +1,10 @@
+
+from pathlib import Path
+
+from plugins.data_system_config import api_login_dir
+
+# one worker process per credentials directory, laid out like api_login_dir
+worker_login_dirs: list[Path] = [api_login_dir/"worker_0", api_login_dir/"worker_1"]
+batch_size = 8 # tasks sent to a worker at once
+poll_timeout = 0.01 # seconds spent waiting for workers when all of them are busy
+shutdown_timeout = 60.0 # seconds granted to busy workers on exit before their tasks get requeued
@@ -3,37 +3,82 @@ from __future__ import annotations
 
 import sqlite3
 import time
-import requests
 import json
-import tweepy #type: ignore
 
+from functools import partial
 from pathlib import Path
-from typing import Any, Callable, Iterable, Optional, TypeVar
+from typing import Any, Callable, Iterable, Optional, Protocol, TypeVar
 
 import plugins.data_system_config as data_system_config
 
 from event import Event, Error
+from factory import Factory
 from herald import Herald
+from metrics import Histogram, Metrics
 from locator import Locator
+from plugin_loader import lazy_import
+from plugins.data_system_cassette import cassette_client
+from plugins.data_system_changes import ChangeLog
+
+tweepy = lazy_import("tweepy")
+requests = lazy_import("requests")
 
 DefaultType = TypeVar("DefaultType")
 
 class Database:
 
-	def __init__(self, file: Path) -> None:
+	def __init__(self, file: Path, read_only: bool = False, check_same_thread: bool = True) -> None:
 		
-		self._connector = sqlite3.connect(file)
+		if read_only:
+			self._connector = sqlite3.connect(f"file:{file}?mode=ro", uri=True, check_same_thread=check_same_thread)
+			self._connector.execute("PRAGMA query_only = 1")
+
+		else:
+			self._connector = sqlite3.connect(file, check_same_thread=check_same_thread)
+			# only applies to a new file, see compaction_system for existing ones
+			self._connector.execute("PRAGMA auto_vacuum = INCREMENTAL")
+			self._connector.execute("PRAGMA journal_mode = WAL")
+
 		self._cursor = self._connector.cursor()
+		self._exec_metric = Metrics.histogram("sqlite_query_seconds", "SQLite statement time, commit included", kind="exec")
+		self._fetch_metric = Metrics.histogram("sqlite_query_seconds", "SQLite statement time, commit included", kind="fetch")
+
+	def exec(self, sql: str, params: dict[str, Any] = {}) -> int:
+		"""returns the rows the statement inserted, updated or deleted"""
+
+		with self._exec_metric.time():
+			self._cursor.execute(sql, params)
+			self._connector.commit()
+			return max(self._cursor.rowcount, 0)
+
+	def exec_all(self, sqls: Iterable[str], params: dict[str, Any] = {}) -> int:
+		"""runs the statements in turn with the same params, in a single transaction, returns the rows they changed"""
+
+		changed = 0
+
+		with self._exec_metric.time():
+
+			for sql in sqls:
+				self._cursor.execute(sql, params)
+				changed += max(self._cursor.rowcount, 0)
 
-	def exec(self, sql: str, params: dict[str, Any] = {}):
+			self._connector.commit()
 
-		self._cursor.execute(sql, params)
-		self._connector.commit()
+		return changed
+
+	def exec_many(self, sql: str, params: Iterable[dict[str, Any]]) -> int:
+		"""runs the statement once per params, in a single transaction, returns the rows it changed"""
+
+		with self._exec_metric.time():
+			self._cursor.executemany(sql, params)
+			self._connector.commit()
+			return max(self._cursor.rowcount, 0)
 
 	def fetch(self, sql: str, params: dict[str, Any] = {}) -> list:
 
-		self._cursor.execute(sql, params)
-		return list(self._cursor.fetchall())
+		with self._fetch_metric.time():
+			self._cursor.execute(sql, params)
+			return list(self._cursor.fetchall())
 
 	def fetch_one(self,
 		sql: str, params: dict[str, Any] = {},
@@ -44,11 +89,43 @@ class Database:
 
 		return default
 
-def read_api_login_file(name: str) -> str:
+	def incremental_vacuum(self, pages: int):
+		"""gives up to pages free pages back, run as a script since execute stops the pragma after one page"""
+
+		with self._exec_metric.time():
+			self._connector.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+
+	def stream(self, sql: str, params: dict[str, Any] = {}, batch_size: int = 10_000) -> Iterable[list]:
+		"""Yields the result in batches, on its own cursor so it can outlive other queries"""
+
+		cursor = self._connector.cursor()
+
+		try:
+			cursor.execute(sql, params)
+
+			while (rows := cursor.fetchmany(batch_size)):
+				yield rows
+
+		finally:
+			cursor.close()
+
+def read_api_login_file(name: str, login_dir: Path = data_system_config.api_login_dir) -> str:
 
-	with open(data_system_config.api_login_dir/name, "r", encoding="utf-8") as f:
+	with open(login_dir/name, "r", encoding="utf-8") as f:
 		return f.read()
 
+def create_api(login_dir: Path = data_system_config.api_login_dir) -> tweepy.Client:
+
+	return tweepy.Client(
+		consumer_key=read_api_login_file("api_key.txt", login_dir),
+		consumer_secret=read_api_login_file("api_key_secret.txt", login_dir),
+		access_token=read_api_login_file("access_token.txt", login_dir),
+		access_token_secret=read_api_login_file("access_token_secret.txt", login_dir),
+		bearer_token=read_api_login_file("bearer_token.txt", login_dir),
+		wait_on_rate_limit=True,
+		return_type=requests.Response,
+	)
+
 def get_data(answer: requests.Response) -> Optional[dict]:
 
 	if not answer.status_code == 200: return None
@@ -73,8 +150,31 @@ def get_meta(answer: requests.Response) -> Optional[dict]:
 
 	return meta
 
+def normalize_username(username: str) -> str:
+	"""usernames are case insensitive, and mentions may carry the @"""
+	return username.removeprefix("@").lower()
+
+def like_pattern(keyword: str) -> str:
+	"""matches text containing keyword, case insensitively, in a LIKE ... ESCAPE '\\' """
+	return "%" + keyword.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+# campaign whose processed flags live in the users and tweets tables, see task_system_config.campaigns
+DEFAULT_CAMPAIGN = ""
+
+# below SQLITE_MAX_VARIABLE_NUMBER of sqlite builds older than 3.32
+sqlite_max_params = 999
+
 T = TypeVar("T")
 
+def next_version(table: str) -> str:
+	"""SQL expression of the version of a row inserted or updated now, see data_system_export"""
+	return f"(SELECT coalesce(max(version), 0) + 1 FROM {table})"
+
+class DataHookProtocol(Protocol):
+	"""Wraps every api call and database write of the DataSystem, kind being "api" or "db" """
+
+	def around_call(self, kind: str, name: str, f: Callable[[], T]) -> T: ...
+
 class DataSystemEvent(Event): ...
 class DataSystemError(Error, DataSystemEvent): ...
 
@@ -85,114 +185,392 @@ class DataSystem(Herald[DataSystemEvent]):
 
 	tags = {"data_system", "tweet_data", "user_data", "username_conversion"}
 
-	def __init__(self):
+	def __init__(self, database: Optional[Database] = None, change_log: Optional[ChangeLog] = None):
 
 		Herald.__init__(self)
-		self._database = Database(data_system_config.data_system_file)
+		self._database = Database(data_system_config.data_system_file) if database is None else database
+		self._change_log = change_log
+		self._create_tables()
+		self._cache_metrics = {
+			(cache, result): Metrics.counter("cache_requests_total", "Local database lookups, by outcome", cache=cache, result=result)
+			for cache in ("user", "tweet", "username", "timeline", "followers") for result in ("hit", "miss")
+		}
+		self._api_metrics: dict[str, Histogram] = {} # endpoint -> latency, resolved once per endpoint
+		self._api_instance: Optional[tweepy.Client] = None
+		# normalized username -> id. Usernames the api does not know are not kept, the account may be created or renamed later
+		self._username_ids: dict[str, int] = {}
+		# (table, campaign) -> id -> processed flag, read ahead of the tasks checking it
+		self._known_processed: dict[tuple[str, str], dict[int, bool]] = {}
+		self._data_hooks: list[DataHookProtocol] = []
+		self.api_calls = 0
+
+	@property
+	def database(self) -> Database:
+		"""the writer connection, shared with systems maintaining the database"""
+		return self._database
+
+	@property
+	def _api(self) -> tweepy.Client:
+		"""created on first call, so that tweepy is only imported when needed"""
+
+		if self._api_instance is None:
+			self._api_instance = cassette_client(partial(Factory.create, "twitter_api", object))
+
+		return self._api_instance
+
+	def _create_tables(self):
+
 		self._database.exec(
 			"CREATE TABLE IF NOT EXISTS users ("
-			"id integer, username text, processed integer, data text"
+			"id integer, username text, processed integer, data text, version integer"
 			")"
 		)
 		self._database.exec(
 			"CREATE TABLE IF NOT EXISTS tweets ("
-			"id integer, author integer, processed integer, data text"
+			"id integer, author integer, processed integer, data text, version integer"
 			")"
 		)
 		self._database.exec(
 			"CREATE TABLE IF NOT EXISTS follows ("
-			"actor integer, target integer"
+			"actor integer, target integer, version integer"
 			")"
 		)
-		self._api: tweepy.Client = tweepy.Client(
-			consumer_key=read_api_login_file("api_key.txt"),
-			consumer_secret=read_api_login_file("api_key_secret.txt"),
-			access_token=read_api_login_file("access_token.txt"),
-			access_token_secret=read_api_login_file("access_token_secret.txt"),
-			bearer_token=read_api_login_file("bearer_token.txt"),
-			wait_on_rate_limit=True,
-			return_type=requests.Response,
+
+		for table in ("users", "tweets", "follows"):
+			self._add_version(table)
+
+		self._database.exec(
+			"CREATE TABLE IF NOT EXISTS campaign_processed ("
+			"campaign text, kind text, id integer, PRIMARY KEY (campaign, kind, id)"
+			") WITHOUT ROWID"
+		)
+		# timelines and follower lists stored whole, served from the tables by any campaign until
+		# fetched_max_age. items holds the tweet ids of a timeline, as a json list in api order
+		self._database.exec(
+			"CREATE TABLE IF NOT EXISTS fetched ("
+			"kind text, id integer, time real, items text, PRIMARY KEY (kind, id)"
+			") WITHOUT ROWID"
 		)
+		columns = {column for _, column, *_ in self._database.fetch("PRAGMA table_info(fetched)")}
+
+		for column in ("time real", "items text"):
+			if column.split()[0] not in columns:
+				# marks from before it have no time, they count as expired
+				self._database.exec(f"ALTER TABLE fetched ADD COLUMN {column}")
+		# lookups by id and the keyset pagination of data_system_query
+		self._database.exec("CREATE INDEX IF NOT EXISTS users_id ON users (id)")
+		self._database.exec("CREATE INDEX IF NOT EXISTS tweets_id ON tweets (id)")
+		self._database.exec("CREATE INDEX IF NOT EXISTS tweets_author ON tweets (author)")
+		self._database.exec("CREATE INDEX IF NOT EXISTS users_username ON users (lower(username))")
+		self._database.exec("CREATE INDEX IF NOT EXISTS follows_pair ON follows (target, actor)")
+		self._database.exec(
+			"CREATE INDEX IF NOT EXISTS users_followers_count ON users ("
+			"json_extract(data, '$.public_metrics.followers_count'), id"
+			")"
+		)
+
+	def _add_version(self, table: str):
+		"""rows of files older than the version column get their rowid, which orders them the same"""
+
+		if "version" not in {column for _, column, *_ in self._database.fetch(f"PRAGMA table_info({table})")}:
+			self._database.exec_all((f"ALTER TABLE {table} ADD COLUMN version integer", f"UPDATE {table} SET version = rowid"))
+
+		self._database.exec(f"CREATE INDEX IF NOT EXISTS {table}_version ON {table} (version)")
+
+	def add_data_hook(self, hook: DataHookProtocol):
+		self._data_hooks.append(hook)
+
+	def rem_data_hook(self, hook: DataHookProtocol):
+		self._data_hooks.remove(hook)
+
+	def _call(self, kind: str, name: str, f: Callable[[], T]) -> T:
+
+		for hook in reversed(self._data_hooks):
+			f = partial(hook.around_call, kind, name, f)
+
+		return f()
+
+	def _write(self, name: str, sql: str | tuple[str, ...], params: dict[str, Any], change: tuple):
+		"""runs a write, several statements in one transaction, then appends it to the change log once committed
+
+		Statements are written to change nothing when the row is already as
+		wanted, and a write that changed no row is left out of the log."""
+
+		write = partial(self._database.exec, sql, params) if isinstance(sql, str) else partial(self._database.exec_all, sql, params)
+
+		if self._call("db", name, write) and self._change_log is not None:
+			self._change_log.append(change)
+
+	def _write_many(self, name: str, sql: str, params: list[dict[str, Any]], changes: list[tuple]):
+		"""runs a write once per params in one transaction, then appends its changes to the change log"""
+
+		if self._call("db", name, partial(self._database.exec_many, sql, params)) and self._change_log is not None:
+			for change in changes:
+				self._change_log.append(change)
 
 	def _api_call(self, f: Callable[..., T], *args, **kwargs) -> T:
 
+		endpoint = getattr(f, "__name__", "unknown")
+		self.api_calls += 1
+
+		if (metric := self._api_metrics.get(endpoint)) is None:
+			metric = self._api_metrics[endpoint] = Metrics.histogram("api_call_seconds", "Twitter API call latency per endpoint", endpoint=endpoint)
+
 		try:
-			return f(*args, **kwargs)
+			with metric.time():
+				return self._call("api", endpoint, partial(f, *args, **kwargs))
 
 		except tweepy.TwitterServerError:
 
+			Metrics.counter("api_errors_total", "Twitter API server errors per endpoint", endpoint=endpoint).inc()
 			self._dispatch_event(TwitterConnectionError())
 			time.sleep(30)
 			return self._api_call(f, *args, **kwargs)
 
-	def is_processed(self, user_id: int) -> bool:
-		return bool(self._get(bool, "users", user_id, "processed"))
+	def _prefetch_processed(self, table: str, ids: Iterable[int], campaign: str):
 
-	def tag_processed(self, user_id: int):
-		self._database.exec(
-			f"UPDATE users SET processed = 1 WHERE id = :id", {"id": user_id}
-		)
+		known = self._known_processed.setdefault((table, campaign), {})
+		wanted = [id for id in dict.fromkeys(ids) if id not in known]
 
-	def is_tweet_processed(self, tweet_id: int) -> bool:
-		return bool(self._get(bool, "tweets", tweet_id, "processed"))
+		if len(known) + len(wanted) > data_system_config.processed_cache_size:
+			known.clear()
 
-	def tag_tweet_processed(self, tweet_id: int):
-		self._database.exec(
-			f"UPDATE tweets SET processed = 1 WHERE id = :id", {"id": tweet_id}
+		# campaigns other than the default bind :campaign and :kind too
+		chunk_size = sqlite_max_params if campaign == DEFAULT_CAMPAIGN else sqlite_max_params - 2
+
+		for i in range(0, len(wanted), chunk_size):
+
+			chunk = wanted[i:i + chunk_size]
+			params: dict[str, Any] = {f"id{j}": id for j, id in enumerate(chunk)}
+			ids_list = ", ".join(":" + name for name in params)
+
+			if campaign == DEFAULT_CAMPAIGN:
+				sql = f"SELECT id, max(processed) FROM {table} WHERE id IN ({ids_list}) GROUP BY id"
+
+			else:
+				sql = f"SELECT id, 1 FROM campaign_processed WHERE campaign = :campaign AND kind = :kind AND id IN ({ids_list})"
+				params |= {"campaign": campaign, "kind": table}
+
+			found = dict(self._database.fetch(sql, params))
+
+			for id in chunk:
+				known[id] = bool(found.get(id))
+
+	def _is_processed(self, table: str, id: int, campaign: str) -> bool:
+
+		if (processed := self._known_processed.get((table, campaign), {}).get(id)) is not None:
+			return processed
+
+		if campaign == DEFAULT_CAMPAIGN:
+			return bool(self._get(bool, table, id, "processed"))
+
+		return self._database.fetch_one(
+			"SELECT 1 FROM campaign_processed WHERE campaign = :campaign AND kind = :kind AND id = :id",
+			{"campaign": campaign, "kind": table, "id": id},
+		) is not None
+
+	def _tag_processed(self, table: str, id: int, campaign: str):
+
+		name = "tag_processed" if table == "users" else "tag_tweet_processed"
+
+		if campaign == DEFAULT_CAMPAIGN:
+			self._write(name, f"UPDATE {table} SET processed = 1, version = {next_version(table)} WHERE id = :id AND processed IS NOT 1", {"id": id}, (name, id, campaign))
+
+		else:
+			self._write(
+				name,
+				"INSERT OR IGNORE INTO campaign_processed VALUES (:campaign, :kind, :id)",
+				{"campaign": campaign, "kind": table, "id": id},
+				(name, id, campaign),
+			)
+
+		self._known_processed.setdefault((table, campaign), {})[id] = True
+
+	def _tag_all_processed(self, table: str, ids: Iterable[int], campaign: str):
+
+		name = "tag_processed" if table == "users" else "tag_tweet_processed"
+		ids = list(dict.fromkeys(ids))
+		self._prefetch_processed(table, ids, campaign)
+		known = self._known_processed[table, campaign]
+		ids = [id for id in ids if not known[id]]
+
+		if campaign == DEFAULT_CAMPAIGN:
+			sql = f"UPDATE {table} SET processed = 1, version = {next_version(table)} WHERE id = :id AND processed IS NOT 1"
+
+		else:
+			sql = "INSERT OR IGNORE INTO campaign_processed VALUES (:campaign, :kind, :id)"
+
+		self._write_many(name, sql, [{"campaign": campaign, "kind": table, "id": id} for id in ids], [(name, id, campaign) for id in ids])
+		known.update(dict.fromkeys(ids, True))
+
+	def prefetch_processed(self, user_ids: Iterable[int], campaign: str = DEFAULT_CAMPAIGN):
+		"""Reads the processed flags of users in one query, so that is_processed answers from memory"""
+		self._prefetch_processed("users", user_ids, campaign)
+
+	def is_processed(self, user_id: int, campaign: str = DEFAULT_CAMPAIGN) -> bool:
+		return self._is_processed("users", user_id, campaign)
+
+	def tag_processed(self, user_id: int, campaign: str = DEFAULT_CAMPAIGN):
+		self._tag_processed("users", user_id, campaign)
+
+	def tag_all_processed(self, user_ids: Iterable[int], campaign: str = DEFAULT_CAMPAIGN):
+		"""tag_processed of many users, in one transaction"""
+		self._tag_all_processed("users", user_ids, campaign)
+
+	def prefetch_tweets_processed(self, tweet_ids: Iterable[int], campaign: str = DEFAULT_CAMPAIGN):
+		"""Reads the processed flags of tweets in one query, so that is_tweet_processed answers from memory"""
+		self._prefetch_processed("tweets", tweet_ids, campaign)
+
+	def is_tweet_processed(self, tweet_id: int, campaign: str = DEFAULT_CAMPAIGN) -> bool:
+		return self._is_processed("tweets", tweet_id, campaign)
+
+	def tag_tweet_processed(self, tweet_id: int, campaign: str = DEFAULT_CAMPAIGN):
+		self._tag_processed("tweets", tweet_id, campaign)
+
+	def tag_all_tweets_processed(self, tweet_ids: Iterable[int], campaign: str = DEFAULT_CAMPAIGN):
+		"""tag_tweet_processed of many tweets, in one transaction"""
+		self._tag_all_processed("tweets", tweet_ids, campaign)
+
+	def _is_fetched(self, kind: str, id: int) -> bool:
+		return self._database.fetch_one(
+			"SELECT 1 FROM fetched WHERE kind = :kind AND id = :id AND time > :since",
+			{"kind": kind, "id": id, "since": time.time() - data_system_config.fetched_max_age},
+		) is not None
+
+	def _tag_fetched(self, kind: str, id: int, items: Optional[list[int]] = None):
+		self._write(
+			"tag_fetched",
+			"INSERT OR REPLACE INTO fetched (kind, id, time, items) VALUES (:kind, :id, :time, :items)",
+			{"kind": kind, "id": id, "time": time.time(), "items": None if items is None else json.dumps(items)},
+			("tag_fetched", kind, id, items),
 		)
 
 	def get_followers(self, user_id: int) -> Iterable[int]:
-		
+		"""from the follows table for fetched_max_age once every page was fetched, by any campaign"""
+
+		if self._is_fetched("followers", user_id):
+
+			self._cache_metrics["followers", "hit"].inc()
+
+			for (actor,) in self._database.fetch("SELECT DISTINCT actor FROM follows WHERE target = :target", {"target": user_id}):
+				yield actor
+
+			return
+
+		self._cache_metrics["followers", "miss"].inc()
 		pagination_token = None
 
 		while True:
 
 			if (ans := self._api_call(self._api.get_users_followers, id=user_id, pagination_token=pagination_token, user_fields=["public_metrics", "username"])) is None:
-				break
+				return
 
-			data, meta = get_data(ans), get_meta(ans)
-
-			if data is None or meta is None:
-				break
+			if ans.status_code != 200:
+				return
 
-			for user_data in data:
+			for user_data in get_data(ans) or []:
 				self._set_user(tweepy.User(user_data))
-				self._database.exec("INSERT INTO follows VALUES (:actor, :target)", {"actor": int(user_data["id"]), "target": user_id})
+				self._add_follow(int(user_data["id"]), user_id)
 				yield int(user_data["id"])
 
-			try:
-				pagination_token = meta["next_token"]
-
-			except KeyError:
+			if (meta := get_meta(ans)) is None or (pagination_token := meta.get("next_token")) is None:
 				break
 
-	def get_recent_tweets(self, user_id: int) -> Iterable[int]:
-		
-		if (ans := self._api_call(self._api.get_users_tweets, id=user_id, tweet_fields=["entities", "referenced_tweets", "author_id"])) is None:
+		self._tag_fetched("followers", user_id)
+
+	def _add_follow(self, actor: int, target: int):
+		self._write(
+			"add_follow",
+			f"INSERT INTO follows (actor, target, version) SELECT :actor, :target, {next_version('follows')} "
+			"WHERE NOT EXISTS (SELECT 1 FROM follows WHERE target = :target AND actor = :actor)",
+			{"actor": actor, "target": target},
+			("add_follow", actor, target),
+		)
+
+	def _stored_tweets(self, author: int) -> Iterable[tweepy.Tweet]:
+		"""the tweets of the fetched timeline, in api order"""
+
+		for (data,) in self._database.fetch(
+			"SELECT (SELECT data FROM tweets WHERE id = item.value ORDER BY rowid DESC LIMIT 1) "
+			"FROM json_each((SELECT items FROM fetched WHERE kind = 'timeline' AND id = :author)) AS item ORDER BY item.key",
+			{"author": author},
+		):
+			if data is not None:
+				yield tweepy.Tweet(json.loads(data))
+
+	def get_recent_tweets(self, user_id: int) -> Iterable[tweepy.Tweet]:
+		"""from the tweets table for fetched_max_age once the timeline was fetched, by any campaign"""
+
+		if self._is_fetched("timeline", user_id):
+			self._cache_metrics["timeline", "hit"].inc()
+			yield from self._stored_tweets(user_id)
 			return
 
-		if (data := get_data(ans)) is None:
+		self._cache_metrics["timeline", "miss"].inc()
+
+		if (ans := self._api_call(self._api.get_users_tweets, id=user_id, tweet_fields=["entities", "referenced_tweets", "author_id"])) is None:
 			return
 
-		for tweet_data in data:
-			self._set_tweet(tweepy.Tweet(tweet_data))
-			yield int(tweet_data["id"])
+		# stored whole before any is handed out, the caller may stop at the first on topic
+		tweets = [tweepy.Tweet(tweet_data) for tweet_data in get_data(ans) or []]
+
+		for tweet in tweets:
+			self._set_tweet(tweet)
+
+		if ans.status_code == 200:
+			self._tag_fetched("timeline", user_id, [int(tweet.id) for tweet in tweets])
+
+		yield from tweets
+
+	def _remember_username(self, username: str, id: int):
+
+		if len(self._username_ids) >= data_system_config.username_cache_size:
+			self._username_ids.clear()
+
+		self._username_ids[normalize_username(username)] = id
 
 	def get_id(self, username: str) -> Optional[int]:
+		return self.get_ids([username])[normalize_username(username)]
 
-		ans = self._database.fetch_one("SELECT id FROM users WHERE username = :username", {"username": username})
-		
-		if ans is None:
-			if (data := get_data(self._api_call(self._api.get_user, username=username, user_fields=["public_metrics", "username"]))) is None:
-				return None
+	def get_ids(self, usernames: Iterable[str]) -> dict[str, Optional[int]]:
+		"""Resolves usernames to ids, keyed by normalized username, None for unknown users
 
-			else:
-				self._set_user(tweepy.User(data))
-				return int(data["id"])
+		Looks in memory, then in the database, and asks the api for the rest,
+		up to get_users_batch_size usernames per call."""
 
-		else:
-			(id,) = ans
-			return int(id)
+		wanted = list(dict.fromkeys(normalize_username(username) for username in usernames))
+		resolved: dict[str, Optional[int]] = {username: self._username_ids[username] for username in wanted if username in self._username_ids}
+		missing = [username for username in wanted if username not in resolved]
+		self._cache_metrics["username", "hit"].inc(len(resolved))
+
+		for i in range(0, len(missing), sqlite_max_params):
+
+			chunk = missing[i:i + sqlite_max_params]
+			params = {f"username{j}": username for j, username in enumerate(chunk)}
+
+			for username, id in self._database.fetch(
+				f"SELECT lower(username), id FROM users WHERE lower(username) IN ({', '.join(':' + name for name in params)})",
+				params,
+			):
+				resolved[username] = int(id)
+				self._remember_username(username, int(id))
+
+		missing = [username for username in missing if username not in resolved]
+		self._cache_metrics["username", "miss"].inc(len(missing))
+
+		for i in range(0, len(missing), data_system_config.get_users_batch_size):
+
+			chunk = missing[i:i + data_system_config.get_users_batch_size]
+			ans = self._api_call(self._api.get_users, usernames=chunk, user_fields=["public_metrics", "username"])
+
+			for user_data in get_data(ans) or []:
+				self._set_user(user := tweepy.User(user_data))
+				resolved[normalize_username(user.username)] = int(user.id)
+
+			for username in chunk:
+				resolved.setdefault(username, None)
+
+		return {username: resolved[username] for username in wanted}
 
 	def _get(self, t: type[T], /, table: str, id: int, attr: str) -> Optional[T]:
 
@@ -219,14 +597,25 @@ class DataSystem(Herald[DataSystemEvent]):
 
 	def _set_user(self, user: tweepy.User):
 
-		self._database.exec(
-			"INSERT INTO users VALUES (:id, :username, 0, :data)",
-			{"id": int(user.id), "data": json.dumps(user.data), "username": user.username}
+		self._remember_username(user.username, int(user.id))
+		self._write(
+			"set_user",
+			(
+				f"UPDATE users SET username = :username, data = :data, version = {next_version('users')} "
+				"WHERE id = :id AND (username IS NOT :username OR data IS NOT :data)",
+				f"INSERT INTO users (id, username, processed, data, version) SELECT :id, :username, 0, :data, {next_version('users')} "
+				"WHERE NOT EXISTS (SELECT 1 FROM users WHERE id = :id)",
+			),
+			{"id": int(user.id), "data": json.dumps(user.data), "username": user.username},
+			("set_user", user.data),
 		)
 
 	def get_user(self, id: int) -> Optional[tweepy.User]:
 		
 		if (user := self._get_user(id)) is None:
+
+			self._cache_metrics["user", "miss"].inc()
+
 			if (data := get_data(self._api_call(self._api.get_user, id=id, user_fields=["public_metrics", "username"]))) is None:
 				return None
 
@@ -237,6 +626,8 @@ class DataSystem(Herald[DataSystemEvent]):
 				return user
 
 		else:
+
+			self._cache_metrics["user", "hit"].inc()
 			return user
 
 	def _get_tweet(self, id: int) -> Optional[tweepy.Tweet]:
@@ -249,14 +640,24 @@ class DataSystem(Herald[DataSystemEvent]):
 
 	def _set_tweet(self, tweet: tweepy.Tweet):
 
-		self._database.exec(
-			"INSERT INTO tweets VALUES (:id, :author, 0, :data)",
-			{"id": int(tweet.id), "data": json.dumps(tweet.data), "author": int(tweet.author_id)}
+		self._write(
+			"set_tweet",
+			(
+				f"UPDATE tweets SET author = :author, data = :data, version = {next_version('tweets')} "
+				"WHERE id = :id AND (author IS NOT :author OR data IS NOT :data)",
+				f"INSERT INTO tweets (id, author, processed, data, version) SELECT :id, :author, 0, :data, {next_version('tweets')} "
+				"WHERE NOT EXISTS (SELECT 1 FROM tweets WHERE id = :id)",
+			),
+			{"id": int(tweet.id), "data": json.dumps(tweet.data), "author": int(tweet.author_id)},
+			("set_tweet", tweet.data),
 		)
 
 	def get_tweet(self, id: int) -> Optional[tweepy.Tweet]:
 		
 		if (tweet := self._get_tweet(id)) is None:
+
+			self._cache_metrics["tweet", "miss"].inc()
+
 			if (data := get_data(self._api_call(self._api.get_tweet, id=id, tweet_fields=["entities", "referenced_tweets", "author_id"]))) is None:
 				return None
 
@@ -267,10 +668,80 @@ class DataSystem(Herald[DataSystemEvent]):
 				return tweet
 
 		else:
+
+			self._cache_metrics["tweet", "hit"].inc()
 			return tweet
 
+	def handoff(self) -> dict:
+		"""state for the DataSystem replacing this one on reload, keeps the connection, client and caches warm"""
+		return {
+			"database": self._database,
+			"api": self._api_instance,
+			"change_log": self._change_log,
+			"username_ids": self._username_ids,
+			"known_processed": self._known_processed,
+		}
+
+	def adopt(self, handoff: dict):
+
+		self._api_instance = handoff["api"]
+		self._username_ids = handoff.get("username_ids", self._username_ids)
+		self._known_processed = handoff.get("known_processed", self._known_processed)
+
+	def log_compaction(self, removed: dict[str, int], stripped: dict[str, int]):
+		"""marks a break in the change log, compaction_system does not record the rows it removes or strips"""
+
+		if self._change_log is not None and (any(removed.values()) or any(stripped.values())):
+			self._change_log.append(("compacted", removed, stripped))
+
+	def apply_changes(self, changes: Iterable[tuple]):
+		"""Replays writes recorded elsewhere, see coordinator_system.WorkerDataSystem"""
+
+		for change, *args in changes:
+
+			if change == "set_user":
+				self._set_user(tweepy.User(*args))
+
+			elif change == "set_tweet":
+				self._set_tweet(tweepy.Tweet(*args))
+
+			elif change == "add_follow":
+				self._add_follow(*args)
+
+			elif change == "tag_processed":
+				self.tag_processed(*args)
+
+			elif change == "tag_tweet_processed":
+				self.tag_tweet_processed(*args)
+
+			elif change == "tag_fetched":
+				self._tag_fetched(*args)
+
+			elif change == "compacted":
+				pass # compaction of the database it happened on, nothing to replay
+
+			else:
+				raise ValueError(f"unknown change {change!r}")
+
+if not Factory.has("twitter_api"):
+	Factory.set("twitter_api", create_api)
+
+def open_change_log() -> Optional[ChangeLog]:
+	"""the change log of data_system_config, None when it is turned off"""
+	return None if data_system_config.changes_dir is None else ChangeLog(data_system_config.changes_dir)
+
 tags = {"data_system"}
 
-def initialize():
+def initialize(handoff: Optional[dict] = None):
+
+	if handoff is None:
+		Locator.add_system(DataSystem(change_log=open_change_log()))
+
+	else:
+
+		data_system = DataSystem(handoff["database"], handoff.get("change_log"))
+		data_system.adopt(handoff)
+		Locator.add_system(data_system)
 
-	Locator.add_system(DataSystem())
+def finalize() -> dict:
+	return Locator.get_system({"data_system"}).handoff() #type: ignore
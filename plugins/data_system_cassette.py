@@ -0,0 +1,249 @@
+
+"""Record and replay of twitter api answers
+
+	python -m plugins.data_system_cassette [FILE]
+
+With data_system_config.cassette_mode = "record", every answer the DataSystem
+gets from the api is appended to cassette_file. With "replay", answers are read
+back from it and no request leaves the machine, so neither tweepy nor the api
+login are needed, and a recorded crawl can be run again to measure changes to
+the task, cache and database layers.
+
+The file is the magic bytes followed by records:
+
+	payload length (4 bytes) | key (20 bytes) | payload
+
+the key being the sha1 of the endpoint and its arguments, the payload the zlib
+compressed json of the call and its answer. Each record is a single append,
+so worker processes record to the same file. cassette_file.index maps keys
+to record positions, it is rebuilt from the record headers whenever it does
+not cover the whole file.
+
+A replayed request gets the answers recorded under its key in order, the last
+one again once they run out, and a 404 if it was never recorded. Each waits
+its recorded latency times cassette_latency_scale, 0 replays at full speed.
+
+The command prints the recorded calls per endpoint."""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+import plugins.data_system_config as data_system_config
+
+from metrics import Metrics
+
+_magic = b"TWTCASSETTE1\n"
+_header_size = 4 + 20
+_index_entry_size = 20 + 8
+
+def request_key(endpoint: str, args: tuple, kwargs: dict[str, Any]) -> bytes:
+	return hashlib.sha1(json.dumps([endpoint, args, kwargs], sort_keys=True, default=str).encode(encoding="utf-8")).digest()
+
+class CassetteResponse:
+	"""Stands for requests.Response, as returned by tweepy.Client(return_type=requests.Response)"""
+
+	def __init__(self, status_code: int, content: bytes):
+
+		self.status_code = status_code
+		self.content = content
+
+	def json(self) -> Any:
+		return json.loads(self.content)
+
+_not_recorded = CassetteResponse(404, b'{"errors": [{"title": "Not recorded in the cassette"}]}')
+
+class CassetteWriter:
+
+	def __init__(self, file: Path):
+
+		if not file.exists():
+
+			# created whole, as worker processes may start recording at the same time
+			temporary = file.with_name(f"{file.name}.{os.getpid()}")
+			temporary.write_bytes(_magic)
+
+			try:
+				os.link(temporary, file)
+
+			except FileExistsError:
+				pass
+
+			finally:
+				temporary.unlink()
+
+		self._out: BinaryIO = open(file, "ab", buffering=0)
+
+	def append(self, endpoint: str, args: tuple, kwargs: dict[str, Any], status_code: int, content: bytes, seconds: float):
+
+		payload = zlib.compress(json.dumps({
+			"endpoint": endpoint, "args": args, "kwargs": kwargs,
+			"status_code": status_code, "content": content.decode(encoding="utf-8"), "seconds": seconds,
+		}, default=str).encode(encoding="utf-8"))
+		self._out.write(len(payload).to_bytes(4, "little") + request_key(endpoint, args, kwargs) + payload)
+
+	def close(self):
+		self._out.close()
+
+def _records(f: BinaryIO) -> Iterator[tuple[int, bytes, int]]:
+	"""position, key and payload length of every complete record"""
+
+	size = os.fstat(f.fileno()).st_size
+	position = len(_magic)
+
+	while position + _header_size <= size:
+
+		f.seek(position)
+		header = f.read(_header_size)
+		length = int.from_bytes(header[:4], "little")
+
+		if position + _header_size + length > size:
+			break
+
+		yield position, header[4:], length
+		position += _header_size + length
+
+class CassetteReader:
+
+	def __init__(self, file: Path):
+
+		self._in: BinaryIO = open(file, "rb")
+
+		if self._in.read(len(_magic)) != _magic:
+			raise ValueError(f"{file} is not a cassette")
+
+		self._positions = self._load_index(file.with_name(file.name + ".index"))
+		self._played: Counter[bytes] = Counter()
+
+	def _load_index(self, index_file: Path) -> dict[bytes, list[int]]:
+
+		positions: dict[bytes, list[int]] = {}
+		size = os.fstat(self._in.fileno()).st_size
+
+		if index_file.exists() and int.from_bytes((data := index_file.read_bytes())[:8], "little") == size:
+
+			for start in range(8, len(data), _index_entry_size):
+				positions.setdefault(data[start:start + 20], []).append(int.from_bytes(data[start + 20:start + _index_entry_size], "little"))
+
+			return positions
+
+		entries = bytearray(size.to_bytes(8, "little"))
+
+		for position, key, _ in _records(self._in):
+			positions.setdefault(key, []).append(position)
+			entries += key + position.to_bytes(8, "little")
+
+		# several replaying processes may rebuild it at once
+		temporary = index_file.with_name(f"{index_file.name}.{os.getpid()}")
+		temporary.write_bytes(entries)
+		temporary.replace(index_file)
+		return positions
+
+	def _read(self, position: int) -> dict:
+
+		self._in.seek(position)
+		header = self._in.read(_header_size)
+		return json.loads(zlib.decompress(self._in.read(int.from_bytes(header[:4], "little"))))
+
+	def answer(self, endpoint: str, args: tuple, kwargs: dict[str, Any]) -> Optional[dict]:
+		"""the next recorded answer to this request, None if it was never recorded"""
+
+		if (positions := self._positions.get(key := request_key(endpoint, args, kwargs))) is None:
+			return None
+
+		played = self._played[key]
+		self._played[key] += 1
+		return self._read(positions[min(played, len(positions) - 1)])
+
+	def records(self) -> Iterator[dict]:
+
+		for position, _, _ in _records(self._in):
+			yield self._read(position)
+
+class RecordingClient:
+	"""Passes calls on to client, appending every answer to the cassette"""
+
+	def __init__(self, client: Any, writer: CassetteWriter):
+
+		self._client = client
+		self._writer = writer
+
+	def __getattr__(self, endpoint: str) -> Callable[..., Any]:
+
+		f = getattr(self._client, endpoint)
+
+		def call(*args, **kwargs) -> Any:
+
+			start = time.perf_counter()
+			answer = f(*args, **kwargs)
+			self._writer.append(endpoint, args, kwargs, answer.status_code, answer.content, time.perf_counter() - start)
+			return answer
+
+		call.__name__ = endpoint
+		return call
+
+class ReplayClient:
+	"""Answers calls from the cassette"""
+
+	def __init__(self, reader: CassetteReader, latency_scale: float = 0.0):
+
+		self._reader = reader
+		self._latency_scale = latency_scale
+		self._misses = Metrics.counter("cassette_misses_total", "Replayed api requests missing from the cassette")
+
+	def __getattr__(self, endpoint: str) -> Callable[..., Any]:
+
+		def call(*args, **kwargs) -> Any:
+
+			if (record := self._reader.answer(endpoint, args, kwargs)) is None:
+				self._misses.inc()
+				return _not_recorded
+
+			if self._latency_scale:
+				time.sleep(record["seconds"]*self._latency_scale)
+
+			return CassetteResponse(record["status_code"], record["content"].encode(encoding="utf-8"))
+
+		call.__name__ = endpoint
+		return call
+
+def cassette_client(create: Callable[[], Any]) -> Any:
+	"""the api client to use under data_system_config.cassette_mode, create making the real one"""
+
+	if data_system_config.cassette_mode is None:
+		return create()
+
+	elif data_system_config.cassette_mode == "record":
+		return RecordingClient(create(), CassetteWriter(data_system_config.cassette_file))
+
+	elif data_system_config.cassette_mode == "replay":
+		return ReplayClient(CassetteReader(data_system_config.cassette_file), data_system_config.cassette_latency_scale)
+
+	raise ValueError(f"unknown cassette_mode {data_system_config.cassette_mode!r}")
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("file", nargs="?", type=Path, default=data_system_config.cassette_file)
+	args = parser.parse_args()
+
+	calls: Counter[str] = Counter()
+	seconds: Counter[str] = Counter()
+
+	for record in CassetteReader(args.file).records():
+		calls[record["endpoint"]] += 1
+		seconds[record["endpoint"]] += record["seconds"]
+
+	print(json.dumps({
+		endpoint: {"calls": amount, "recorded_seconds": round(seconds[endpoint], 3)}
+		for endpoint, amount in calls.most_common()
+	}, indent=4))
+
+if __name__ == "__main__":
+	main()
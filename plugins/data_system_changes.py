@@ -0,0 +1,257 @@
+
+"""Change feed of data_system.db
+
+	python -m plugins.data_system_changes [--from OFFSET] [--follow] [--batch-size N]
+
+The DataSystem appends each of its writes, once committed, to a log of json
+lines numbered by a monotonic offset, so consumers tail it rather than
+polling the database:
+
+	{"offset": 41, "time": 1700000000.0, "change": ["set_user", {"id": "12", ...}]}
+	{"offset": 42, "time": 1700000000.0, "change": ["add_follow", 13, 12]}
+	{"offset": 43, "time": 1700000000.1, "change": ["tag_processed", 12, ""]}
+
+Changes have the form DataSystem.apply_changes replays. Compaction removes and
+rewrites rows without recording each of them, and marks the break instead:
+
+	{"offset": 44, "time": 1700003600.0, "change": ["compacted", {"tweets": 120}, {"users": 7}]}
+
+with the rows removed and stripped per table; a consumer keeping a copy of
+the tables reads them again from the database or data_system_export. The log is cut in
+segments of changes_segment_records, changes/<first offset>.log, each with a
+sparse index of (offset, byte position) pairs, changes/<first offset>.index,
+so a read seeks close to its offset. Only the newest changes_retained_segments
+are kept; a consumer fallen behind resumes at the oldest kept offset, the gap
+showing in the offsets."""
+
+import argparse
+import bisect
+import json
+import os
+import sys
+import time
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+import plugins.data_system_config as data_system_config
+
+_index_typecode = "q" # offset, position, offset, position...
+
+def _segment_bases(directory: Path) -> list[int]:
+	return sorted(int(file.stem) for file in directory.glob("*.log"))
+
+def _segment_file(directory: Path, base: int, suffix: str) -> Path:
+	return directory/f"{base:020}{suffix}"
+
+def _read_index(file: Path) -> array:
+
+	index = array(_index_typecode)
+
+	if file.exists():
+		data = file.read_bytes()
+		index.frombytes(data[:len(data) - len(data)%(2*index.itemsize)])
+
+	return index
+
+@dataclass
+class Change:
+
+	offset: int
+	time: float
+	change: list # [name, *args]
+
+	def to_json(self) -> dict:
+		return {"offset": self.offset, "time": self.time, "change": self.change}
+
+class ChangeLog:
+	"""Appends changes, a single writer per directory"""
+
+	def __init__(self,
+		directory: Path,
+		segment_records: int = data_system_config.changes_segment_records,
+		retained_segments: int = data_system_config.changes_retained_segments,
+		index_interval: int = data_system_config.changes_index_interval):
+
+		directory.mkdir(parents=True, exist_ok=True)
+		self._directory = directory
+		self._segment_records = segment_records
+		self._retained_segments = retained_segments
+		self._index_interval = index_interval
+		bases = _segment_bases(directory)
+		self._base = bases[-1] if bases else 0
+		self._records = self._recover() if bases else 0
+		self.next_offset = self._base + self._records
+		self._open()
+
+	def _recover(self) -> int:
+		"""changes in the last segment, dropping what an interrupted append left of its last change"""
+
+		log_file = _segment_file(self._directory, self._base, ".log")
+		index_file = _segment_file(self._directory, self._base, ".index")
+		index = _read_index(index_file)
+		offset, position = (index[-2], index[-1]) if index else (self._base, 0)
+
+		with open(log_file, "rb") as f:
+			f.seek(position)
+			tail = f.read()
+
+		complete = tail[:tail.rfind(b"\n") + 1]
+		lines = complete.count(b"\n")
+
+		if index and not lines:
+			# the index entry was written, not its change
+			del index[-2:]
+
+		os.truncate(log_file, position + len(complete))
+		index_file.write_bytes(index.tobytes())
+		return offset - self._base + lines
+
+	def _open(self):
+
+		self._log: BinaryIO = open(_segment_file(self._directory, self._base, ".log"), "ab", buffering=0)
+		self._index: BinaryIO = open(_segment_file(self._directory, self._base, ".index"), "ab", buffering=0)
+
+	def _roll(self):
+
+		self.close()
+		self._base = self.next_offset
+		self._records = 0
+		self._open()
+
+		for base in _segment_bases(self._directory)[:-self._retained_segments]:
+			for suffix in (".log", ".index"):
+				_segment_file(self._directory, base, suffix).unlink(missing_ok=True)
+
+	def append(self, change: tuple):
+
+		if self._records >= self._segment_records:
+			self._roll()
+
+		if self._records%self._index_interval == 0:
+			self._index.write(array(_index_typecode, (self.next_offset, self._log.tell())).tobytes())
+
+		# one unbuffered write per change, readers only take complete lines
+		self._log.write((json.dumps({"offset": self.next_offset, "time": time.time(), "change": change}) + "\n").encode(encoding="utf-8"))
+		self._records += 1
+		self.next_offset += 1
+
+	def close(self):
+
+		self._log.close()
+		self._index.close()
+
+class ChangeLogReader:
+	"""Reads changes by offset, while the DataSystem appends them"""
+
+	def __init__(self, directory: Path):
+		self._directory = directory
+
+	def _read_segment(self, base: int, offset: int, max_records: int) -> list[Change]:
+
+		index = _read_index(_segment_file(self._directory, base, ".index"))
+		offsets = index[0::2]
+		position, line_offset = 0, base
+
+		if (entry := bisect.bisect_right(offsets, offset) - 1) >= 0:
+			line_offset, position = offsets[entry], index[2*entry + 1]
+
+		changes: list[Change] = []
+
+		with open(_segment_file(self._directory, base, ".log"), "rb") as f:
+
+			f.seek(position)
+
+			for line in f:
+
+				if not line.endswith(b"\n") or len(changes) == max_records:
+					break
+
+				if line_offset >= offset:
+					record = json.loads(line)
+					changes.append(Change(offset=record["offset"], time=record["time"], change=record["change"]))
+
+				line_offset += 1
+
+		return changes
+
+	def first_offset(self) -> Optional[int]:
+		return bases[0] if (bases := _segment_bases(self._directory)) else None
+
+	def read(self, offset: int, max_records: int = data_system_config.changes_read_batch_size) -> list[Change]:
+		"""up to max_records changes from offset on, from the oldest kept one if offset is gone"""
+
+		while True:
+
+			bases = _segment_bases(self._directory)
+			changes: list[Change] = []
+
+			if not bases:
+				return changes
+
+			offset = max(offset, bases[0])
+
+			try:
+				for base in bases[max(bisect.bisect_right(bases, offset) - 1, 0):]:
+
+					changes += self._read_segment(base, offset + len(changes), max_records - len(changes))
+
+					if len(changes) == max_records:
+						break
+
+				return changes
+
+			except FileNotFoundError:
+				# removed by retention meanwhile
+				continue
+
+	def tail(self,
+		offset: int,
+		batch_size: int = data_system_config.changes_read_batch_size,
+		poll_period: float = data_system_config.changes_poll_period) -> Iterator[list[Change]]:
+		"""yields batches of new changes as they come, forever"""
+
+		while True:
+
+			if (changes := self.read(offset, batch_size)):
+				offset = changes[-1].offset + 1
+				yield changes
+
+			else:
+				time.sleep(poll_period)
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--from", dest="offset", type=int, default=0, help="first offset, the oldest kept one by default")
+	parser.add_argument("--follow", action="store_true", help="keep waiting for new changes")
+	parser.add_argument("--batch-size", type=int, default=data_system_config.changes_read_batch_size)
+	args = parser.parse_args()
+
+	if data_system_config.changes_dir is None:
+		parser.error("data_system_config.changes_dir is None, the change log is off")
+
+	reader = ChangeLogReader(data_system_config.changes_dir)
+	offset = args.offset
+
+	try:
+		if args.follow:
+			batches = reader.tail(offset, args.batch_size)
+
+		else:
+			batches = iter(lambda: reader.read(offset, args.batch_size), [])
+
+		for changes in batches:
+
+			for change in changes:
+				sys.stdout.write(json.dumps(change.to_json()) + "\n")
+
+			offset = changes[-1].offset + 1
+			sys.stdout.flush()
+
+	except (KeyboardInterrupt, BrokenPipeError):
+		pass
+
+if __name__ == "__main__":
+	main()
@@ -1,6 +1,29 @@
 
 from pathlib import Path
+from typing import Optional
 from config import plugins_package
 
 data_system_file = Path("data_system.db")
 api_login_dir = Path(plugins_package)/"api_login"
+export_dir = Path("export")
+username_cache_size = 1_000_000 # usernames resolved in memory, the map is reset when full
+get_users_batch_size = 100 # usernames per get_users call, the api maximum
+processed_cache_size = 100_000 # processed flags read ahead of task checks, reset when full
+fetched_max_age = 7*24*3600.0 # seconds a fetched timeline or follower list is served from the database
+query_host = "127.0.0.1"
+query_port = 9465
+query_pool_size = 4
+query_page_size = 100
+
+# change feed of every write, see data_system_changes, None turns it off
+changes_dir: Optional[Path] = Path("changes")
+changes_segment_records = 100_000 # changes per segment file
+changes_retained_segments = 50 # older segments are deleted
+changes_index_interval = 1_000 # changes between two entries of a segment's index
+changes_read_batch_size = 1_000
+changes_poll_period = 0.5 # seconds between two reads of a consumer that caught up
+
+# record and replay of api answers, see data_system_cassette: None, "record" or "replay"
+cassette_mode: Optional[str] = None
+cassette_file = Path("api.cassette")
+cassette_latency_scale = 0.0 # replayed answers wait their recorded latency times this
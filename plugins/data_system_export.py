@@ -0,0 +1,277 @@
+
+"""Columnar export of data_system.db
+
+	python -m plugins.data_system_export [--full]
+
+Every run appends a part holding the rows inserted or updated since the
+previous run, tracked by the version column of each table in state.json:
+
+	export/users/part-000001/version.npy, id.npy, processed.npy, followers_count.npy, ...
+	export/users/part-000001/username.offsets.npy + username.data.bin
+	export/tweets/part-000001/version.npy, id.npy, author.npy, referenced_id.npy, ...
+	export/follows/part-000001/version.npy, actor.npy, target.npy
+	export/users/processed_ids.npy, export/tweets/processed_ids.npy
+	export/campaign_processed/campaign.*, kind.*, id.npy
+
+Every write of a row gives it a new version, larger than all before (see
+data_system.next_version), so an updated user or tweet is exported again and
+the row of an id with the largest version is the current one. Rows deleted by
+compaction stay in the parts. Versions do not change with VACUUM.
+
+Numeric columns are plain .npy files (numpy.load(file, mmap_mode="r") maps
+them without copying). Text columns follow the Arrow layout: int64 offsets
+(n + 1 values) into a contiguous utf-8 buffer. processed_ids.npy and
+campaign_processed are rewritten on every run."""
+
+import argparse
+import json
+import shutil
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable
+
+import plugins.data_system_config as data_system_config
+
+from plugins.data_system import Database
+
+_byte_order = "<" if sys.byteorder == "little" else ">"
+_descriptors = {"q": f"{_byte_order}i8", "B": "|u1"}
+
+REFERENCE_TYPES = {None: 0, "retweeted": 1, "quoted": 2, "replied_to": 3}
+
+def write_npy(file: Path, values: array):
+	"""Writes a one dimensional array in the .npy format, version 1.0"""
+
+	header = f"{{'descr': '{_descriptors[values.typecode]}', 'fortran_order': False, 'shape': ({len(values)},), }}"
+	padding = 64 - (10 + len(header) + 1)%64
+	header_bytes = (header + " "*padding + "\n").encode(encoding="latin1")
+
+	with open(file, "wb") as f:
+		f.write(b"\x93NUMPY\x01\x00")
+		f.write(len(header_bytes).to_bytes(2, "little"))
+		f.write(header_bytes)
+		values.tofile(f)
+
+class StringColumn:
+	"""Streams a text column to disk, offsets are written on close"""
+
+	def __init__(self, directory: Path, name: str):
+
+		self._offsets_file = directory/f"{name}.offsets.npy"
+		self._data: BinaryIO = open(directory/f"{name}.data.bin", "wb")
+		self._offsets = array("q", [0])
+
+	def append(self, value: Any):
+
+		if value is not None:
+			self._data.write(str(value).encode(encoding="utf-8"))
+
+		self._offsets.append(self._data.tell())
+
+	def close(self):
+
+		self._data.close()
+		write_npy(self._offsets_file, self._offsets)
+
+class Part:
+	"""A set of columns of equal length, written in a hidden directory renamed to directory on close
+
+	An interrupted export leaves at most that hidden directory, which the next
+	run writing the same part starts over."""
+
+	def __init__(self, directory: Path, columns: dict[str, str]):
+
+		self.directory = directory
+		self._temporary = directory.with_name(f".{directory.name}.tmp")
+
+		if self._temporary.exists():
+			shutil.rmtree(self._temporary)
+
+		self._temporary.mkdir(parents=True)
+		self.rows = 0
+		self._columns: dict[str, Any] = {
+			name: StringColumn(self._temporary, name) if typecode == "str" else array(typecode)
+			for name, typecode in columns.items()
+		}
+
+	def append(self, row: Iterable[Any]):
+
+		for column, value in zip(self._columns.values(), row):
+			column.append(value)
+
+		self.rows += 1
+
+	def close(self):
+
+		for name, column in self._columns.items():
+
+			if isinstance(column, StringColumn):
+				column.close()
+
+			else:
+				write_npy(self._temporary/f"{name}.npy", column)
+
+		with open(self._temporary/"part.json", "w", encoding="utf-8") as f:
+			json.dump({"rows": self.rows, "columns": list(self._columns)}, f)
+
+		if self.directory.exists():
+			# from a run interrupted before it saved state.json, these rows are exported again
+			shutil.rmtree(self.directory)
+
+		self._temporary.rename(self.directory)
+
+	def discard(self):
+
+		for column in self._columns.values():
+			if isinstance(column, StringColumn):
+				column.close()
+
+		shutil.rmtree(self._temporary)
+
+# table -> (columns with their typecode, select list whose order matches the columns)
+TABLES: dict[str, tuple[dict[str, str], str]] = {
+	"users": (
+		{
+			"version": "q", "id": "q", "processed": "B", "username": "str",
+			"followers_count": "q", "following_count": "q", "tweet_count": "q", "listed_count": "q",
+		},
+		"version, id, coalesce(processed, 0), username, "
+		"coalesce(json_extract(data, '$.public_metrics.followers_count'), -1), "
+		"coalesce(json_extract(data, '$.public_metrics.following_count'), -1), "
+		"coalesce(json_extract(data, '$.public_metrics.tweet_count'), -1), "
+		"coalesce(json_extract(data, '$.public_metrics.listed_count'), -1)",
+	),
+	"tweets": (
+		{
+			"version": "q", "id": "q", "author": "q", "processed": "B",
+			"referenced_type": "B", "referenced_id": "q", "text": "str",
+		},
+		"version, id, author, coalesce(processed, 0), "
+		"json_extract(data, '$.referenced_tweets[0].type'), "
+		"coalesce(json_extract(data, '$.referenced_tweets[0].id'), -1), "
+		"json_extract(data, '$.text')",
+	),
+	"follows": (
+		{"version": "q", "actor": "q", "target": "q"},
+		"version, actor, target",
+	),
+}
+
+def _convert(table: str, row: tuple) -> tuple:
+
+	if table == "tweets":
+		return row[:4] + (REFERENCE_TYPES.get(row[4], 0), int(row[5])) + row[6:]
+
+	return row
+
+class MissingVersions(Exception):
+	"""the file was written by an older DataSystem, which adds the version columns when it opens it"""
+
+class Exporter:
+
+	def __init__(self, database: Database, directory: Path):
+
+		self._database = database
+		self._directory = directory
+		self._state_file = directory/"state.json"
+
+		if self._state_file.exists():
+			self._state: dict = json.load(open(self._state_file, "r", encoding="utf-8"))
+
+		else:
+			self._state = {"last_version": {table: 0 for table in TABLES}, "parts": 0}
+
+		# versions of rows older than the column are their rowids, states from before it go on from there
+		self._state.setdefault("last_version", self._state.pop("last_rowid", None))
+
+		for table in TABLES:
+			if "version" not in {column for _, column, *_ in database.fetch(f"PRAGMA table_info({table})")}:
+				raise MissingVersions(table)
+
+	def _export_table(self, table: str, part_name: str) -> int:
+
+		columns, select = TABLES[table]
+		last_version = self._state["last_version"][table]
+		part = Part(self._directory/table/part_name, columns)
+
+		for rows in self._database.stream(
+			f"SELECT {select} FROM {table} WHERE version > :last_version ORDER BY version",
+			{"last_version": last_version},
+		):
+			for row in rows:
+				part.append(_convert(table, row))
+
+			last_version = rows[-1][0]
+
+		if part.rows:
+			part.close()
+
+		else:
+			part.discard()
+
+		self._state["last_version"][table] = last_version
+		return part.rows
+
+	def _export_processed(self, table: str):
+
+		ids = array("q")
+
+		for rows in self._database.stream(f"SELECT DISTINCT id FROM {table} WHERE processed = 1"):
+			ids.extend(id for (id,) in rows)
+
+		(self._directory/table).mkdir(parents=True, exist_ok=True)
+		write_npy(self._directory/table/"processed_ids.npy", ids)
+
+	def _export_campaign_processed(self):
+
+		part = Part(self._directory/"campaign_processed", {"campaign": "str", "kind": "str", "id": "q"})
+
+		for rows in self._database.stream("SELECT campaign, kind, id FROM campaign_processed"):
+			for row in rows:
+				part.append(row)
+
+		part.close()
+
+	def export(self) -> dict[str, int]:
+
+		self._state["parts"] += 1
+		part_name = f"part-{self._state['parts']:06}"
+		exported = {table: self._export_table(table, part_name) for table in TABLES}
+
+		if not any(exported.values()):
+			self._state["parts"] -= 1
+
+		for table in ("users", "tweets"):
+			self._export_processed(table)
+
+		self._export_campaign_processed()
+		self._directory.mkdir(parents=True, exist_ok=True)
+		temporary = self._state_file.with_suffix(".tmp")
+
+		with open(temporary, "w", encoding="utf-8") as f:
+			json.dump(self._state, f, indent=4)
+
+		temporary.replace(self._state_file)
+		return exported
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--full", action="store_true", help="drop previous exports and start over")
+	parser.add_argument("--output", type=Path, default=data_system_config.export_dir)
+	args = parser.parse_args()
+
+	if args.full and args.output.exists():
+		shutil.rmtree(args.output)
+
+	try:
+		exporter = Exporter(Database(data_system_config.data_system_file, read_only=True), args.output)
+
+	except MissingVersions as e:
+		parser.error(f"{e} has no version column, open the file with the crawler once to add it")
+
+	print(json.dumps(exporter.export()))
+
+if __name__ == "__main__":
+	main()
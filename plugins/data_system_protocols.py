@@ -1,21 +1,33 @@
 
-import tweepy #type: ignore
+from __future__ import annotations
 
 from typing import Iterable, Optional, Protocol
 
 from protocols import SystemProtocol
 from herald import HeraldProtocol
-from plugins.data_system import DataSystemEvent
+from plugin_loader import lazy_import
+from plugins.data_system import DEFAULT_CAMPAIGN, Database, DataHookProtocol, DataSystemEvent
+
+tweepy = lazy_import("tweepy")
 
 class DataSystemProtocol(SystemProtocol, HeraldProtocol[DataSystemEvent], Protocol):
 	"""Provides cached interface with twitter api"""
 
-	def is_processed(self, user_id: int) -> bool: ...
-	def tag_processed(self, user_id: int): ...
+	api_calls: int
+	database: Database
+
+	def is_processed(self, user_id: int, campaign: str = DEFAULT_CAMPAIGN) -> bool: ...
+	def prefetch_processed(self, user_ids: Iterable[int], campaign: str = DEFAULT_CAMPAIGN): ...
+	def tag_processed(self, user_id: int, campaign: str = DEFAULT_CAMPAIGN): ...
 	def get_id(self, username: str) -> Optional[int]: ...
+	def get_ids(self, usernames: Iterable[str]) -> dict[str, Optional[int]]: ...
 	def get_user(self, id: int) -> Optional[tweepy.User]: ...
 	def get_tweet(self, id: int) -> Optional[tweepy.Tweet]: ...
-	def get_recent_tweets(self, user_id: int) -> Iterable[int]: ...
+	def get_recent_tweets(self, user_id: int) -> Iterable[tweepy.Tweet]: ...
 	def get_followers(self, user_id: int) -> Iterable[int]: ...
-	def is_tweet_processed(self, tweet_id: int) -> bool: ...
-	def tag_tweet_processed(self, tweet_id: int): ...
+	def is_tweet_processed(self, tweet_id: int, campaign: str = DEFAULT_CAMPAIGN) -> bool: ...
+	def prefetch_tweets_processed(self, tweet_ids: Iterable[int], campaign: str = DEFAULT_CAMPAIGN): ...
+	def tag_tweet_processed(self, tweet_id: int, campaign: str = DEFAULT_CAMPAIGN): ...
+	def apply_changes(self, changes: Iterable[tuple]): ...
+	def add_data_hook(self, hook: DataHookProtocol): ...
+	def rem_data_hook(self, hook: DataHookProtocol): ...
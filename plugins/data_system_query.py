@@ -0,0 +1,266 @@
+
+"""Read-only queries over data_system.db, safe to run while crawling
+
+	python -m plugins.data_system_query top-accounts [--limit N] [--after CURSOR]
+	python -m plugins.data_system_query on-topic-users [--campaign NAME] [--limit N] [--after CURSOR]
+	python -m plugins.data_system_query mention-graph TWEET_ID
+	python -m plugins.data_system_query serve [--host HOST] [--port PORT]
+
+Queries run on a pool of read-only connections. Under WAL a reader works on
+its own snapshot, so it never waits for the crawler's writes nor makes them
+wait. Every statement text is fixed, so sqlite3 keeps it prepared in the
+connection's statement cache.
+
+Listings are paginated by key (WHERE key > :after ORDER BY key LIMIT :limit),
+each page returns the cursor of the next one, so no page costs an OFFSET scan
+and no read transaction outlives its page.
+
+Served over http as GET /top_accounts, /on_topic_users and /mention_graph,
+with the same arguments as query parameters. On-topic users are matched with
+the keywords of a campaign of task_system_config, the first one by default."""
+
+import argparse
+import json
+import queue
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+import plugins.data_system_config as data_system_config
+
+from plugins.data_system import Database, like_pattern
+from plugins.task_system import Campaign, configured_campaigns
+
+@dataclass
+class Page:
+
+	rows: list[dict]
+	next: Optional[str]
+
+	def to_json(self) -> dict:
+		return {"rows": self.rows, "next": self.next}
+
+class ConnectionPool:
+	"""Read-only connections shared between threads, one query at a time each"""
+
+	def __init__(self, file: Path, size: int):
+
+		self._idle: queue.Queue[Database] = queue.Queue()
+
+		for _ in range(size):
+			self._idle.put(Database(file, read_only=True, check_same_thread=False))
+
+	@contextmanager
+	def connection(self) -> Iterator[Database]:
+
+		database = self._idle.get()
+
+		try:
+			yield database
+
+		finally:
+			self._idle.put(database)
+
+_followers_count = "json_extract(data, '$.public_metrics.followers_count')"
+
+_top_accounts_sql = (
+	f"SELECT id, username, {_followers_count} FROM users "
+	# spelled out rather than as a row value comparison, which sqlite cannot seek the index with
+	f"WHERE {_followers_count} <= :followers_count AND ({_followers_count} < :followers_count OR id < :id) "
+	# users are stored once per fetch, each account is listed at its newest row. A GROUP BY id
+	# would aggregate the whole table for every page, this is a seek on users_id per row
+	"AND rowid = (SELECT max(rowid) FROM users AS newest WHERE newest.id = users.id) "
+	f"ORDER BY {_followers_count} DESC, id DESC LIMIT :limit"
+)
+
+_mentions_sql = (
+	"SELECT json_extract(mention.value, '$.username'), "
+	"(SELECT id FROM users WHERE lower(username) = lower(json_extract(mention.value, '$.username')) LIMIT 1) "
+	"FROM tweets, json_each(tweets.data, '$.entities.mentions') AS mention "
+	"WHERE tweets.rowid = (SELECT rowid FROM tweets WHERE id = :id LIMIT 1)"
+)
+
+class Queries:
+
+	def __init__(self, pool: ConnectionPool, campaigns: Optional[list[Campaign]] = None):
+
+		self._pool = pool
+		campaigns = configured_campaigns() if campaigns is None else campaigns
+		self._default_campaign = campaigns[0].name
+		# campaign -> (keyword params, statement), one fixed statement text per campaign
+		self._on_topic_users: dict[str, tuple[dict[str, str], str]] = {}
+
+		for campaign in campaigns:
+
+			keywords = {f"keyword{i}": like_pattern(keyword) for i, keyword in enumerate(campaign.keywords)}
+			matches = " OR ".join(f"lower(json_extract(data, '$.text')) LIKE :{name} ESCAPE '\\'" for name in keywords)
+			self._on_topic_users[campaign.name] = (keywords, (
+				"SELECT author, (SELECT username FROM users WHERE users.id = author LIMIT 1) "
+				f"FROM (SELECT DISTINCT author FROM tweets WHERE author > :after AND ({matches}) ORDER BY author LIMIT :limit)"
+			))
+
+	def top_accounts(self, limit: int = data_system_config.query_page_size, after: Optional[str] = None) -> Page:
+		"""Stored users by decreasing follower count, after is "followers_count,id" """
+
+		followers_count, id = (int(value) for value in after.split(",")) if after else (2**63 - 1, 2**63 - 1)
+
+		with self._pool.connection() as database:
+			rows = database.fetch(_top_accounts_sql, {"followers_count": followers_count, "id": id, "limit": limit})
+
+		accounts = [{"id": id, "username": username, "followers_count": followers_count} for id, username, followers_count in rows]
+		return Page(rows=accounts, next=f"{rows[-1][2]},{rows[-1][0]}" if len(rows) == limit else None)
+
+	def on_topic_users(self,
+		limit: int = data_system_config.query_page_size, after: Optional[str] = None,
+		campaign: Optional[str] = None) -> Page:
+		"""Authors of at least one stored tweet containing a keyword of the campaign, by id"""
+
+		if (on_topic_users := self._on_topic_users.get(self._default_campaign if campaign is None else campaign)) is None:
+			raise ValueError(f"unknown campaign {campaign!r}")
+
+		keywords, sql = on_topic_users
+
+		if not keywords:
+			return Page(rows=[], next=None)
+
+		params: dict[str, Any] = keywords | {"after": int(after) if after else -1, "limit": limit}
+
+		with self._pool.connection() as database:
+			rows = database.fetch(sql, params)
+
+		users = [{"id": id, "username": username} for id, username in rows]
+		return Page(rows=users, next=str(rows[-1][0]) if len(rows) == limit else None)
+
+	def mention_graph(self, tweet_id: int) -> Optional[dict]:
+		"""The tweet's author, the users it mentions and the tweets it references
+
+		Mentioned users that were never stored have a null id."""
+
+		with self._pool.connection() as database:
+
+			if (tweet := database.fetch_one(
+				"SELECT author, json_extract(data, '$.referenced_tweets') FROM tweets WHERE id = :id LIMIT 1",
+				{"id": tweet_id},
+			)) is None:
+				return None
+
+			mentions = database.fetch(_mentions_sql, {"id": tweet_id})
+
+		author, referenced = tweet
+		return {
+			"id": tweet_id,
+			"author": author,
+			"mentions": [{"username": username, "id": id} for username, id in mentions],
+			"references": [{"type": ref["type"], "id": int(ref["id"])} for ref in json.loads(referenced or "[]")],
+		}
+
+def _run(queries: Queries, name: str, args: dict[str, list[str]]) -> Any:
+
+	if name == "top_accounts":
+		return queries.top_accounts(int(args.get("limit", [data_system_config.query_page_size])[0]), args.get("after", [None])[0]).to_json()
+
+	elif name == "on_topic_users":
+		return queries.on_topic_users(
+			int(args.get("limit", [data_system_config.query_page_size])[0]), args.get("after", [None])[0], args.get("campaign", [None])[0],
+		).to_json()
+
+	elif name == "mention_graph":
+
+		if "id" not in args:
+			raise ValueError("missing id")
+
+		return queries.mention_graph(int(args["id"][0]))
+
+	else:
+		raise KeyError(name)
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+
+	queries: Queries
+
+	def do_GET(self):
+
+		url = urlparse(self.path)
+
+		try:
+			answer = _run(self.queries, url.path.strip("/"), parse_qs(url.query))
+
+		except KeyError:
+			self.send_error(404)
+			return
+
+		except ValueError as e:
+			self.send_error(400, str(e))
+			return
+
+		body = json.dumps(answer).encode(encoding="utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+def serve(queries: Queries, host: str, port: int):
+
+	handler = type("BoundQueryRequestHandler", (QueryRequestHandler,), {"queries": queries})
+
+	with ThreadingHTTPServer((host, port), handler) as server:
+
+		print(f"serving on http://{host}:{port}")
+
+		try:
+			server.serve_forever()
+
+		except KeyboardInterrupt:
+			pass
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	for command in ("top-accounts", "on-topic-users"):
+		listing = commands.add_parser(command)
+		listing.add_argument("--limit", type=int, default=data_system_config.query_page_size)
+		listing.add_argument("--after", help="cursor returned as next by the previous page")
+
+		if command == "on-topic-users":
+			listing.add_argument("--campaign", help="campaign whose keywords are matched, the first one by default")
+
+	commands.add_parser("mention-graph").add_argument("id", type=int)
+
+	server = commands.add_parser("serve")
+	server.add_argument("--host", default=data_system_config.query_host)
+	server.add_argument("--port", type=int, default=data_system_config.query_port)
+
+	args = parser.parse_args()
+	pool_size = data_system_config.query_pool_size if args.command == "serve" else 1
+	queries = Queries(ConnectionPool(data_system_config.data_system_file, pool_size))
+
+	if args.command == "serve":
+		serve(queries, args.host, args.port)
+
+	elif args.command == "mention-graph":
+		print(json.dumps(queries.mention_graph(args.id), indent=4))
+
+	elif args.command == "on-topic-users":
+
+		try:
+			page = queries.on_topic_users(args.limit, args.after, args.campaign)
+
+		except ValueError as e:
+			parser.error(str(e))
+
+		print(json.dumps(page.to_json(), indent=4))
+
+	else:
+		print(json.dumps(queries.top_accounts(args.limit, args.after).to_json(), indent=4))
+
+if __name__ == "__main__":
+	main()
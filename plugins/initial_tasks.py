@@ -1,6 +1,8 @@
 
 import json
 
+from typing import Optional
+
 from cast_tools import CasterFactory
 from locator import Locator
 from plugin_loader import assert_tags
@@ -16,15 +18,26 @@ def locate_task_system() -> TaskSystem:
 	else: return CasterFactory[SystemProtocol, TaskSystem]()(ans)
 
 tags = {"initial_tasks"}
+requires = {"task_system", "log_system"}
+
+def initialize(handoff: Optional[dict] = None):
+
+	assert_tags(existing=Locator.loaded_tags, required=requires)
 
-def initialize():
+	if handoff is not None and handoff["seeded"]:
+		return
 
-	assert_tags(existing=Locator.loaded_tags, required={"task_system", "log_system"})
 	task_system = locate_task_system()
 	ids = json.load(open(initial_tasks_config.ids_file, "r", encoding="utf-8"))
 
-	for id in ids["users"]:
-		task_system.put_task(FirstSightUser(id=int(id)))
+	for campaign in task_system.campaigns():
+
+		for id in ids["users"]:
+			task_system.put_task(FirstSightUser(id=int(id)), campaign.name)
+
+		for id in ids["tweets"]:
+			task_system.put_task(FirstSightTweet(id=int(id)), campaign.name)
 
-	for id in ids["tweets"]:
-		task_system.put_task(FirstSightTweet(id=int(id)))
+def finalize() -> dict:
+	"""seeds are only queued once per run, reloading must not queue them again"""
+	return {"seeded": True}
@@ -1,9 +1,10 @@
 
+from collections import Counter
 from dataclasses import dataclass
+import random
 import time
-from typing import TypeVar
+from typing import Optional, TypeVar
 
-from rich.console import Console
 from datetime import datetime
 
 import plugins.log_system_config as log_system_config
@@ -12,10 +13,14 @@ from event import Event
 from locator import Update, Error, Exit, Locator
 from protocols import SystemProtocol
 from tag import SystemTag
+from plugins.task_system import AddedTask, ChargeReport, WorkingOnTask
 from plugins.task_system_protocols import TaskSystemProtocol
+from plugins.data_system import DataSystemError
 from plugins.data_system_protocols import DataSystemProtocol
 from cast_tools import CasterFactory
-from plugin_loader import assert_tags
+from plugin_loader import assert_tags, lazy_import
+
+rich_console = lazy_import("rich.console")
 
 @dataclass
 class CannotLocateSystem(Exception):
@@ -36,9 +41,32 @@ class LogSystem:
 
 	def __init__(self):
 
-		self._console = Console(record=True)
+		self._console_instance = None
 		self._colors = ["blue", "cyan", "green", "purple", "yellow"]
 		self._color_map: dict[str, str] = {}
+		self._aggregate = log_system_config.mode == "aggregate"
+		self._window_start = time.monotonic()
+		self._counts: Counter[str] = Counter()
+		self._pending_tasks = 0
+
+	@property
+	def _console(self):
+		"""created on first print, so that rich is only imported when needed"""
+
+		if self._console_instance is None:
+			self._console_instance = rich_console.Console(record=True)
+
+		return self._console_instance
+
+	def handoff(self) -> dict:
+		"""state for the LogSystem replacing this one on reload, so that archives stay complete"""
+		return {"console": self._console_instance, "colors": self._colors, "color_map": self._color_map}
+
+	def adopt(self, handoff: dict):
+
+		self._console_instance = handoff["console"]
+		self._colors = handoff["colors"]
+		self._color_map = handoff["color_map"]
 
 	def _get_new_color(self) -> str:
 
@@ -63,25 +91,87 @@ class LogSystem:
 		with open(log_system_config.logs_dir/f"{time.time()}.html", "w", encoding="utf-8") as f:
 			f.write(self._console.export_html())
 
-	def on_event(self, event: Event):
-
-		if isinstance(event, Update):
-			return
+	def _print(self, event: Event):
 
 		style = "red" if isinstance(event, Error) else "normal"
 		parent_name = event.__class__.__mro__[1].__name__
 		parent_color = self._get_color(parent_name)
 		self._console.print(f"[dim]{datetime.now()}...[/dim][{parent_color}]{parent_name}[/{parent_color}]...[{style}]{event}[/{style}]")
 
+	def _count(self, event: Event):
+
+		self._counts[event.__class__.__name__] += 1
+
+		if isinstance(event, WorkingOnTask):
+			self._counts["_worked"] += 1
+
+		elif isinstance(event, AddedTask):
+			self._counts["_added"] += 1
+
+		elif isinstance(event, ChargeReport):
+			self._pending_tasks = event.pending_tasks
+
+		if isinstance(event, DataSystemError):
+			self._counts["_api_errors"] += 1
+
+	def _summarize(self, now: float):
+		"""prints rates over the current window, then starts a new one"""
+
+		elapsed = max(now - self._window_start, 1e-9)
+		worked = self._counts.pop("_worked", 0)
+		added = self._counts.pop("_added", 0)
+		api_errors = self._counts.pop("_api_errors", 0)
+		counts = ", ".join(f"{name}={amount}" for name, amount in self._counts.most_common())
+		self._console.print(
+			f"[dim]{datetime.now()}...[/dim][bold]Summary[/bold]..."
+			f"{worked/elapsed:.1f} tasks/s, {added/elapsed:.1f} added/s, "
+			f"queue depth {self._pending_tasks}, {api_errors*60/elapsed:.1f} api errors/min"
+			f"{' [dim](' + counts + ')[/dim]' if counts else ''}"
+		)
+		self._counts.clear()
+		self._window_start = now
+
+	def on_event(self, event: Event):
+
+		if isinstance(event, Update):
+
+			if self._aggregate and (now := time.monotonic()) - self._window_start > log_system_config.summary_period:
+				self._summarize(now)
+
+			return
+
+		if not self._aggregate:
+			self._print(event)
+
+		else:
+
+			self._count(event)
+
+			if isinstance(event, (Error, Exit)) or random.random() < log_system_config.sample_rate:
+				self._print(event)
+
 		if isinstance(event, Exit):
+
+			if self._aggregate:
+				self._summarize(time.monotonic())
+
 			self._archive()
 
 tags = {"log_system"}
+requires = {"task_system", "data_system"}
 
-def initialize():
+def initialize(handoff: Optional[dict] = None):
 
-	assert_tags(existing=Locator.loaded_tags, required={"task_system", "data_system"})
+	assert_tags(existing=Locator.loaded_tags, required=requires)
 	log_system = LogSystem()
+
+	if handoff is not None:
+		log_system.adopt(handoff)
+
 	CasterFactory[SystemProtocol, TaskSystemProtocol]()(locate_system("task_system")).add_observer(log_system)
 	CasterFactory[SystemProtocol, DataSystemProtocol]()(locate_system("data_system")).add_observer(log_system)
 	Locator.add_observer(log_system)
+	Locator.add_system(log_system)
+
+def finalize() -> dict:
+	return locate_system("log_system").handoff() #type: ignore
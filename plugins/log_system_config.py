@@ -3,3 +3,8 @@ from pathlib import Path
 
 logs_dir = Path("logs")
 if not logs_dir.exists(): logs_dir.mkdir()
+
+# "verbose" prints every event, "aggregate" prints periodic summaries
+mode = "verbose"
+summary_period = 10.0 # seconds between two summaries in aggregate mode
+sample_rate = 0.001 # fraction of individual events still printed in aggregate mode
@@ -0,0 +1,98 @@
+
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import plugins.metrics_system_config as metrics_system_config
+
+from event import Event, Error
+from herald import Herald
+from locator import Exit, Locator, LocatorEvent, Update
+from metrics import Metrics
+
+class MetricsSystemEvent(Event): ...
+class MetricsSystemError(Error, MetricsSystemEvent): ...
+
+@dataclass
+class CannotStartMetricsServer(MetricsSystemError):
+
+	reason: str
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+
+		if self.path not in ("/metrics", "/"):
+			self.send_error(404)
+			return
+
+		body = Metrics.render().encode(encoding="utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+class MetricsSystem(Herald[MetricsSystemEvent]):
+	"""Exposes the metrics registry over http and as a snapshot file"""
+
+	tags = {"metrics_system"}
+
+	def __init__(self):
+
+		Herald.__init__(self)
+		self._last_snapshot = time.monotonic()
+		self._server: Optional[ThreadingHTTPServer] = None
+
+	def start_server(self):
+
+		try:
+			self._server = ThreadingHTTPServer((metrics_system_config.host, metrics_system_config.port), MetricsRequestHandler)
+
+		except OSError as e:
+			# no plugin may observe the MetricsSystem yet, the failure is printed as well
+			print(f"cannot start the metrics server on {metrics_system_config.host}:{metrics_system_config.port}, {e}")
+			self._dispatch_event(CannotStartMetricsServer(reason=str(e)))
+			return
+
+		threading.Thread(target=self._server.serve_forever, name="metrics_server", daemon=True).start()
+
+	def on_event(self, event: LocatorEvent):
+
+		if isinstance(event, Update):
+
+			if (now := time.monotonic()) - self._last_snapshot > metrics_system_config.snapshot_period:
+				self._last_snapshot = now
+				Metrics.write_snapshot(metrics_system_config.snapshot_file)
+
+		elif isinstance(event, Exit):
+			self.stop()
+
+	def stop(self):
+
+		Metrics.write_snapshot(metrics_system_config.snapshot_file)
+
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+
+tags = {"metrics_system"}
+
+def initialize():
+
+	metrics_system = MetricsSystem()
+	Locator.add_system(metrics_system)
+	Locator.add_observer(metrics_system)
+	metrics_system.start_server()
+
+def finalize():
+	"""frees the port for the reloaded plugin"""
+
+	if (metrics_system := Locator.get_system({"metrics_system"})) is not None:
+		metrics_system.stop() #type: ignore
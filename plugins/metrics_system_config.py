@@ -0,0 +1,7 @@
+
+from pathlib import Path
+
+host = "127.0.0.1"
+port = 9464
+snapshot_file = Path("metrics.json")
+snapshot_period = 30.0 # seconds
@@ -1,9 +1,14 @@
 
 import time
 
+import plugins.plugins_auto_loader_config as plugins_auto_loader_config
+
 from locator import Locator, Update, LocatorEvent
 
 class LoaderSystem:
+	"""Loads and unloads plugins listed in plugins.json, reloads the ones whose files changed
+
+	Changes are detected with a stat per file, and applied between two updates."""
 
 	tags = {"plugin_aauto_loader"}
 
@@ -11,14 +16,21 @@ class LoaderSystem:
 
 		self._last = time.time()
 
+	def _check(self):
+
+		Locator.load_plugins()
+
+		if plugins_auto_loader_config.reload_changed_plugins:
+			Locator.reload_changed_plugins()
+
 	def on_event(self, event: LocatorEvent):
 
 		now = time.time()
 
-		if isinstance(event, Update) and (now - self._last) > 30:
+		if isinstance(event, Update) and (now - self._last) > plugins_auto_loader_config.check_period:
 
 			self._last = now
-			Locator.load_plugins()
+			Locator.defer(self._check)
 
 tags = {"plugins_auto_loader"}
 
@@ -0,0 +1,3 @@
+
+check_period = 2.0 # seconds between two looks at plugins.json and the plugins' source files
+reload_changed_plugins = True
@@ -0,0 +1,158 @@
+
+import cProfile
+import io
+import pstats
+import random
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, TypeVar
+
+import plugins.profiling_system_config as profiling_system_config
+
+from event import Event
+from herald import Herald
+from locator import Exit, Locator, LocatorEvent, Update
+from plugin_loader import assert_tags
+from plugins.task_system import Task, locate_task_system
+
+T = TypeVar("T")
+
+class ProfilingSystemEvent(Event): ...
+
+@dataclass
+class DumpedProfile(ProfilingSystemEvent):
+
+	file: Path
+	sampled: int
+
+class TaskProfile:
+	"""Aggregated samples of a single task class"""
+
+	def __init__(self):
+
+		self.profiler = cProfile.Profile()
+		self.samples = 0
+		self.allocated_size: Counter[str] = Counter()
+		self.allocated_count: Counter[str] = Counter()
+
+	def add_allocations(self, snapshot: tracemalloc.Snapshot):
+
+		for stat in snapshot.statistics("lineno"):
+			site = str(stat.traceback)
+			self.allocated_size[site] += stat.size
+			self.allocated_count[site] += stat.count
+
+class ProfilingSystem(Herald[ProfilingSystemEvent]):
+	"""Samples task phases under cProfile and tracemalloc, aggregated per task class"""
+
+	tags = {"profiling_system"}
+
+	def __init__(self):
+
+		Herald.__init__(self)
+		self._profiles: dict[str, TaskProfile] = {}
+		self._active = False
+		self._last_trigger_check = time.monotonic()
+
+	def around(self, task: Task, phase: str, f: Callable[[], T]) -> T:
+
+		if self._active or phase not in profiling_system_config.phases or random.random() >= profiling_system_config.sample_rate:
+			return f()
+
+		profile = self._profiles.setdefault(f"{task.__class__.__name__}.{phase}", TaskProfile())
+		profile.samples += 1
+		own_tracing = profiling_system_config.trace_allocations and not tracemalloc.is_tracing()
+		self._active = True
+
+		if own_tracing:
+			tracemalloc.start(profiling_system_config.traced_frames)
+
+		try:
+			profile.profiler.enable()
+
+			try:
+				return f()
+
+			finally:
+				profile.profiler.disable()
+
+		finally:
+
+			self._active = False
+
+			if own_tracing:
+				profile.add_allocations(tracemalloc.take_snapshot())
+				tracemalloc.stop()
+
+	def _render(self) -> str:
+
+		out = io.StringIO()
+		n = profiling_system_config.top_n
+
+		for name, profile in sorted(self._profiles.items()):
+
+			out.write(f"===== {name} ({profile.samples} samples)\n")
+
+			if profile.samples:
+				stats = pstats.Stats(profile.profiler, stream=out)
+				stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(n)
+				stats.sort_stats(pstats.SortKey.TIME).print_stats(n)
+
+			if profile.allocated_size:
+
+				out.write(f"top {n} allocation sites (retained after the phase)\n")
+
+				for site, size in profile.allocated_size.most_common(n):
+					out.write(f"{size/1024:12.1f} KiB {profile.allocated_count[site]:10} blocks  {site}\n")
+
+			out.write("\n")
+
+		return out.getvalue()
+
+	def dump(self) -> Path:
+
+		file = profiling_system_config.dumps_dir/f"{time.time()}.txt"
+
+		with open(file, "w", encoding="utf-8") as f:
+			f.write(self._render())
+
+		self._dispatch_event(DumpedProfile(file=file, sampled=sum(profile.samples for profile in self._profiles.values())))
+		return file
+
+	def on_event(self, event: LocatorEvent):
+
+		if isinstance(event, Update):
+
+			if (now := time.monotonic()) - self._last_trigger_check > profiling_system_config.trigger_check_period:
+
+				self._last_trigger_check = now
+
+				if profiling_system_config.trigger_file.exists():
+					profiling_system_config.trigger_file.unlink()
+					self.dump()
+
+		elif isinstance(event, Exit):
+			self.dump()
+
+tags = {"profiling_system"}
+requires = {"task_system"}
+
+def initialize():
+
+	assert_tags(existing=Locator.loaded_tags, required=requires)
+	profiling_system = ProfilingSystem()
+	locate_task_system().add_task_hook(profiling_system)
+	Locator.add_system(profiling_system)
+	Locator.add_observer(profiling_system)
+
+def finalize():
+
+	if (profiling_system := Locator.get_system({"profiling_system"})) is not None:
+
+		profiling_system.dump() #type: ignore
+
+		if (task_system := Locator.get_system({"task_system"})) is not None:
+			task_system.rem_task_hook(profiling_system) #type: ignore
@@ -0,0 +1,12 @@
+
+from pathlib import Path
+
+sample_rate = 0.01 # fraction of task phases run under the profiler
+phases = {"check", "run"}
+trace_allocations = True
+traced_frames = 8
+top_n = 25
+dumps_dir = Path("profiles")
+if not dumps_dir.exists(): dumps_dir.mkdir()
+trigger_file = Path("profile_dump.request") # creating this file asks for a dump
+trigger_check_period = 5.0 # seconds
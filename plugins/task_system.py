@@ -1,26 +1,33 @@
 
 from __future__ import annotations
 
+import itertools
 import json
+import re
 import shutil
 import time
-from typing import Iterable, Optional
-import tweepy#type: ignore
+from array import array
+from typing import Callable, ClassVar, Iterable, Iterator, Optional, Protocol, TypeVar
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
+from functools import partial
 from pathlib import Path
 
 from locator import Update, LocatorEvent, Locator, Exit
-from plugin_loader import assert_tags
+from plugin_loader import assert_tags, lazy_import
 from event import Event, Error
 from herald import Herald
+from metrics import Counter, Histogram, Metrics
 from protocols import SystemProtocol
 from tag import PluginTag
 from cast_tools import CasterFactory
 
 import plugins.task_system_config as task_system_config
+from plugins.data_system import DEFAULT_CAMPAIGN
 from plugins.data_system_protocols import DataSystemProtocol
 
+tweepy = lazy_import("tweepy")
+
 class CannotLocateDataSystem(Exception): ...
 class CannotLocateTaskSystem(Exception): ...
 
@@ -38,6 +45,20 @@ def locate_task_system() -> TaskSystem:
 
 class Task:
 
+	__slots__ = ()
+	lease_kind: ClassVar[Optional[str]] = None # of the object the task's id names, see lease_key
+
+	def lease_key(self) -> Optional[tuple[str, int]]:
+		"""the (kind, id) of the user or tweet the task fetches, None if it has no id
+
+		coordinator_system leases a key to one worker at a time. Kinds default to
+		the class name, so that unrelated tasks sharing an id do not block each other."""
+
+		if (id := getattr(self, "id", None)) is None:
+			return None
+
+		return (self.lease_kind or self.__class__.__name__, id)
+
 	def check(self) -> bool:
 		"""returns True if the task is worthy of running"""
 		return True
@@ -50,12 +71,33 @@ class Task:
 
 	@staticmethod
 	def load(saved: str) -> Task:
+
+		if (match := _saved_pattern.fullmatch(saved)) is not None and (cls := _builtin_classes.get(match.group(1))) is not None:
+			return cls(id=int(match.group(2)))
+
 		return eval(saved)
 
-def tweet_is_on_topic(tweet: tweepy.Tweet) -> bool:
+	def without_prefetched(self) -> Task:
+		"""the task as it should wait in a queue, without objects only worth keeping when run inline"""
+		return self
+
+	@classmethod
+	def prefetch(cls, ids: list[int]):
+		"""called with the ids of upcoming queued tasks of this built-in class, ahead of their check"""
+		pass
 
-	text = str(tweet.text).lower()
-	return any(keyword in text for keyword in task_system_config.keywords)
+def is_fusable(task: Task, depth: int) -> bool:
+	"""True if a task created by a running one, depth stages deep, should run inline"""
+	return depth < task_system_config.max_fusion_depth and task.__class__.__name__ in task_system_config.fused_tasks
+
+def text_is_on_topic(text: str, keywords: Iterable[str]) -> bool:
+	"""case insensitive on both sides, the crawl and task_system_reclassify must classify alike"""
+
+	text = text.lower()
+	return any(keyword.lower() in text for keyword in keywords)
+
+def tweet_is_on_topic(tweet: tweepy.Tweet) -> bool:
+	return text_is_on_topic(str(tweet.text), task_system_config.keywords)
 
 def is_retweet(tweet: tweepy.Tweet) -> Optional[int]:
 
@@ -84,14 +126,19 @@ def get_mentions(tweet: tweepy.Tweet) -> Iterable[str]:
 class TaskEvent(Event): ...
 class TaskError(Error, TaskEvent): ...
 
-@dataclass
+@dataclass(slots=True)
 class FirstSightUser(Task):
 	"""Checks if any tweet is on topic and starts processing user accordingly"""
 
+	lease_kind = "user"
 	id: int
 
+	@classmethod
+	def prefetch(cls, ids: list[int]):
+		locate_data_system().prefetch_processed(ids, locate_task_system().campaign.name)
+
 	def check(self) -> bool:
-		return not locate_data_system().is_processed(self.id)
+		return not locate_data_system().is_processed(self.id, locate_task_system().campaign.name)
 
 	def run(self):
 
@@ -101,18 +148,18 @@ class FirstSightUser(Task):
 		if (user := data_system.get_user(self.id)) is None:
 			return
 
-		for tweet_id in data_system.get_recent_tweets(self.id):
-			if (tweet := data_system.get_tweet(tweet_id)) is not None:
-				if tweet_is_on_topic(tweet):
-					task_system.put_task(ScanUser(id=self.id))
-					break
+		for tweet in data_system.get_recent_tweets(self.id):
+			if task_system.campaign.is_on_topic(tweet):
+				task_system.put_task(ScanUser(id=self.id))
+				break
 
-		data_system.tag_processed(self.id)
+		data_system.tag_processed(self.id, task_system.campaign.name)
 
-@dataclass
+@dataclass(slots=True)
 class ScanUser(Task):
 	"""Procedes to full scan of user, assuming they are on topic"""
 
+	lease_kind = "user"
 	id: int
 
 	def run(self):
@@ -120,19 +167,24 @@ class ScanUser(Task):
 		data_system = locate_data_system()
 		task_system = locate_task_system()
 
-		for tweet_id in data_system.get_recent_tweets(self.id):
-			task_system.put_task(ScanTweet(id=tweet_id))
+		for tweet in data_system.get_recent_tweets(self.id):
+			task_system.put_next(ScanTweet(id=int(tweet.id), tweet=tweet))
 
 		task_system.put_task(FollowersProcess(id=self.id))
 
-@dataclass
+@dataclass(slots=True)
 class FirstSightTweet(Task):
 	"""Checks if the tweet is on topic, and create appropriate tasks"""
 
+	lease_kind = "tweet"
 	id: int
 
+	@classmethod
+	def prefetch(cls, ids: list[int]):
+		locate_data_system().prefetch_tweets_processed(ids, locate_task_system().campaign.name)
+
 	def check(self) -> bool:
-		return not locate_data_system().is_tweet_processed(self.id)
+		return not locate_data_system().is_tweet_processed(self.id, locate_task_system().campaign.name)
 
 	def run(self):
 
@@ -142,53 +194,64 @@ class FirstSightTweet(Task):
 		if (tweet := data_system.get_tweet(self.id)) is None:
 			return
 
-		if tweet_is_on_topic(tweet):
-			task_system.put_task(ScanTweet(id=self.id))
+		if task_system.campaign.is_on_topic(tweet):
+			task_system.put_next(ScanTweet(id=self.id, tweet=tweet))
 
 		if (tweet_id := is_retweet(tweet)) is not None:
 			task_system.put_task(FirstSightTweet(id=tweet_id))
 
-		data_system.tag_tweet_processed(self.id)
+		data_system.tag_tweet_processed(self.id, task_system.campaign.name)
 
-@dataclass
+@dataclass(slots=True)
 class ScanTweet(Task):
 	"""Creates appropriate tasks, assuming the tweet's author is on topic"""
 
+	lease_kind = "tweet"
 	id: int
+	tweet: Optional[tweepy.Tweet] = field(default=None, repr=False, compare=False)
+
+	def without_prefetched(self) -> Task:
+		return replace(self, tweet=None)
 
 	def run(self):
 		
 		data_system = locate_data_system()
 		task_system = locate_task_system()
 
-		if (tweet := data_system.get_tweet(self.id)) is None:
+		if (tweet := self.tweet or data_system.get_tweet(self.id)) is None:
 			return
 
 		task_system.put_task(FirstSightUser(id=int(tweet.author_id)))
-		task_system.put_task(MentionsProcess(id=self.id))
+		task_system.put_next(MentionsProcess(id=self.id, tweet=tweet))
 
-@dataclass
+@dataclass(slots=True)
 class MentionsProcess(Task):
 	"""Checks mentions and starts processing of mentionned users, assuming the author is on topic"""
 
+	lease_kind = "tweet"
 	id: int
+	tweet: Optional[tweepy.Tweet] = field(default=None, repr=False, compare=False)
+
+	def without_prefetched(self) -> Task:
+		return replace(self, tweet=None)
 
 	def run(self):
 
 		data_system = locate_data_system()
 		task_system = locate_task_system()
 
-		if (tweet := data_system.get_tweet(self.id)) is None:
+		if (tweet := self.tweet or data_system.get_tweet(self.id)) is None:
 			return
 
-		for username in get_mentions(tweet):
-			if (user_id := data_system.get_id(username)) is not None:
+		for user_id in data_system.get_ids(get_mentions(tweet)).values():
+			if user_id is not None:
 				task_system.put_task(FirstSightUser(id=user_id))
 
-@dataclass
+@dataclass(slots=True)
 class FollowersProcess(Task):
 	"""Checks followers and process users, assuming the followed is on topic"""
 
+	lease_kind = "user"
 	id: int
 
 	def run(self):
@@ -199,6 +262,190 @@ class FollowersProcess(Task):
 		for follower_id in data_system.get_followers(self.id):
 			task_system.put_task(FirstSightUser(id=follower_id))
 
+# built-in tasks only hold an id, the queue stores them as a type code and that id
+BUILTIN_TASKS: tuple[type[Task], ...] = (FirstSightUser, ScanUser, FirstSightTweet, ScanTweet, MentionsProcess, FollowersProcess)
+_builtin_codes: dict[type[Task], int] = {cls: code for code, cls in enumerate(BUILTIN_TASKS, start=1)}
+_builtin_classes: dict[str, type[Task]] = {cls.__name__: cls for cls in BUILTIN_TASKS}
+_saved_pattern = re.compile(r"(\w+)\(id=(-?\d+)\)")
+_CUSTOM = 0
+
+@dataclass(frozen=True, slots=True)
+class Lineage:
+	"""Where a task comes from, in spans of the TaskSystem, see trace_system
+
+	parent is the span of the task that queued it, root the one of the task
+	its chain started from, depth the number of tasks from the root. Tasks
+	queued outside of any task, seeds included, have none and start a chain."""
+
+	parent: int = 0
+	root: int = 0
+	depth: int = 0
+
+NO_LINEAGE = Lineage()
+
+class TaskQueue:
+	"""FIFO of tasks, about 9 bytes per built-in task
+
+	Built-in tasks are stored as a type code in one array and their id in a
+	parallel one, their objects are only created when read. Other tasks are
+	kept as objects, by position. Popped slots are reclaimed in bulk once they
+	make up half of the arrays.
+
+	The Lineage of tasks is only kept once enable_lineage is called, in three
+	more arrays, about 20 bytes per task."""
+
+	def __init__(self):
+
+		self._codes = array("B")
+		self._ids = array("q")
+		self._custom: dict[int, Task] = {} # position -> task, positions count from the first task ever queued
+		self._head = 0 # index of the first pending task in the arrays
+		self._offset = 0 # position of the arrays' first slot
+		self._lineage: Optional[tuple[array, array, array]] = None # parents, roots and depths
+
+	def __len__(self) -> int:
+		return len(self._codes) - self._head
+
+	def __iter__(self) -> Iterator[Task]:
+
+		for index in range(self._head, len(self._codes)):
+			yield self._read(index)
+
+	def _read(self, index: int) -> Task:
+
+		if (code := self._codes[index]) == _CUSTOM:
+			return self._custom[self._offset + index]
+
+		return BUILTIN_TASKS[code - 1](id=self._ids[index]) #type: ignore
+
+	def enable_lineage(self):
+		"""keeps the lineage of tasks appended from now on, the ones already queued have none"""
+
+		if self._lineage is None:
+			size = len(self._codes)
+			self._lineage = (array("q", bytes(8*size)), array("q", bytes(8*size)), array("I", bytes(4*size)))
+
+	def _write(self, index: int, task: Task, lineage: Lineage = NO_LINEAGE):
+
+		if (code := _builtin_codes.get(type(task), _CUSTOM)) == _CUSTOM:
+			self._custom[self._offset + index] = task
+			self._ids[index] = 0
+
+		else:
+			self._ids[index] = task.id #type: ignore
+
+		self._codes[index] = code
+
+		if self._lineage is not None:
+			parents, roots, depths = self._lineage
+			parents[index], roots[index], depths[index] = lineage.parent, lineage.root, lineage.depth
+
+	def _grow(self):
+
+		self._codes.append(_CUSTOM)
+		self._ids.append(0)
+
+		if self._lineage is not None:
+			for values in self._lineage:
+				values.append(0)
+
+	def append(self, task: Task, lineage: Lineage = NO_LINEAGE):
+
+		self._grow()
+		self._write(len(self._codes) - 1, task, lineage)
+
+	def append_saved(self, saved: str):
+		"""appends a task in its saved form, without building built-in tasks"""
+
+		if (match := _saved_pattern.fullmatch(saved)) is not None and (cls := _builtin_classes.get(match.group(1))) is not None:
+			self._grow()
+			self._codes[-1] = _builtin_codes[cls]
+			self._ids[-1] = int(match.group(2))
+
+		else:
+			self.append(Task.load(saved))
+
+	def ahead(self, amount: int) -> Iterator[tuple[type[Task], int]]:
+		"""class and id of the next built-in tasks, within the first amount tasks"""
+
+		for index in range(self._head, min(self._head + amount, len(self._codes))):
+			if (code := self._codes[index]) != _CUSTOM:
+				yield BUILTIN_TASKS[code - 1], self._ids[index]
+
+	def peek(self) -> Task:
+
+		if not self:
+			raise IndexError("peek from an empty TaskQueue")
+
+		return self._read(self._head)
+
+	def peek_lineage(self) -> Lineage:
+
+		if self._lineage is None or not self:
+			return NO_LINEAGE
+
+		parents, roots, depths = self._lineage
+		return Lineage(parents[self._head], roots[self._head], depths[self._head])
+
+	def drop(self, amount: int = 1):
+		"""removes amount tasks from the head"""
+		self.replace_head(amount, [])
+
+	def replace_head(self, amount: int, tasks: list[Task]):
+		"""replaces the amount tasks at the head with tasks, which must not be more and lose their lineage"""
+
+		amount = min(amount, len(self))
+
+		if len(tasks) > amount:
+			raise ValueError("replace_head cannot grow the queue")
+
+		for index in range(self._head, self._head + amount):
+			if self._codes[index] == _CUSTOM:
+				del self._custom[self._offset + index]
+
+		self._head += amount - len(tasks)
+
+		for index, task in enumerate(tasks, start=self._head):
+			self._write(index, task)
+
+		if self._head > len(self._codes)//2:
+
+			for values in (self._codes, self._ids, *(self._lineage or ())):
+				del values[:self._head]
+
+			self._offset += self._head
+			self._head = 0
+
+	def save(self) -> list[str]:
+		return [task.save() for task in self]
+
+@dataclass
+class Campaign:
+	"""A topic crawled by the TaskSystem, with its own frontier and processed flags"""
+
+	name: str
+	keywords: list[str]
+	share: float = 1.0
+	tasks: TaskQueue = field(default_factory=TaskQueue, repr=False)
+	spent: float = 0.0 # api calls charged to the campaign, see TaskSystem.charge
+
+	def is_on_topic(self, tweet: tweepy.Tweet) -> bool:
+		return text_is_on_topic(str(tweet.text), self.keywords)
+
+	@property
+	def usage(self) -> float:
+		return self.spent/self.share
+
+def configured_campaigns() -> list[Campaign]:
+
+	if not task_system_config.campaigns:
+		return [Campaign(name=DEFAULT_CAMPAIGN, keywords=list(task_system_config.keywords))]
+
+	return [
+		Campaign(name=name, keywords=list(campaign["keywords"]), share=float(campaign.get("share", 1.0)))
+		for name, campaign in task_system_config.campaigns.items()
+	]
+
 def archive_task_file(file: Path):
 	shutil.copy(file, task_system_config.tasks_archive_dir/f"{time.time()}.json")
 
@@ -234,19 +481,66 @@ class ChargeReport(TaskSystemEvent):
 
 	pending_tasks: int
 
+@dataclass
+class ParkedTasks(TaskSystemError):
+	"""tasks of a campaign missing from task_system_config.campaigns, kept aside and saved again"""
+
+	campaign: str
+	amount: int
+
+T = TypeVar("T")
+
+@dataclass(slots=True)
+class TaskMetrics:
+	"""metrics of a task class, resolved once since they are recorded for every task"""
+
+	check: Histogram
+	run: Histogram
+	rejected: Counter
+	fused: Counter
+
+	@staticmethod
+	def of(task_name: str) -> TaskMetrics:
+		return TaskMetrics(
+			check=Metrics.histogram("task_check_seconds", "Time spent in Task.check per task class", task=task_name),
+			run=Metrics.histogram("task_run_seconds", "Time spent in Task.run per task class", task=task_name),
+			rejected=Metrics.counter("tasks_rejected_total", "Tasks discarded by Task.check", task=task_name),
+			fused=Metrics.counter("tasks_fused_total", "Tasks run inline by the task creating them", task=task_name),
+		)
+
+class TaskHookProtocol(Protocol):
+	"""Wraps the check and run phases of every task the TaskSystem works on"""
+
+	def around(self, task: Task, phase: str, f: Callable[[], T]) -> T: ...
+
 class TaskSystem(Herald[TaskSystemEvent]):
+	"""Runs the tasks of every campaign
+
+	Campaigns share the data system, so its cache and its api budget. Each
+	task goes to the campaign whose api calls are the lowest in proportion to
+	its share, and runs with that campaign as TaskSystem.campaign."""
 
 	tags = {"task_system",}
 
 	def __init__(self):
 
 		Herald.__init__(self)
-		self._tasks: list[Task] = []
+		self._campaigns = {campaign.name: campaign for campaign in configured_campaigns()}
+		self.campaign = next(iter(self._campaigns.values()))
+		self._parked: dict[str, list[str]] = {}
+		self._task_hooks: list[TaskHookProtocol] = []
+		self._local_execution = True
+		self._fusion_depth = 0
+		self._spans = itertools.count(1)
+		self.span = 0 # span of the running task, 0 between tasks
+		self.lineage = NO_LINEAGE # lineage of the running task, its root always set
+		self._queue_depth_metric = Metrics.gauge("task_queue_depth", "Pending tasks in the TaskSystem queue")
+		self._task_metrics: dict[type[Task], TaskMetrics] = {}
 
 		if task_system_config.tasks_file.exists():
 
 			self._load_tasks(task_system_config.tasks_file)
-			self._dispatch_event(LoadedTasks(amount=len(self._tasks)))
+			self._dispatch_event(LoadedTasks(amount=self.pending_tasks()))
 			archive_task_file(task_system_config.tasks_file)
 			task_system_config.tasks_file.unlink()
 
@@ -259,38 +553,252 @@ class TaskSystem(Herald[TaskSystemEvent]):
 
 			self._dispatch_event(ShuttingDown())
 
-			if self._tasks:
+			if self.pending_tasks() or self._parked:
 				self._save_tasks(task_system_config.tasks_file)
-				self._dispatch_event(DumpedTasks(amount=len(self._tasks)))
+				self._dispatch_event(DumpedTasks(amount=self.pending_tasks()))
+
+	def campaigns(self) -> list[Campaign]:
+		return list(self._campaigns.values())
+
+	def _saved_tasks(self) -> dict[str, list[str]]:
+		return self._parked | {name: campaign.tasks.save() for name, campaign in self._campaigns.items()}
+
+	def _add_saved_tasks(self, saved_tasks: list[str] | dict[str, list[str]]):
+		"""adds tasks in their saved form, a plain list being the tasks of the first campaign"""
+
+		if isinstance(saved_tasks, list):
+			saved_tasks = {self.campaign.name: saved_tasks}
+
+		for name, saved in saved_tasks.items():
+
+			if (campaign := self._campaigns.get(name)) is None:
+				self._parked.setdefault(name, []).extend(saved)
+				self._dispatch_event(ParkedTasks(campaign=name, amount=len(saved)))
+				continue
+
+			for task in saved:
+				campaign.tasks.append_saved(task)
+
+		self._queue_depth_metric.set(self.pending_tasks())
+
+	def handoff(self) -> dict:
+		"""state for the TaskSystem replacing this one on reload, tasks get rebuilt from their saved form"""
+		return {"tasks": self._saved_tasks(), "spent": {name: campaign.spent for name, campaign in self._campaigns.items()}}
+
+	def adopt(self, handoff: dict):
+
+		before = self.pending_tasks()
+		self._add_saved_tasks(handoff["tasks"])
+
+		for name, spent in handoff.get("spent", {}).items():
+			if name in self._campaigns:
+				self._campaigns[name].spent = spent
+
+		self._dispatch_event(LoadedTasks(amount=self.pending_tasks() - before))
 
 	def _save_tasks(self, file: Path):
-		json.dump([task.save() for task in self._tasks], open(file, "w", encoding="utf-8"), indent=4)
+		json.dump(self._saved_tasks(), open(file, "w", encoding="utf-8"), indent=4)
 
 	def _load_tasks(self, file: Path):
-		self._tasks = [Task.load(saved) for saved in json.load(open(file, "r", encoding="utf-8"))]
+		self._add_saved_tasks(json.load(open(file, "r", encoding="utf-8")))
+
+	def add_task_hook(self, hook: TaskHookProtocol):
+		self._task_hooks.append(hook)
+
+	def rem_task_hook(self, hook: TaskHookProtocol):
+		self._task_hooks.remove(hook)
+
+	def _call(self, task: Task, phase: str, f: Callable[[], T]) -> T:
+
+		for hook in reversed(self._task_hooks):
+			f = partial(hook.around, task, phase, f)
+
+		return f()
+
+	def enable_lineage(self):
+		"""queued tasks keep their Lineage from now on, see TaskQueue.enable_lineage"""
+
+		for campaign in self._campaigns.values():
+			campaign.tasks.enable_lineage()
+
+	def _child_lineage(self) -> Lineage:
+		"""lineage of a task created by the running one"""
+
+		if not self.span:
+			return NO_LINEAGE
+
+		return Lineage(parent=self.span, root=self.lineage.root, depth=self.lineage.depth + 1)
+
+	def set_local_execution(self, enabled: bool):
+		"""when disabled, queued tasks are left for another runner, see coordinator_system. Takes effect from the next task"""
+		self._local_execution = enabled
+
+	def _metrics(self, task: Task) -> TaskMetrics:
+
+		if (metrics := self._task_metrics.get(type(task))) is None:
+			metrics = self._task_metrics[type(task)] = TaskMetrics.of(task.__class__.__name__)
+
+		return metrics
+
+	def _work(self, task: Task, lineage: Lineage = NO_LINEAGE):
+
+		metrics = self._metrics(task)
+		previous = self.span, self.lineage
+		self.span = next(self._spans)
+		self.lineage = lineage if lineage.root else Lineage(root=self.span)
+
+		try:
+			with metrics.check.time():
+				worthy = self._call(task, "check", task.check)
+
+			if worthy:
+				self._dispatch_event(WorkingOnTask(task=task))
+
+				with metrics.run.time():
+					self._call(task, "run", task.run)
+
+			else:
+				metrics.rejected.inc()
+
+		finally:
+			self.span, self.lineage = previous
+
+	def _prefetch(self, campaign: Campaign):
+		"""lets upcoming built-in tasks read what their check needs in one go"""
+
+		ids: dict[type[Task], list[int]] = {}
+
+		for cls, id in campaign.tasks.ahead(task_system_config.check_lookahead):
+			ids.setdefault(cls, []).append(id)
+
+		for cls, class_ids in ids.items():
+			cls.prefetch(class_ids)
+
+	def _by_usage(self) -> list[Campaign]:
+		"""campaigns with pending tasks, the one furthest below its share first"""
+		return sorted((campaign for campaign in self._campaigns.values() if campaign.tasks), key=lambda campaign: campaign.usage)
+
+	def charge(self, campaign_name: str, api_calls: int):
+		"""counts api calls made for a campaign, a task without any still costs task_charge"""
+		self._campaigns[campaign_name].spent += api_calls + task_system_config.task_charge
 
 	def _tick(self):
+		"""Works on queued tasks until the tick's task or time budget is spent
+
+		The budget is checked between tasks, so a long task still runs alone,
+		and the Locator gets back control to update the other systems."""
+
+		if not (self._local_execution and self.pending_tasks()):
+			return
+
+		deadline = time.perf_counter() + task_system_config.tick_time_budget
+		data_system = locate_data_system()
+		prefetched: set[str] = set()
+		worked = 0
+
+		while self._local_execution and worked < task_system_config.tick_max_tasks and (campaigns := self._by_usage()):
+
+			self.campaign = campaign = campaigns[0]
+
+			if campaign.name not in prefetched:
+				prefetched.add(campaign.name)
+				self._prefetch(campaign)
+
+			api_calls = data_system.api_calls
+			self._work(campaign.tasks.peek(), campaign.tasks.peek_lineage())
+			campaign.tasks.drop()
+			self.charge(campaign.name, data_system.api_calls - api_calls)
+			worked += 1
+
+			if time.perf_counter() >= deadline:
+				break
+
+		self._queue_depth_metric.set(self.pending_tasks())
+		self._dispatch_event(ChargeReport(pending_tasks=self.pending_tasks()))
+
+	def take_tasks(self, amount: int, exclude: set[tuple[str, int]], lookahead: int = 1024) -> tuple[str, list[Task]]:
+		"""Pops up to amount tasks from the head of a campaign's queue, with the campaign's name
 
-		if self._tasks:
+		The campaign is the one furthest below its share having tasks to give.
+		Tasks whose lease_key is in exclude are skipped and keep their place."""
 
-			if self._tasks[0].check():
-				self._dispatch_event(WorkingOnTask(task=self._tasks[0]))
-				self._tasks[0].run()
+		for campaign in self._by_usage():
 
-			self._tasks.pop(0)
-			self._dispatch_event(ChargeReport(pending_tasks=len(self._tasks)))
+			taken: list[Task] = []
+			kept: list[Task] = []
+			scanned = 0
 
-	def put_task(self, task: Task):
+			for task in campaign.tasks:
 
-		self._tasks.append(task)
+				if len(taken) == amount or scanned == lookahead:
+					break
+
+				scanned += 1
+
+				if task.lease_key() in exclude:
+					kept.append(task)
+
+				else:
+					taken.append(task)
+
+			if taken:
+				campaign.tasks.replace_head(scanned, kept)
+				self._queue_depth_metric.set(self.pending_tasks())
+				self._dispatch_event(ChargeReport(pending_tasks=self.pending_tasks()))
+				return campaign.name, taken
+
+		return self.campaign.name, []
+
+	def pending_tasks(self) -> int:
+		return sum(len(campaign.tasks) for campaign in self._campaigns.values())
+
+	def put_next(self, task: Task):
+		"""Continues the running task's pipeline with task
+
+		Fused tasks (see task_system_config.fused_tasks) run right away, with
+		whatever the running task prefetched, up to max_fusion_depth stages deep.
+		Other tasks are queued like put_task does."""
+
+		if not is_fusable(task, self._fusion_depth):
+			self.put_task(task.without_prefetched())
+			return
+
+		self._metrics(task).fused.inc()
+		self._fusion_depth += 1
+
+		try:
+			self._work(task, self._child_lineage())
+
+		finally:
+			self._fusion_depth -= 1
+
+	def put_task(self, task: Task, campaign_name: Optional[str] = None):
+		"""queues task in the named campaign, by default the one of the running task"""
+
+		campaign = self.campaign if campaign_name is None else self._campaigns[campaign_name]
+
+		if not campaign.tasks:
+			# an idle campaign does not get to catch up on the usage it did not have
+			campaign.spent = max(campaign.spent, min((other.usage for other in self._by_usage()), default=0.0)*campaign.share)
+
+		campaign.tasks.append(task, self._child_lineage())
+		self._queue_depth_metric.set(self.pending_tasks())
 		self._dispatch_event(AddedTask(task=task))
-		self._dispatch_event(ChargeReport(pending_tasks=len(self._tasks)))
+		self._dispatch_event(ChargeReport(pending_tasks=self.pending_tasks()))
 
 tags = {"task_system"}
+requires = {"data_system"}
 
-def initialize():
+def initialize(handoff: Optional[dict] = None):
 
-	assert_tags(existing=Locator.loaded_tags, required={"data_system"})
+	assert_tags(existing=Locator.loaded_tags, required=requires)
 	task_system = TaskSystem()
+
+	if handoff is not None:
+		task_system.adopt(handoff)
+
 	Locator.add_observer(task_system)
 	Locator.add_system(task_system)
+
+def finalize() -> dict:
+	return locate_task_system().handoff()
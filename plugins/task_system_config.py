@@ -1,9 +1,32 @@
 
 from pathlib import Path
+from typing import Optional
 
 tasks_file = Path("tasks.json")
 tasks_archive_dir = Path("tasks_archive")
 if not tasks_archive_dir.exists(): tasks_archive_dir.mkdir()
 
+# pipeline stages run inline by the task creating them, with the tweet it already fetched,
+# instead of going through the queue. Only list stages making no api call with that tweet,
+# others would skip the frontier, the campaign budgets and the scheduling between campaigns
+fused_tasks: set[str] = {"ScanTweet"}
+max_fusion_depth = 1
+
+# each Update works on queued tasks until one of these budgets is spent, 1 task per Update when tick_max_tasks = 1
+tick_max_tasks = 256
+tick_time_budget = 0.02 # seconds
+check_lookahead = 512 # queued tasks whose check reads are prefetched at each tick
+
+# python -m plugins.task_system_reclassify
+reclassify_chunk_size = 5_000 # tweets per process pool job
+reclassify_processes: Optional[int] = None # defaults to the cpu count
+
 keywords: list[str] = [
 ]
+
+# several topics crawled at once, sharing the data system cache and api budget:
+# name -> {"keywords": [...], "share": weight of the campaign in api calls}.
+# When empty, a single campaign named "" crawls keywords. Only that campaign keeps its
+# processed flags in the users and tweets tables, the others in campaign_processed
+campaigns: dict[str, dict] = {}
+task_charge = 0.01 # api calls a task is charged on top of the ones it made
@@ -1,18 +1,26 @@
 
 from __future__ import annotations
-from typing import Protocol
+from typing import Optional, Protocol
 
 from locator import SystemProtocol
 from herald import HeraldProtocol
-from plugins.task_system import TaskSystemEvent
+from plugins.task_system import TaskHookProtocol, TaskSystemEvent
 
 class TaskProtocol(Protocol):
 
 	def run(self): ...
 	def save(self) -> str: ...
+	def lease_key(self) -> Optional[tuple[str, int]]: ...
 	@staticmethod
 	def load(saved: str) -> TaskProtocol: ...
 
 class TaskSystemProtocol(SystemProtocol, HeraldProtocol[TaskSystemEvent], Protocol):
 
-	def put_task(self, task: TaskProtocol): ...
+	def put_task(self, task: TaskProtocol, campaign_name: Optional[str] = None): ...
+	def put_next(self, task: TaskProtocol): ...
+	def pending_tasks(self) -> int: ...
+	def take_tasks(self, amount: int, exclude: set[tuple[str, int]], lookahead: int = 1024) -> tuple[str, list[TaskProtocol]]: ...
+	def charge(self, campaign_name: str, api_calls: int): ...
+	def set_local_execution(self, enabled: bool): ...
+	def add_task_hook(self, hook: TaskHookProtocol): ...
+	def rem_task_hook(self, hook: TaskHookProtocol): ...
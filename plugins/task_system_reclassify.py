@@ -0,0 +1,149 @@
+
+"""Reclassification of the stored corpus after a keywords change
+
+	python -m plugins.task_system_reclassify [--campaign NAME] [--previous-keywords KEYWORD ...]
+
+Streams every stored tweet out of data_system.db and matches its text against
+the keywords of a campaign, the first of task_system_config by default, in
+chunks spread over a process pool, without a single api call. For each tweet
+that is on topic now but was not with the previous keywords, and whose author
+had no tweet on topic before:
+
+	- the tweet is tagged processed for the campaign and a ScanTweet is queued
+	- its author is tagged processed for the campaign and a ScanUser is queued
+
+Tags are written through a DataSystem, which appends them to the change log.
+Queued tasks are appended to the campaign in tasks.json, which the TaskSystem
+loads on start, so run it while the crawler is stopped. Without
+--previous-keywords every on-topic tweet and author counts as new."""
+
+import argparse
+import json
+import multiprocessing
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+import plugins.data_system_config as data_system_config
+import plugins.task_system_config as task_system_config
+
+from plugins.data_system import Database, DataSystem, open_change_log
+from plugins.task_system import Campaign, ScanTweet, ScanUser, Task, configured_campaigns, text_is_on_topic
+
+@dataclass
+class Classification:
+	"""What a chunk of tweets contributes, see _classify"""
+
+	on_topic: list[tuple[int, int]] = field(default_factory=list) # (tweet, author), on topic now but not before
+	authors_before: set[int] = field(default_factory=set) # authors of a tweet on topic before
+
+def _classify(args: tuple[list[tuple[int, int, str]], list[str], list[str]]) -> Classification:
+
+	rows, keywords, previous_keywords = args
+	classification = Classification()
+
+	for tweet_id, author, text in rows:
+
+		before = bool(previous_keywords) and text_is_on_topic(text, previous_keywords)
+
+		if before:
+			classification.authors_before.add(author)
+
+		elif text_is_on_topic(text, keywords):
+			classification.on_topic.append((tweet_id, author))
+
+	return classification
+
+class Reclassifier:
+
+	def __init__(self, data_system: DataSystem, campaign: Campaign, previous_keywords: list[str]):
+
+		self._data_system = data_system
+		self._database = data_system.database
+		self._campaign = campaign.name
+		self._keywords = list(campaign.keywords)
+		self._previous_keywords = list(previous_keywords)
+
+	def _chunks(self) -> Iterable[tuple[list[tuple[int, int, str]], list[str], list[str]]]:
+
+		for rows in self._database.stream(
+			"SELECT DISTINCT id, author, coalesce(json_extract(data, '$.text'), '') FROM tweets",
+			batch_size=task_system_config.reclassify_chunk_size,
+		):
+			yield rows, self._keywords, self._previous_keywords
+
+	def run(self, processes: int) -> tuple[list[int], list[int]]:
+		"""returns the newly on topic tweets and their authors, leaving out authors on topic before"""
+
+		tweets: dict[int, int] = {}
+		authors_before: set[int] = set()
+
+		with multiprocessing.get_context("spawn").Pool(processes) as pool:
+			for classification in pool.imap(_classify, self._chunks()):
+
+				authors_before |= classification.authors_before
+				tweets.update(classification.on_topic)
+
+		# ScanUser already scanned every tweet of authors that were on topic
+		tweets = {tweet_id: author for tweet_id, author in tweets.items() if author not in authors_before}
+		return list(tweets), list(dict.fromkeys(tweets.values()))
+
+	def apply(self, tweets: list[int], authors: list[int]):
+		"""tags for the campaign through the DataSystem, so that the change log has them"""
+
+		self._data_system.tag_all_tweets_processed(tweets, self._campaign)
+		self._data_system.tag_all_processed(authors, self._campaign)
+
+def queue_tasks(file: Path, tasks: list[Task], campaign_name: str) -> int:
+	"""appends tasks to a campaign in a tasks file, skipping the ones already in it"""
+
+	content: list[str] | dict[str, list[str]] = json.load(open(file, "r", encoding="utf-8")) if file.exists() else {}
+
+	if isinstance(content, list):
+		# the tasks of the first campaign, see TaskSystem._add_saved_tasks
+		content = {configured_campaigns()[0].name: content}
+
+	saved = content.setdefault(campaign_name, [])
+	known = set(saved)
+	added = [task.save() for task in tasks if task.save() not in known]
+	saved += added
+	json.dump(content, open(file, "w", encoding="utf-8"), indent=4)
+	return len(added)
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--campaign", help="campaign of task_system_config whose keywords and processed flags are used, the first one by default")
+	parser.add_argument("--previous-keywords", nargs="*", default=[], help="keywords the corpus was crawled with")
+	parser.add_argument("--processes", type=int, default=task_system_config.reclassify_processes or os.cpu_count() or 1)
+	parser.add_argument("--dry-run", action="store_true", help="report without writing anything")
+	args = parser.parse_args()
+
+	campaigns = {campaign.name: campaign for campaign in configured_campaigns()}
+
+	if (campaign := campaigns.get(next(iter(campaigns)) if args.campaign is None else args.campaign)) is None:
+		parser.error(f"unknown campaign {args.campaign!r}, configured ones are {list(campaigns)}")
+
+	if not campaign.keywords:
+		parser.error(f"campaign {campaign.name!r} has no keywords")
+
+	# the pool reads the chunks from its task feeding thread
+	database = Database(data_system_config.data_system_file, check_same_thread=False)
+	data_system = DataSystem(database, None if args.dry_run else open_change_log())
+	reclassifier = Reclassifier(data_system, campaign, args.previous_keywords)
+	tweets, authors = reclassifier.run(args.processes)
+	queued = 0
+
+	if not args.dry_run:
+		reclassifier.apply(tweets, authors)
+		queued = queue_tasks(
+			task_system_config.tasks_file,
+			[ScanUser(id=id) for id in authors] + [ScanTweet(id=id) for id in tweets],
+			campaign.name,
+		)
+
+	print(json.dumps({"on_topic_tweets": len(tweets), "on_topic_authors": len(authors), "queued_tasks": queued}))
+
+if __name__ == "__main__":
+	main()
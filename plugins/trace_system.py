@@ -0,0 +1,131 @@
+
+"""Causal tracing of the crawl
+
+Every task run by the TaskSystem is a span, with its Lineage: the span of the
+task that created it, the one of the seed its chain started from and its depth.
+Api calls and database writes of the DataSystem are recorded against the span
+of the task making them. One json line per record, in traces_dir/<time>.jsonl:
+
+	{"kind": "task", "span": 7, "parent": 3, "root": 1, "depth": 2, "campaign": "", "task": "ScanUser(id=12)", "start": 1700000000.0, "seconds": 0.2}
+	{"kind": "api", "span": 7, "name": "get_users_tweets", "seconds": 0.15}
+	{"kind": "db", "span": 7, "name": "set_tweet", "seconds": 0.0004}
+
+A task's seconds include the tasks it ran inline. Records made outside of any
+task have span 0. Tasks run by coordinator_system workers are not traced, and
+tasks loaded from tasks.json or handed off on reload start new chains.
+
+Lines are written out at every Update, so a crash loses at most the records
+of the tick it happened in.
+
+See trace_system_analyze for the roll-up per seed and per task class."""
+
+import json
+import time
+from pathlib import Path
+from typing import Callable, TypeVar
+
+import plugins.trace_system_config as trace_system_config
+
+from locator import Exit, Locator, LocatorEvent, Update
+from plugin_loader import assert_tags
+from plugins.task_system import Task, TaskSystem, locate_data_system, locate_task_system
+
+T = TypeVar("T")
+
+class TraceSystem:
+	"""Writes spans of tasks, api calls and database writes, hooked into the task and data systems"""
+
+	tags = {"trace_system"}
+
+	def __init__(self, task_system: TaskSystem, file: Path):
+
+		self._task_system = task_system
+		self.file = file
+		self._out = open(file, "a", encoding="utf-8", buffering=trace_system_config.write_buffer_size)
+
+	def _record(self, record: dict):
+
+		if not self._out.closed:
+			self._out.write(json.dumps(record) + "\n")
+
+	def around(self, task: Task, phase: str, f: Callable[[], T]) -> T:
+
+		if phase != "run":
+			return f()
+
+		span, lineage = self._task_system.span, self._task_system.lineage
+		start = time.time()
+		begin = time.perf_counter()
+
+		try:
+			return f()
+
+		finally:
+			self._record({
+				"kind": "task", "span": span, "parent": lineage.parent, "root": lineage.root, "depth": lineage.depth,
+				"campaign": self._task_system.campaign.name, "task": task.save(),
+				"start": start, "seconds": time.perf_counter() - begin,
+			})
+
+	def around_call(self, kind: str, name: str, f: Callable[[], T]) -> T:
+
+		begin = time.perf_counter()
+		failed = True
+
+		try:
+			result = f()
+			failed = False
+			return result
+
+		finally:
+
+			record = {"kind": kind, "span": self._task_system.span, "name": name, "seconds": time.perf_counter() - begin}
+
+			if failed:
+				record["failed"] = True
+
+			self._record(record)
+
+	def flush(self):
+
+		if not self._out.closed:
+			self._out.flush()
+
+	def close(self):
+
+		if not self._out.closed:
+			self._out.close()
+
+	def on_event(self, event: LocatorEvent):
+
+		if isinstance(event, Update):
+			self.flush()
+
+		elif isinstance(event, Exit):
+			self.close()
+
+tags = {"trace_system"}
+requires = {"task_system", "data_system"}
+
+def initialize():
+
+	assert_tags(existing=Locator.loaded_tags, required=requires)
+	task_system = locate_task_system()
+	trace_system = TraceSystem(task_system, trace_system_config.traces_dir/f"{time.time()}.jsonl")
+	task_system.enable_lineage()
+	task_system.add_task_hook(trace_system)
+	locate_data_system().add_data_hook(trace_system)
+	Locator.add_system(trace_system)
+	Locator.add_observer(trace_system)
+
+def finalize():
+
+	if (trace_system := Locator.get_system({"trace_system"})) is not None:
+
+		if (task_system := Locator.get_system({"task_system"})) is not None:
+			task_system.rem_task_hook(trace_system) #type: ignore
+
+		if (data_system := Locator.get_system({"data_system"})) is not None:
+			data_system.rem_data_hook(trace_system) #type: ignore
+
+		trace_system.close() #type: ignore
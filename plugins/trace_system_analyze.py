@@ -0,0 +1,161 @@
+
+"""Roll-up of crawl traces, to find the seeds and task chains spending the api budget
+
+	python -m plugins.trace_system_analyze [FILE ...] [--by seed|task] [--top N]
+
+Reads trace files written by trace_system, all of trace_system_config.traces_dir
+by default, and sums per seed (the task a chain started from) or per task class:
+
+	tasks           tasks run
+	api_calls       api calls made, api_seconds their latency
+	db_writes       database writes, db_seconds their time
+	on_topic_users  distinct users found on topic, as ScanUser tasks run. Per task
+	                class, they count for the class of the task that found them
+	max_depth       of the chain, per seed
+	api_calls_per_on_topic_user
+
+Rows come sorted by api calls, the costliest first. Seeds whose chains spent
+many calls for few on-topic users are the branches worth pruning."""
+
+import argparse
+import json
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import plugins.trace_system_config as trace_system_config
+
+_scan_user_pattern = re.compile(r"ScanUser\(id=(-?\d+)\)")
+
+@dataclass
+class Rollup:
+
+	tasks: int = 0
+	api_calls: int = 0
+	api_seconds: float = 0.0
+	db_writes: int = 0
+	db_seconds: float = 0.0
+	on_topic_users: set[int] = field(default_factory=set)
+	max_depth: int = 0
+
+	def to_json(self) -> dict:
+		return {
+			"tasks": self.tasks,
+			"api_calls": self.api_calls,
+			"api_seconds": round(self.api_seconds, 3),
+			"db_writes": self.db_writes,
+			"db_seconds": round(self.db_seconds, 3),
+			"on_topic_users": len(self.on_topic_users),
+			"max_depth": self.max_depth,
+			"api_calls_per_on_topic_user": round(self.api_calls/len(self.on_topic_users), 2) if self.on_topic_users else None,
+		}
+
+@dataclass
+class SpanTask:
+
+	root: tuple[int, int]
+	parent: tuple[int, int]
+	depth: int
+	task: str
+
+def task_class(saved: str) -> str:
+	return saved.split("(", 1)[0]
+
+class TraceAnalysis:
+	"""Spans of several trace files, span ids being keyed by file since each run counts from 1"""
+
+	def __init__(self):
+
+		self._tasks: dict[tuple[int, int], SpanTask] = {}
+		self._calls: dict[tuple[int, int], Counter[str]] = {}
+
+	def add_file(self, index: int, lines: Iterable[str]):
+
+		for line in lines:
+
+			record = json.loads(line)
+			span = (index, record["span"])
+
+			if record["kind"] == "task":
+				self._tasks[span] = SpanTask(
+					root=(index, record["root"]),
+					parent=(index, record["parent"]),
+					depth=record["depth"],
+					task=record["task"],
+				)
+
+			else:
+				calls = self._calls.setdefault(span, Counter())
+				calls[record["kind"]] += 1
+				calls[record["kind"] + "_seconds"] += record["seconds"]
+
+	def _rollup(self, key_of: Callable[[tuple[int, int], SpanTask], Optional[str]]) -> dict[str, Rollup]:
+
+		rollups: dict[str, Rollup] = {}
+
+		for span, span_task in self._tasks.items():
+
+			if (key := key_of(span, span_task)) is None:
+				continue
+
+			rollup = rollups.setdefault(key, Rollup())
+			rollup.tasks += 1
+			rollup.max_depth = max(rollup.max_depth, span_task.depth)
+			calls = self._calls.get(span, Counter())
+			rollup.api_calls += int(calls["api"])
+			rollup.api_seconds += calls["api_seconds"]
+			rollup.db_writes += int(calls["db"])
+			rollup.db_seconds += calls["db_seconds"]
+
+		return rollups
+
+	def _label(self, span: tuple[int, int]) -> str:
+		return self._tasks[span].task if span in self._tasks else f"span {span[1]} of file {span[0]}"
+
+	def by_seed(self) -> dict[str, Rollup]:
+
+		rollups = self._rollup(lambda span, span_task: self._label(span_task.root))
+
+		for span_task in self._tasks.values():
+			if (match := _scan_user_pattern.fullmatch(span_task.task)) is not None:
+				rollups[self._label(span_task.root)].on_topic_users.add(int(match.group(1)))
+
+		return rollups
+
+	def by_task(self) -> dict[str, Rollup]:
+
+		rollups = self._rollup(lambda span, span_task: task_class(span_task.task))
+
+		for span_task in self._tasks.values():
+			if (match := _scan_user_pattern.fullmatch(span_task.task)) is not None and span_task.parent in self._tasks:
+				finder = task_class(self._tasks[span_task.parent].task)
+				rollups.setdefault(finder, Rollup()).on_topic_users.add(int(match.group(1)))
+
+		return rollups
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("files", nargs="*", type=Path, help="trace files, all of traces_dir by default")
+	parser.add_argument("--by", choices=("seed", "task"), default="seed")
+	parser.add_argument("--top", type=int, default=20, help="rows printed, 0 for all")
+	args = parser.parse_args()
+
+	analysis = TraceAnalysis()
+
+	for index, file in enumerate(args.files or sorted(trace_system_config.traces_dir.glob("*.jsonl"))):
+		with open(file, "r", encoding="utf-8") as f:
+			analysis.add_file(index, f)
+
+	rollups = analysis.by_seed() if args.by == "seed" else analysis.by_task()
+	rows = sorted(rollups.items(), key=lambda item: item[1].api_calls, reverse=True)
+
+	if args.top:
+		rows = rows[:args.top]
+
+	print(json.dumps({key: rollup.to_json() for key, rollup in rows}, indent=4))
+
+if __name__ == "__main__":
+	main()
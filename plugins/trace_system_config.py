@@ -0,0 +1,6 @@
+
+from pathlib import Path
+
+traces_dir = Path("traces")
+if not traces_dir.exists(): traces_dir.mkdir()
+write_buffer_size = 1 << 16 # bytes of trace lines buffered, they are also written out at every Update